@@ -0,0 +1,273 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from db_connect import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_PRIMARY_DSN, DB_USER, RollbackOnly, db_logger
+from query_stats import DB_SLOW_QUERY_MS, DB_STATS_ENABLED, log_slow_query, query_stats
+
+# Async counterpart of db_connect for the asyncio service: psycopg 3 connections from one
+# AsyncConnectionPool, so a waiting query parks a coroutine instead of a thread.
+# There is no replica routing here yet: every statement goes to the primary, including the
+# reads PostgresConnection.reading() would send to DB_REPLICA_DSNS (see db_connect).
+ASYNC_POOL_MIN = int(os.getenv("ASYNC_POOL_MIN", "1"))
+ASYNC_POOL_MAX = int(os.getenv("ASYNC_POOL_MAX", "20"))
+ASYNC_POOL_TIMEOUT = float(os.getenv("ASYNC_POOL_TIMEOUT", os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30")))
+ASYNC_POOL_IDLE_TIMEOUT = float(os.getenv("ASYNC_POOL_IDLE_TIMEOUT", os.getenv("DB_POOL_IDLE_TIMEOUT", "300")))
+ASYNC_POOL_MAX_LIFETIME = float(os.getenv("ASYNC_POOL_MAX_LIFETIME", os.getenv("DB_POOL_MAX_LIFETIME", "3600")))
+
+
+def conninfo():
+    if DB_PRIMARY_DSN:
+        return DB_PRIMARY_DSN
+    return make_conninfo(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+
+
+async def connect():
+    # client-side binding keeps the psycopg2 %s / %(name)s statements usable verbatim
+    return await psycopg.AsyncConnection.connect(conninfo(), cursor_factory=psycopg.AsyncClientCursor)
+
+
+def make_async_pool(min_size=ASYNC_POOL_MIN, max_size=ASYNC_POOL_MAX):
+    """Unopened pool; await pool.open() inside the running event loop"""
+    return AsyncConnectionPool(
+        conninfo(),
+        min_size=min(min_size, max_size),
+        max_size=max_size,
+        timeout=ASYNC_POOL_TIMEOUT,
+        max_idle=ASYNC_POOL_IDLE_TIMEOUT,
+        max_lifetime=ASYNC_POOL_MAX_LIFETIME,
+        kwargs={"cursor_factory": psycopg.AsyncClientCursor},
+        open=False,
+    )
+
+
+class AsyncPostgresConnection:
+    """PostgresConnection with awaitable helpers; same scope semantics for transaction()."""
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.con = None
+        self.cur = None
+        self._scopes = []          # one entry per open transaction() scope: savepoint name or None
+        self._rollback_only = False
+        self._doomed = set()       # savepoints a nested rollback() returned to; undone again on scope exit
+        self.query_hooks = []      # hook(sql, params, elapsed, rowcount, error) after every statement
+        self._stream_seq = 0
+
+    async def __aenter__(self):
+        try:
+            if self.pool:
+                self.con = await self.pool.getconn()
+            else:
+                self.con = await connect()
+            self.cur = self.con.cursor()
+            return self
+        except Exception as e:
+            db_logger.error(f"Error connecting to database: {e}")
+            if self.pool and self.con:
+                await self.pool.putconn(self.con)
+            raise e
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.cur:
+            await self.cur.close()
+        if self.con:
+            if self.pool:
+                # the pool rolls back anything left open before handing the connection out again
+                await self.pool.putconn(self.con)
+            else:
+                await self.con.close()
+        self.cur = None
+        self.con = None
+
+    # --- Query timing ---
+    def add_query_hook(self, hook):
+        self.query_hooks.append(hook)
+
+    def remove_query_hook(self, hook):
+        if hook in self.query_hooks:
+            self.query_hooks.remove(hook)
+
+    async def _execute(self, query, params=None, cur=None):
+        cur = cur or self.cur
+        start = time.perf_counter()
+        error = None
+        try:
+            await cur.execute(query, params or None)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._after_query(cur, query, params, time.perf_counter() - start, error)
+
+    def _after_query(self, cur, sql, params, elapsed, error=None):
+        rowcount = cur.rowcount if error is None else -1
+        if DB_STATS_ENABLED:
+            query_stats.record(sql, params, elapsed, rowcount, error)
+        for hook in self.query_hooks:
+            try:
+                hook(sql, params, elapsed, rowcount, error)
+            except Exception:
+                db_logger.error("Query hook failed", exc_info=True)
+        if error is None and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+            log_slow_query(sql, params, elapsed, rowcount)
+
+    # --- Query Helpers ---
+    async def execute_query(self, query, params=None):
+        try:
+            await self._execute(query, params)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            db_logger.error(f"Error executing query: {e}")
+            return False
+
+    async def execute_many(self, query, params_seq):
+        start = time.perf_counter()
+        error = None
+        try:
+            await self.cur.executemany(query, params_seq)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._after_query(self.cur, query, None, time.perf_counter() - start, error)
+
+    async def fetch_one(self, query, params=None):
+        try:
+            await self._execute(query, params)
+            return await self.cur.fetchone()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            db_logger.error("Error fetching data", exc_info=True)
+            return None
+
+    async def fetch_all(self, query, params=None):
+        try:
+            await self._execute(query, params)
+            return await self.cur.fetchall()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            db_logger.error("Error fetching data", exc_info=True)
+            return []
+
+    @property
+    def rowcount(self):
+        return self.cur.rowcount
+
+    # --- Streaming ---
+    async def stream(self, query, params=None, batch_size=2000):
+        """Yield rows through a server-side cursor, batch_size rows per round trip.
+        Must be consumed inside the transaction that opened it."""
+        self._stream_seq += 1
+        cur = self.con.cursor(name=f"stream_{id(self)}_{self._stream_seq}")
+        cur.itersize = batch_size
+        try:
+            await self._execute(query, params, cur)
+            async for row in cur:
+                yield row
+        finally:
+            await cur.close()
+
+    async def commit(self):
+        if self._scopes:
+            # the outermost transaction() scope commits
+            return
+        try:
+            await self.con.commit()
+        except Exception:
+            db_logger.error("Error commiting", exc_info=True)
+
+    async def rollback(self):
+        """PostgresConnection.rollback: back to the nearest enclosing savepoint, RollbackOnly
+        from a nested scope without one"""
+        savepoint = next((name for name in reversed(self._scopes) if name), None)
+        if savepoint is None and len(self._scopes) > 1:
+            self._rollback_only = True
+            raise RollbackOnly("Rollback inside a nested transaction scope without a savepoint")
+        try:
+            if savepoint:
+                await self.cur.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                if savepoint != self._scopes[-1]:
+                    # inner scopes keep running; whatever they do next goes too
+                    self._doomed.add(savepoint)
+                return
+            await self.con.rollback()
+            if self._scopes:
+                # the unit of work is gone; make sure nothing after this gets committed
+                self._rollback_only = True
+        except Exception:
+            db_logger.error("Error rolling back", exc_info=True)
+
+    # --- Unit of work ---
+    @asynccontextmanager
+    async def transaction(self, savepoint=False):
+        """Transaction scope: the outermost scope commits once, nested scopes join it
+        or, with savepoint=True, can be rolled back on their own."""
+        outermost = not self._scopes
+        name = None
+        if outermost:
+            self._rollback_only = False
+            self._doomed.clear()
+        elif savepoint:
+            name = f"uow_{len(self._scopes)}"
+            await self.cur.execute(f"SAVEPOINT {name}")
+        self._scopes.append(name)
+        try:
+            yield self
+        except BaseException:
+            self._scopes.pop()
+            if outermost:
+                self._rollback_only = False
+                await self.con.rollback()
+            elif name:
+                self._doomed.discard(name)
+                await self.cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                await self.cur.execute(f"RELEASE SAVEPOINT {name}")
+            else:
+                self._rollback_only = True
+            raise
+        else:
+            self._scopes.pop()
+            if outermost:
+                if self._rollback_only:
+                    self._rollback_only = False
+                    await self.con.rollback()
+                else:
+                    await self.con.commit()
+            elif name:
+                if name in self._doomed:
+                    self._doomed.discard(name)
+                    await self.cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                await self.cur.execute(f"RELEASE SAVEPOINT {name}")
+
+    @property
+    def in_transaction(self):
+        return bool(self._scopes)
+
+    @property
+    def rollback_only(self):
+        """The open transaction can no longer commit; its outermost scope will roll it back"""
+        return self._rollback_only
+
+
+def pool_stats(pool):
+    """AsyncConnectionPool counters under the names ConnectionPool.stats() uses"""
+    stats = pool.get_stats()
+    return {
+        "size": stats.get("pool_size", 0),
+        "idle": stats.get("pool_available", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "min_size": stats.get("pool_min", pool.min_size),
+        "max_size": stats.get("pool_max", pool.max_size),
+        "waiting": stats.get("requests_waiting", 0),
+        "checkouts": stats.get("requests_num", 0),
+        "timeouts": stats.get("requests_errors", 0),
+        "connects": stats.get("connections_num", 0),
+    }
@@ -0,0 +1,660 @@
+import asyncio
+import json
+import time
+from audit_log import AUDIT_INSERT_SQL, AUDIT_KEYSET, AUDIT_PAGE_SQL, get_audit_writer
+from bus import (BUS_AVAILABILITY_TTL, BUS_SELECT, BUSES_PAGE_KEYSET, BUSES_PAGE_SQL, TRIP_SCHEMA_SQL, TRIP_SOURCE_SQL,
+                 TRIP_STOPS_DELETE_SQL, TRIP_STOPS_INSERT_SQL, TRIP_UPDATE_SQL, BusManager, bus_cache,
+                 parse_seat_preferences, seat_order_sql, trip_sync_params)
+from counters import LIVE_SEATS_SQL
+from db_connect import db_logger
+from pagination import InvalidCursor, afetch_page
+from reports import LATEST_REPORT_SQL, SAVE_REPORT_SQL, watermark_query
+from rollups import ROLLUP_PURCHASE_SQL, status_change_query, totals_query, totals_row
+from search import (ROUTE_CITIES_SQL, ROUTE_INDEX_TTL, ROUTE_PAIRS_SQL, SEARCH_KEYSET, SEARCH_MIN_SEATS, RouteIndex,
+                    search_query, trip_row)
+from seat_map import SEAT_INVENTORY, BitmapBusManager, SeatBitmap
+from ticket import (ANY_SEAT_RETRIES, CANCEL_TICKET_SELECT_SQL, CANCEL_TICKET_SQL, PURCHASE_BUS_NOT_FOUND,
+                    PURCHASE_DEBIT_CONDITION, PURCHASE_ERROR, PURCHASE_INSUFFICIENT_FUNDS, PURCHASE_MESSAGES,
+                    PURCHASE_OK, PURCHASE_QUERY, PURCHASE_SEAT_NOT_FOUND, PURCHASE_SEAT_TAKEN, PURCHASE_SOLD_OUT,
+                    USER_TICKETS_KEYSET, USER_TICKETS_PAGE_SQL, TicketManager, purchase_outcome, refund_amount)
+from users import EMAIL_EXISTS_SQL, LOGIN_SQL, REGISTER_SQL, user_from_row
+from wallet import (TRANSACTIONS_KEYSET, TRANSACTIONS_PAGE_SQL, WALLET_ERROR, WALLET_INSUFFICIENT_FUNDS,
+                    WALLET_INVALID_AMOUNT, WALLET_OK, WALLET_USER_NOT_FOUND, WalletManager, to_amount)
+from wallet_ledger import WALLET_MODE, LedgerWalletManager
+
+# Async managers over an AsyncPostgresConnection. Statements, result codes and row
+# mapping come from the sync managers so both layers behave the same; the sync
+# classes also pick the seat inventory and wallet variant (their SQL fragments).
+
+
+class AsyncAuditLogger:
+    def __init__(self, db, writer=None):
+        self.db = db
+        self.writer = writer or get_audit_writer()
+
+    async def log(self, actor_id, action):
+        if self.writer:
+            if self.writer.overflow == "drop":
+                self.writer.submit(actor_id, action)
+            else:
+                # a full queue blocks for up to block_timeout; keep that off the event loop
+                await asyncio.to_thread(self.writer.submit, actor_id, action)
+            return
+        try:
+            async with self.db.transaction():
+                await self.db.execute_query(AUDIT_INSERT_SQL, (actor_id, action))
+        except Exception:
+            db_logger.exception("Error Logging action")
+
+    async def get_logs_page(self, page_size=None, cursor=None, since=None):
+        try:
+            rows, next_cursor = await afetch_page(self.db, "audit", AUDIT_PAGE_SQL, (since,), cursor, page_size, *AUDIT_KEYSET)
+            items = [
+                {"log_id": log_id, "actor_id": actor_id, "action": action, "timestamp": timestamp}
+                for log_id, actor_id, action, timestamp in rows
+            ]
+            return {"items": items, "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error fetching audit logs page")
+            return {"items": [], "next_cursor": None}
+
+
+class AsyncUserManager:
+    def __init__(self, db):
+        self.db = db
+
+    async def register_user(self, name, email, password):
+        try:
+            if await self.db.fetch_one(EMAIL_EXISTS_SQL, (email,)):
+                db_logger.warning("Email already exists.")
+                return False
+            async with self.db.transaction():
+                success = await self.db.execute_query(REGISTER_SQL, (name, email, password, False, 0))
+            if success:
+                db_logger.info(f"User {name} registered successfully!")
+            return success
+        except Exception:
+            db_logger.exception("Faild while registring user")
+            return False
+
+    async def login_user(self, email, password):
+        try:
+            result = await self.db.fetch_one(LOGIN_SQL, (email,))
+            if not result:
+                db_logger.error("User not found")
+                return None
+            return user_from_row(result, password)
+        except Exception:
+            db_logger.exception("Login failed")
+            return None
+
+
+class AsyncBusManager:
+    """Async BusManager; inventory is the sync class whose seat SQL it runs (rows or bitmap)"""
+
+    def __init__(self, db, inventory=None, cache=None, availability_ttl=BUS_AVAILABILITY_TTL):
+        self.db = db
+        if inventory is None:
+            inventory = BitmapBusManager if SEAT_INVENTORY == "bitmap" else BusManager
+        self.inventory = inventory
+        self.SEAT_CLAIM_SQL = inventory.SEAT_CLAIM_SQL
+        self.SEAT_EXISTS_SQL = inventory.SEAT_EXISTS_SQL
+        self.BUS_EXISTS_SQL = inventory.BUS_EXISTS_SQL
+        self.cache = cache if cache is not None else bus_cache
+        self.availability_ttl = availability_ttl
+
+    def any_seat_claim_sql(self, preferences=()):
+        return self.inventory.ANY_SEAT_CLAIM_SQL.format(order=seat_order_sql(preferences, self.inventory.ANY_SEAT_COLUMN))
+
+    # --- Add bus ---
+    async def add_bus(self, admin_id, bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route):
+        try:
+            bitmap = self.inventory.SEAT_INVENTORY == "bitmap"
+            query = """INSERT INTO buses (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route, available_seats, seat_map)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                       ON CONFLICT (bus_number) DO NOTHING RETURNING bus_id"""
+            seat_map = SeatBitmap(total_seats).to_bytes() if bitmap else None
+            async with self.db.transaction():
+                result = await self.db.fetch_one(query, (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route, total_seats, seat_map))
+                if not result:
+                    await self.db.rollback()
+                    db_logger.error("Bus number already exists")
+                    return False
+                if not bitmap:
+                    await self.db.execute_query(
+                        "INSERT INTO seats (bus_id, seat_number) SELECT %s, generate_series(1, %s)",
+                        (result[0], total_seats)
+                    )
+                await self.sync_trips([result[0]])
+            self.cache.invalidate(("buses",), ("routes",))
+            db_logger.info(f"Bus '{bus_name}' added successfully with {total_seats} seats.")
+            return True
+        except Exception:
+            db_logger.exception(f"Error adding bus: {bus_name}", exc_info=True)
+            return False
+
+    # --- Cached reads (same cache entries as BusManager) ---
+    async def _with_fresh_counts(self, entry):
+        now = time.monotonic()
+        if now - entry["counted_at"] > self.availability_ttl:
+            bus_ids = [b["bus_id"] for b in entry["buses"]]
+            counts = dict(await self.db.fetch_all(
+                f"SELECT b.bus_id, {LIVE_SEATS_SQL} FROM buses b WHERE b.bus_id = ANY(%s)", (bus_ids,)
+            ))
+            for b in entry["buses"]:
+                b["available_seats"] = counts.get(b["bus_id"], b["available_seats"])
+            entry["counted_at"] = now
+        return [dict(b) for b in entry["buses"]]
+
+    async def get_all_buses(self):
+        entry = self.cache.get(("buses",))
+        if entry is None:
+            try:
+                buses = [BusManager._bus_row(row) for row in await self.db.fetch_all(BUS_SELECT + " ORDER BY departure_time")]
+            except Exception:
+                db_logger.exception("Error getting buses", exc_info=True)
+                return []
+            if buses:
+                self.cache.set(("buses",), {"counted_at": time.monotonic(), "buses": buses})
+            return [dict(b) for b in buses]
+        return await self._with_fresh_counts(entry)
+
+    async def get_bus_by_id(self, bus_id):
+        entry = self.cache.get(("bus", bus_id))
+        if entry is None:
+            try:
+                result = await self.db.fetch_one(BUS_SELECT + " WHERE b.bus_id=%s", (bus_id,))
+            except Exception:
+                db_logger.exception(f"Error getting bus: {bus_id}", exc_info=True)
+                return None
+            if not result:
+                db_logger.info("Bus not found")
+                return None
+            bus = BusManager._bus_row(result)
+            self.cache.set(("bus", bus_id), {"counted_at": time.monotonic(), "buses": [bus]})
+            return dict(bus)
+        return (await self._with_fresh_counts(entry))[0]
+
+    def invalidate_cache(self, bus_id=None):
+        if bus_id is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(("buses",), ("bus", bus_id), ("routes",))
+
+    async def sync_trips(self, bus_ids):
+        if not BusManager._trips_ready:
+            row = await self.db.fetch_one(TRIP_SCHEMA_SQL)
+            BusManager._trips_ready = bool(row and row[0])
+            if not BusManager._trips_ready:
+                return 0
+        rows = await self.db.fetch_all(TRIP_SOURCE_SQL + " WHERE bus_id = ANY(%s)", (list(bus_ids),))
+        trips, stops = trip_sync_params(rows)
+        await self.db.execute_query(TRIP_UPDATE_SQL, trips)
+        await self.db.execute_query(TRIP_STOPS_DELETE_SQL, (trips[0],))
+        await self.db.execute_query(TRIP_STOPS_INSERT_SQL, stops)
+        return len(rows)
+
+    async def get_buses_page(self, page_size=None, cursor=None):
+        try:
+            rows, next_cursor = await afetch_page(self.db, "buses", BUSES_PAGE_SQL, (), cursor, page_size, *BUSES_PAGE_KEYSET)
+            return {"items": [BusManager._bus_row(row) for row in rows], "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error fetching buses page", exc_info=True)
+            return {"items": [], "next_cursor": None}
+
+    # --- Seats ---
+    async def get_available_seats(self, bus_id):
+        try:
+            rows = await self.db.fetch_all(self.inventory.FREE_SEATS_SQL, (bus_id,))
+            return [{"seat_id": s_id, "seat_number": num} for s_id, num in rows]
+        except Exception:
+            db_logger.exception("Error fetching seats", exc_info=True)
+            return []
+
+    async def resolve_seat(self, bus_id, seat_number):
+        try:
+            result = await self.db.fetch_one(self.inventory.RESOLVE_SEAT_SQL, {"bus_id": bus_id, "seat_number": seat_number})
+            return BusManager._seat_row(bus_id, seat_number, result) if result else None
+        except Exception:
+            db_logger.exception(f"Error resolving seat {seat_number} on bus {bus_id}", exc_info=True)
+            return None
+
+    async def current_price(self, bus_id):
+        try:
+            result = await self.db.fetch_one(self.inventory.PRICE_SQL, (bus_id,))
+            return result[0] if result else None
+        except Exception:
+            db_logger.exception(f"Error reading price of bus {bus_id}", exc_info=True)
+            return None
+
+    async def release_seat(self, bus_id, seat_id, seat_number):
+        params = {"bus_id": bus_id, "seat_id": seat_id, "seat_number": seat_number}
+        if not await self.db.fetch_one(self.inventory.RELEASE_SEAT_SQL, params):
+            db_logger.info("Seat not booked.")
+            return False
+        return True
+
+    async def count_free_seats(self, bus_id):
+        try:
+            result = await self.db.fetch_one(f"SELECT {LIVE_SEATS_SQL} FROM buses b WHERE b.bus_id=%s;", (bus_id,))
+            return result[0] if result and result[0] is not None else 0
+        except Exception:
+            db_logger.exception(f"Error counting free seats on bus {bus_id}", exc_info=True)
+            return 0
+
+
+class AsyncWalletManager:
+    """Async WalletManager; wallet is the sync class whose statements it runs (column or ledger)"""
+
+    def __init__(self, db, wallet=None):
+        self.db = db
+        self.wallet = wallet or (LedgerWalletManager if WALLET_MODE == "ledger" else WalletManager)
+        self.WALLET_MODE = self.wallet.WALLET_MODE
+        self.DEBIT_SQL = self.wallet.DEBIT_SQL
+        self.audit = AsyncAuditLogger(db)
+
+    async def _balance_exact(self, user_id):
+        row = await self.db.fetch_one(self.wallet.BALANCE_SQL, (user_id,))
+        return row[0] if row else None
+
+    async def debit(self, user_id, amount, type="Ticket purchase"):
+        try:
+            amount = to_amount(amount)
+        except ValueError:
+            return {"status": WALLET_INVALID_AMOUNT, "balance": None}
+        try:
+            async with self.db.transaction():
+                row = await self.db.fetch_one(self.wallet.DEBIT_QUERY, {"user_id": user_id, "amount": amount, "type": type})
+                if not row:
+                    return {"status": WALLET_ERROR, "balance": None}
+                debited, balance, user_exists = row
+                if not debited:
+                    return {"status": WALLET_INSUFFICIENT_FUNDS if user_exists else WALLET_USER_NOT_FOUND, "balance": None}
+                if balance is None:
+                    balance = await self._balance_exact(user_id)
+                await self.audit.log(user_id, f"Purchase: -{amount:.2f} ({type})")
+            return {"status": WALLET_OK, "balance": balance}
+        except Exception:
+            db_logger.exception(f"Error deducting balance for user {user_id}")
+            return {"status": WALLET_ERROR, "balance": None}
+
+    async def credit(self, user_id, amount, type="Wallet deposit", action="Deposit"):
+        try:
+            amount = to_amount(amount)
+        except ValueError:
+            return {"status": WALLET_INVALID_AMOUNT, "balance": None}
+        try:
+            async with self.db.transaction():
+                row = await self.db.fetch_one(self.wallet.CREDIT_QUERY, {"user_id": user_id, "amount": amount, "type": type})
+                if not row:
+                    return {"status": WALLET_USER_NOT_FOUND, "balance": None}
+                balance = row[0] if row[0] is not None else await self._balance_exact(user_id)
+                await self.audit.log(user_id, f"{action}: +{amount:.2f} ({type})")
+            return {"status": WALLET_OK, "balance": balance}
+        except Exception:
+            db_logger.exception(f"Error crediting balance for user {user_id}")
+            return {"status": WALLET_ERROR, "balance": None}
+
+    async def make_room(self, user_id, amount):
+        # shard consolidation stays on the sync LedgerWalletManager (service maintenance loop)
+        return False
+
+    async def add_balance(self, user_id, amount, type="Wallet deposit"):
+        result = await self.credit(user_id, amount, type, "Deposit")
+        return WalletManager._succeeded(result, "Added ${amount:.2f} to user {user_id} wallet.", amount, user_id)
+
+    async def deduct_balance(self, user_id, amount, type="Ticket purchase"):
+        result = await self.debit(user_id, amount, type)
+        return WalletManager._succeeded(result, "Deducted ${amount:.2f} from user {user_id} wallet.", amount, user_id)
+
+    async def refund_balance(self, user_id, amount, type="Ticket refund"):
+        result = await self.credit(user_id, amount, type, "Refund")
+        return WalletManager._succeeded(result, "Refunded ${amount:.2f} to user {user_id}.", amount, user_id)
+
+    async def get_balance(self, user_id):
+        try:
+            balance = await self._balance_exact(user_id)
+            return float(balance) if balance is not None else 0.0
+        except Exception:
+            db_logger.exception(f"Error fetching balance for user {user_id}")
+            return 0.0
+
+    async def get_transactions_page(self, user_id, page_size=None, cursor=None, since=None):
+        try:
+            rows, next_cursor = await afetch_page(
+                self.db, "transactions", TRANSACTIONS_PAGE_SQL, (user_id, since), cursor, page_size, *TRANSACTIONS_KEYSET
+            )
+            items = [
+                {"transaction_id": t_id, "type": t_type, "amount": float(amount), "timestamp": created}
+                for t_id, t_type, amount, created in rows
+            ]
+            return {"items": items, "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception(f"Error fetching transactions page for user {user_id}")
+            return {"items": [], "next_cursor": None}
+
+
+class AsyncTicketManager:
+    def __init__(self, db, bus_manager=None, wallet_manager=None):
+        self.db = db
+        self.bus_manager = bus_manager or AsyncBusManager(db)
+        self.wallet_manager = wallet_manager or AsyncWalletManager(db)
+        self.purchase_debit_sql = self.wallet_manager.DEBIT_SQL.format(condition=PURCHASE_DEBIT_CONDITION)
+        self.purchase_query = PURCHASE_QUERY.format(
+            seat_claim=self.bus_manager.SEAT_CLAIM_SQL,
+            seat_exists=self.bus_manager.SEAT_EXISTS_SQL,
+            rollup=ROLLUP_PURCHASE_SQL,
+            debit=self.purchase_debit_sql,
+        )
+        self._any_seat_queries = {}
+
+    async def buy_ticket(self, user_id, bus_id, seat_id, price, seat_number=None):
+        return (await self.purchase(user_id, bus_id, seat_id, price, seat_number))["status"] == PURCHASE_OK
+
+    async def purchase(self, user_id, bus_id, seat_id, price, seat_number=None):
+        params = TicketManager._purchase_params(user_id, bus_id, seat_id, price, seat_number)
+        return await self._run_purchase(self.purchase_query, params)
+
+    def _any_seat_query(self, preferences):
+        query = self._any_seat_queries.get(preferences)
+        if query is None:
+            query = self._any_seat_queries[preferences] = PURCHASE_QUERY.format(
+                seat_claim=self.bus_manager.any_seat_claim_sql(preferences),
+                seat_exists=self.bus_manager.BUS_EXISTS_SQL,
+                rollup=ROLLUP_PURCHASE_SQL,
+                debit=self.purchase_debit_sql,
+            )
+        return query
+
+    async def purchase_any_seat(self, user_id, bus_id, preferences=None, retries=ANY_SEAT_RETRIES):
+        try:
+            query = self._any_seat_query(parse_seat_preferences(preferences))
+        except ValueError as e:
+            db_logger.error(str(e))
+            return {"status": PURCHASE_ERROR, "ticket_id": None, "balance": None, "seat_number": None}
+
+        async with self.db.transaction():
+            price = await self.bus_manager.current_price(bus_id)
+            if price is None:
+                return {"status": PURCHASE_BUS_NOT_FOUND, "ticket_id": None, "balance": None, "seat_number": None}
+
+            params = TicketManager._purchase_params(user_id, bus_id, None, price, None)
+            for _ in range(retries + 1):
+                result = await self._run_purchase(query, params, quiet=True)
+                if result["status"] == PURCHASE_SEAT_NOT_FOUND:
+                    result["status"] = PURCHASE_BUS_NOT_FOUND
+                if result["status"] != PURCHASE_SEAT_TAKEN:
+                    break
+                if not await self.bus_manager.count_free_seats(bus_id):
+                    result["status"] = PURCHASE_SOLD_OUT
+                    break
+        if result["status"] == PURCHASE_SEAT_TAKEN:
+            result["status"] = PURCHASE_SOLD_OUT
+        if result["status"] in PURCHASE_MESSAGES:
+            db_logger.info(PURCHASE_MESSAGES[result["status"]])
+        return result
+
+    async def _run_purchase(self, query, params, quiet=False):
+        result = await self._purchase_once(query, params, quiet)
+        if result["status"] == PURCHASE_INSUFFICIENT_FUNDS and await self.wallet_manager.make_room(params["user_id"], params["amount"]):
+            result = await self._purchase_once(query, params, quiet)
+        return result
+
+    async def _purchase_once(self, query, params, quiet=False):
+        try:
+            async with self.db.transaction(savepoint=True):
+                row = await self.db.fetch_one(query, params)
+                if not row:
+                    await self.db.rollback()
+                    return {"status": PURCHASE_ERROR, "ticket_id": None, "balance": None, "seat_number": None}
+
+                ticket_id, balance, _, _, _, seat_number = row
+                status = purchase_outcome(row)
+                if status != PURCHASE_OK:
+                    await self.db.rollback()
+                    if not quiet:
+                        db_logger.info(PURCHASE_MESSAGES[status])
+                    return {"status": status, "ticket_id": None, "balance": None, "seat_number": None}
+
+            if balance is not None:
+                db_logger.info(f"Ticket purchased successfully! Remaining balance: ${balance:.2f}")
+            else:
+                db_logger.info("Ticket purchased successfully!")
+            return {"status": status, "ticket_id": ticket_id, "balance": balance, "seat_number": seat_number}
+        except Exception:
+            db_logger.exception("Error buying ticket")
+            return {"status": PURCHASE_ERROR, "ticket_id": None, "balance": None, "seat_number": None}
+
+    async def cancel_ticket(self, user_id, ticket_id, refund_percent=80):
+        try:
+            async with self.db.transaction():
+                ticket = await self.db.fetch_one(CANCEL_TICKET_SELECT_SQL, (ticket_id, user_id))
+                if not ticket:
+                    db_logger.info("Ticket not found")
+                    return False
+
+                status, price, bus_id, seat_id, seat_number, purchase_date = ticket
+                if status != "PAID":
+                    db_logger.error("Ticket cannot be cancelled!")
+                    return False
+
+                refund = refund_amount(price, refund_percent)
+                await self.db.execute_query(CANCEL_TICKET_SQL, (ticket_id,))
+                await self.db.execute_query(*status_change_query(bus_id, purchase_date, price, "PAID", "CANCELLED"))
+                if not await self.bus_manager.release_seat(bus_id, seat_id, seat_number):
+                    db_logger.error(f"Could not release the seat of ticket {ticket_id}")
+                    await self.db.rollback()
+                    return False
+
+                if refund > 0 and not await self.wallet_manager.refund_balance(user_id, refund, type="Ticket refund"):
+                    await self.db.rollback()
+                    return False
+
+            db_logger.info(f"Ticket cancelled. Refund: ${refund:.2f}")
+            return True
+        except Exception:
+            db_logger.exception("Error cancelling ticket")
+            return False
+
+    async def get_user_tickets_page(self, user_id, page_size=None, cursor=None, since=None):
+        try:
+            rows, next_cursor = await afetch_page(
+                self.db, "tickets", USER_TICKETS_PAGE_SQL, (user_id, since), cursor, page_size, *USER_TICKETS_KEYSET
+            )
+            return {"items": [TicketManager._ticket_row(row) for row in rows], "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error fetching tickets page")
+            return {"items": [], "next_cursor": None}
+
+
+class AsyncReportManager:
+    def __init__(self, db):
+        self.db = db
+        self.audit = AsyncAuditLogger(db)
+
+    async def _save_report(self, admin_id, report_type, details, params=None, watermark=None, result=None):
+        try:
+            async with self.db.transaction():
+                await self.db.execute_query(SAVE_REPORT_SQL, (report_type, admin_id, details, params, watermark, result))
+                await self.audit.log(admin_id, f"Generated report: {report_type}")
+        except Exception:
+            db_logger.exception(f"Error saving report: {report_type}")
+
+    async def _memoized(self, admin_id, report_type, params, compute, describe):
+        key = json.dumps(params, sort_keys=True)
+        result = await self.db.fetch_one(*watermark_query(params.get("bus_id")))
+        watermark = str(result[0]) if result else None
+        if watermark:
+            row = await self.db.fetch_one(LATEST_REPORT_SQL, (report_type, key))
+            if row and row[0] == watermark and row[1] is not None:
+                await self.audit.log(admin_id, f"Viewed report: {report_type}")
+                return json.loads(row[1])
+
+        value = await compute()
+        await self._save_report(admin_id, report_type, describe(value), key, watermark, json.dumps(value))
+        return value
+
+    async def _totals(self, bus_id=None):
+        return totals_row(await self.db.fetch_one(*totals_query(bus_id)))
+
+    async def get_total_revenue(self, admin_id):
+        try:
+            async def compute():
+                return (await self._totals())["revenue"]
+
+            return await self._memoized(
+                admin_id, "TOTAL_REVENUE", {}, compute,
+                lambda total: f"Total revenue from all tickets: ${total:.2f}",
+            )
+        except Exception:
+            db_logger.exception("Error fetching total revenue")
+            return 0.0
+
+    async def get_revenue_by_bus(self, admin_id, bus_id):
+        try:
+            async def compute():
+                return (await self._totals(bus_id))["revenue"]
+
+            return await self._memoized(
+                admin_id, "BUS_REVENUE", {"bus_id": bus_id}, compute,
+                lambda total: f"Revenue for bus {bus_id}: ${total:.2f}",
+            )
+        except Exception:
+            db_logger.exception("Error fetching bus revenue")
+            return 0.0
+
+    async def get_ticket_statistics(self, admin_id):
+        try:
+            async def compute():
+                totals = await self._totals()
+                return {"sold": totals["paid"], "cancelled": totals["cancelled"], "used": totals["used"]}
+
+            return await self._memoized(
+                admin_id, "TICKET_STATS", {}, compute,
+                lambda s: f"Tickets - Sold: {s['sold']}, Cancelled: {s['cancelled']}, Used: {s['used']}",
+            )
+        except Exception:
+            db_logger.exception("Error fetching ticket stats")
+            return {}
+
+    async def get_trip_statistics(self, admin_id):
+        try:
+            async def compute():
+                totals = await self._totals()
+                return {"trips": totals["trips"], "tickets": totals["paid"], "income": totals["revenue"]}
+
+            return await self._memoized(
+                admin_id, "TRIP_STATS", {}, compute,
+                lambda s: f"Trips: {s['trips']}, Tickets sold: {s['tickets']}, Income: ${s['income']:.2f}",
+            )
+        except Exception:
+            db_logger.exception("Error fetching trip stats")
+            return {}
+
+
+class AsyncSearchManager:
+    def __init__(self, db, cache=None):
+        self.db = db
+        self.cache = cache if cache is not None else bus_cache
+
+    async def search(self, origin=None, destination=None, date_from=None, date_to=None, min_seats=SEARCH_MIN_SEATS,
+                     max_price=None, page_size=None, cursor=None):
+        query, params = search_query(origin, destination, date_from, date_to, min_seats, max_price)
+        try:
+            rows, next_cursor = await afetch_page(self.db, "search", query, params, cursor, page_size, *SEARCH_KEYSET)
+            return {"items": [trip_row(row) for row in rows], "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error searching trips")
+            return {"items": [], "next_cursor": None}
+
+    async def route_index(self):
+        index = self.cache.get(("routes",))
+        if index is None:
+            index = RouteIndex(await self.db.fetch_all(ROUTE_CITIES_SQL), await self.db.fetch_all(ROUTE_PAIRS_SQL))
+            if index:
+                self.cache.set(("routes",), index, ROUTE_INDEX_TTL)
+        return index
+
+    async def complete(self, prefix="", limit=10, origin=None):
+        return (await self.route_index()).complete(prefix, limit, origin)
+
+
+class AsyncReservationSystem:
+    """BusReservationSystem's write paths and the managers the service operations use, awaitable"""
+
+    def __init__(self, db):
+        self.db = db
+        self.user_manager = AsyncUserManager(db)
+        self.bus_manager = AsyncBusManager(db)
+        self.wallet_manager = AsyncWalletManager(db)
+        self.ticket_manager = AsyncTicketManager(db, self.bus_manager, self.wallet_manager)
+        self.audit = AsyncAuditLogger(db)
+        self.report_manager = AsyncReportManager(db)
+        self.search_manager = AsyncSearchManager(db)
+
+    async def register(self, name, email, password):
+        return await self.user_manager.register_user(name, email, password)
+
+    async def login(self, email, password):
+        return await self.user_manager.login_user(email, password)
+
+    async def add_bus(self, admin_id, bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route):
+        success = await self.bus_manager.add_bus(admin_id, bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route)
+        if success:
+            await self.audit.log(admin_id, f"Bus added: {bus_name} ({bus_number})")
+        else:
+            db_logger.info(f"Failed to add bus: {bus_name} ({bus_number})")
+        return success
+
+    async def book_ticket(self, user_id, bus_id, seat_number):
+        seat = await self.bus_manager.resolve_seat(bus_id, seat_number)
+        if not seat:
+            db_logger.info("Bus not found.")
+            return False
+        if not seat["exists"]:
+            db_logger.info(f"Seat {seat_number} not found on bus {bus_id}.")
+            return False
+        if not seat["available"]:
+            db_logger.info("Seat not available.")
+            return False
+
+        success = await self.ticket_manager.buy_ticket(user_id, bus_id, seat["seat_id"], seat["price_per_seat"], seat_number)
+        if success:
+            await self.audit.log(user_id, f"Booked seat {seat_number} on bus {bus_id}")
+        else:
+            db_logger.info(f"Failed to book seat {seat_number} on bus {bus_id}")
+        return success
+
+    async def book_any_seat(self, user_id, bus_id, preferences=None):
+        result = await self.ticket_manager.purchase_any_seat(user_id, bus_id, preferences)
+        if result["ticket_id"]:
+            await self.audit.log(user_id, f"Booked seat {result['seat_number']} on bus {bus_id}")
+        else:
+            db_logger.info(f"Failed to book a seat on bus {bus_id}")
+        return result
+
+    async def cancel_ticket(self, user_id, ticket_id):
+        success = await self.ticket_manager.cancel_ticket(user_id, ticket_id)
+        if success:
+            await self.audit.log(user_id, f"Cancelled ticket {ticket_id}")
+        else:
+            db_logger.info(f"Failed to cancel ticket {ticket_id}")
+        return success
+
+    async def add_money(self, user_id, amount):
+        success = await self.wallet_manager.add_balance(user_id, amount, "Wallet deposit")
+        if success:
+            await self.audit.log(user_id, f"Wallet topped up by ${amount:.2f}")
+        else:
+            db_logger.info(f"Failed to add ${amount:.2f} to wallet for user {user_id}")
+        return success
@@ -1,32 +1,232 @@
+import atexit
+import csv
+import io
+import os
+import queue
+import threading
+import time
 from datetime import datetime
-from db_connect import db_logger
+from db_connect import connect, db_logger, replica_read
+from pagination import InvalidCursor, fetch_page
+
+# Buffered audit mode: AUDIT_BUFFERED=1 routes AuditLogger.log through one background AuditWriter
+AUDIT_BUFFERED = os.getenv("AUDIT_BUFFERED", "0") == "1"
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_MAX_QUEUE = int(os.getenv("AUDIT_MAX_QUEUE", "10000"))
+AUDIT_OVERFLOW = os.getenv("AUDIT_OVERFLOW", "block")  # "block" (backpressure) or "drop"
+AUDIT_BLOCK_TIMEOUT = float(os.getenv("AUDIT_BLOCK_TIMEOUT", "1.0"))
+
+_STOP = object()
+
+AUDIT_INSERT_SQL = "INSERT INTO audit_log (actor_id, action) VALUES (%s, %s)"
+AUDIT_PAGE_SQL = """
+    SELECT log_id, actor_id, action, timestamp FROM audit_log
+    WHERE timestamp >= COALESCE(%s, '-infinity'::timestamp) {after}
+    ORDER BY timestamp DESC, log_id DESC
+    LIMIT %s
+"""
+# plain timestamp bound so older monthly partitions are pruned, not just skipped by the index
+AUDIT_KEYSET = ("timestamp <= {0} AND (timestamp, log_id) < ({0}, {1})", lambda row: (row[3], row[0]))
+
+
+class AuditWriter:
+    """Queue of audit events drained by a background thread that COPYs them in batches"""
+
+    def __init__(self, pool=None, batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL,
+                 max_queue=AUDIT_MAX_QUEUE, overflow=AUDIT_OVERFLOW, block_timeout=AUDIT_BLOCK_TIMEOUT):
+        if overflow not in ("block", "drop"):
+            raise ValueError("overflow must be 'block' or 'drop'")
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._con = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "flushes": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def submit(self, actor_id, action):
+        if self._closed:
+            self._count("dropped")
+            return False
+        event = (actor_id, action, datetime.now())
+        try:
+            if self.overflow == "drop":
+                self._queue.put_nowait(event)
+            else:
+                self._queue.put(event, timeout=self.block_timeout)
+        except queue.Full:
+            self._count("dropped")
+            db_logger.warning("Audit queue full, dropping event")
+            return False
+        self._count("enqueued")
+        return True
+
+    # --- Background writer ---
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _checkout(self):
+        if self.pool:
+            return self.pool.getconn()
+        if self._con is None or self._con.closed:
+            self._con = connect()
+        return self._con
+
+    def _checkin(self, con, broken=False):
+        if self.pool:
+            self.pool.putconn(con, discard=broken)
+        elif broken:
+            try:
+                con.close()
+            except Exception:
+                pass
+            self._con = None
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for actor_id, action, timestamp in batch:
+            writer.writerow(("" if actor_id is None else actor_id, action, timestamp.isoformat()))
+
+        for attempt in range(2):
+            con = None
+            try:
+                con = self._checkout()
+                buf.seek(0)
+                with con.cursor() as cur:
+                    cur.copy_expert("COPY audit_log (actor_id, action, timestamp) FROM STDIN WITH (FORMAT csv)", buf)
+                con.commit()
+                self._count("written", len(batch))
+                self._count("flushes")
+                return
+            except Exception:
+                self._count("errors")
+                db_logger.exception(f"Error flushing {len(batch)} audit events (attempt {attempt + 1})")
+                if con is not None:
+                    try:
+                        con.rollback()
+                    except Exception:
+                        pass
+                    self._checkin(con, broken=True)
+                    con = None
+            finally:
+                if con is not None:
+                    self._checkin(con)
+
+        self._count("dropped", len(batch))
+
+    def close(self, timeout=10):
+        """Flush everything queued so far and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._con is not None and not self._con.closed:
+            self._con.close()
+        db_logger.info(f"Audit writer stopped: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+
+def get_audit_writer(pool=None):
+    """Process-wide AuditWriter when AUDIT_BUFFERED=1, otherwise None"""
+    global _default_writer
+    if not AUDIT_BUFFERED:
+        return None
+    with _default_writer_lock:
+        if _default_writer is None:
+            _default_writer = AuditWriter(pool=pool)
+            atexit.register(_default_writer.close)
+        return _default_writer
+
+
+def close_audit_writer():
+    if _default_writer is not None:
+        _default_writer.close()
+
 
 class AuditLogger:
-    def __init__(self, db):
+    def __init__(self, db, writer=None):
         self.db = db
-    
+        self.writer = writer or get_audit_writer(getattr(db, "pool", None))
+
     def log(self, actor_id, action):
+        if self.writer:
+            self.writer.submit(actor_id, action)
+            return
         try:
-            query = "INSERT INTO audit_log (actor_id, action) VALUES (%s, %s)"
-            self.db.execute_query(query, (actor_id, action))
-            self.db.commit()
+            with self.db.transaction():
+                self.db.execute_query(AUDIT_INSERT_SQL, (actor_id, action))
         except Exception:
             db_logger.exception ("Error Logging action")
 
-    def show_logs(self, limit=10):
+    @replica_read
+    def get_logs_page(self, page_size=None, cursor=None, since=None):
+        try:
+            rows, next_cursor = fetch_page(self.db, "audit", AUDIT_PAGE_SQL, (since,), cursor, page_size, *AUDIT_KEYSET)
+            items = [
+                {"log_id": log_id, "actor_id": actor_id, "action": action, "timestamp": timestamp}
+                for log_id, actor_id, action, timestamp in rows
+            ]
+            return {"items": items, "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error fetching audit logs page")
+            return {"items": [], "next_cursor": None}
+
+    def show_logs(self, limit=10, cursor=None, since=None):
         """showing last logs"""
         try:
-            query = "SELECT actor, action, timestamp FROM audit_log ORDER BY timestamp DESC LIMIT %s"
-            logs = self.db.fetch_all(query, (limit,))
-            if not logs:
+            page = self.get_logs_page(limit, cursor, since)
+            if not page["items"]:
                 db_logger.info("No audit logs found.")
-                return
+                return None
 
             print("Recent Audit Logs:")
             print("-" * 60)
-            for actor, action, timestamp in logs:
-                print(f"[{timestamp}] {actor}: {action}")
+            for log in page["items"]:
+                print(f"[{log['timestamp']}] {log['actor_id']}: {log['action']}")
             print("-" * 60)
+            return page["next_cursor"]
 
         except Exception:
-            db_logger.exception("Error fetching audit logs")
\ No newline at end of file
+            db_logger.exception("Error fetching audit logs")
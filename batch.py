@@ -0,0 +1,192 @@
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from counters import COUNTER_FOLD_EVERY, CounterManager
+from db_connect import ConnectionPool, PostgresConnection, RollbackOnly, db_logger, get_pool
+from query_stats import percentile
+from server import OPERATIONS, json_default
+
+
+def read_commands(path=None):
+    """(line, request) pairs from a JSONL file or stdin; request lines use the service
+    format {"id": ..., "op": ..., "params": {...}}. Unparseable lines come back as ValueError."""
+    f = sys.stdin if path in (None, "-") else open(path)
+    try:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict) or "op" not in request:
+                    raise ValueError("expected an object with an 'op'")
+            except ValueError as e:
+                request = ValueError(f"Bad request: {e}")
+            yield line_no, request
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+# Ops creating the users and buses later commands refer to by id. With several workers
+# they run on their own, after everything before them and before anything after them.
+BARRIER_OPS = ("register", "addbus")
+
+
+def _is_barrier(request):
+    return isinstance(request, dict) and request.get("op") in BARRIER_OPS
+
+
+def _phases(commands):
+    """Split (line, request) pairs into runs of barrier and non-barrier commands, in file order"""
+    phases = []
+    for command in commands:
+        barrier = _is_barrier(command[1])
+        if not phases or phases[-1][0] != barrier:
+            phases.append((barrier, []))
+        phases[-1][1].append(command)
+    return phases
+
+
+def _shard_key(request):
+    # keep one user's commands on one worker so they run in file order
+    if isinstance(request, dict):
+        params = request.get("params") or {}
+        for key in ("user_id", "admin_id", "bus_id"):
+            if key in params:
+                return hash((key, params[key]))
+    return None
+
+
+class BatchRunner:
+    def __init__(self, system_class, pool=None, group_size=1, workers=1, fold_every=COUNTER_FOLD_EVERY):
+        if group_size < 1 or workers < 1:
+            raise ValueError("group_size and workers must be at least 1")
+        self.system_class = system_class
+        self.group_size = group_size
+        self.workers = workers
+        self.fold_every = fold_every  # commands between counter folds (0: only at the end)
+        self.pool = pool or get_pool() or (ConnectionPool(min_size=workers, max_size=workers) if workers > 1 else None)
+
+    def _execute(self, db, system, line_no, request):
+        result = {"line": line_no, "id": None, "op": None}
+        start = time.perf_counter()
+        try:
+            if isinstance(request, Exception):
+                raise request
+            result.update(id=request.get("id"), op=request["op"])
+            if request["op"] not in OPERATIONS:
+                raise ValueError(f"Unknown op '{request['op']}'")
+            params = request.get("params") or {}
+            db.actor = params.get("user_id")
+            # inside a group each command gets a savepoint so one failure does not sink the rest
+            with db.transaction(savepoint=self.group_size > 1):
+                value = OPERATIONS[request["op"]](system, params)
+            result.update(ok=value is not False and value is not None, result=value)
+        except KeyError as e:
+            result.update(ok=False, error=f"Missing parameter {e}")
+        except Exception as e:
+            result.update(ok=False, error=str(e) or type(e).__name__)
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    def _run_shard(self, commands, results):
+        with PostgresConnection(pool=self.pool) as db:
+            system = self.system_class(db)
+            since_fold = 0
+            for i in range(0, len(commands), self.group_size):
+                group = commands[i:i + self.group_size]
+                done = []
+                try:
+                    with db.transaction():
+                        for line_no, request in group:
+                            done.append(self._execute(db, system, line_no, request))
+                        # a command that swallowed its own failure may still have doomed the group
+                        if db.rollback_only:
+                            raise RollbackOnly("a command rolled back the group transaction")
+                except Exception as e:
+                    db_logger.error(f"Group starting at line {group[0][0]} rolled back: {e}")
+                    for r in done:
+                        if r["ok"]:
+                            r.update(ok=False, error=f"Group rolled back: {e}")
+                results.extend(done)
+                since_fold += len(group)
+                if self.fold_every and since_fold >= self.fold_every:
+                    CounterManager(db).fold()
+                    since_fold = 0
+
+    def _run_parallel(self, commands, results):
+        shards = [[] for _ in range(self.workers)]
+        for n, (line_no, request) in enumerate(commands):
+            key = _shard_key(request)
+            shards[(key if key is not None else n) % self.workers].append((line_no, request))
+        partial = [[] for _ in shards]
+        threads = [
+            threading.Thread(target=self._run_shard, args=(shard, out), name=f"batch-{i}")
+            for i, (shard, out) in enumerate(zip(shards, partial)) if shard
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for out in partial:
+            results.extend(out)
+
+    def run(self, commands):
+        """Run (line, request) pairs; returns (results in input order, summary)"""
+        start = time.perf_counter()
+        results = []
+        if self.workers == 1:
+            self._run_shard(list(commands), results)
+        else:
+            for barrier, phase in _phases(commands):
+                if barrier:
+                    # later commands may refer to what these create, so nothing runs alongside them
+                    self._run_shard(phase, results)
+                else:
+                    self._run_parallel(phase, results)
+        # outside the service nothing else folds the queued seat and rollup changes
+        with PostgresConnection(pool=self.pool) as db:
+            CounterManager(db).fold()
+        elapsed = time.perf_counter() - start
+        results.sort(key=lambda r: r["line"])
+        return results, self.summary(results, elapsed)
+
+    @staticmethod
+    def summary(results, elapsed):
+        by_op = defaultdict(list)
+        failed = defaultdict(int)
+        for r in results:
+            by_op[r["op"]].append(r["latency_ms"])
+            if not r["ok"]:
+                failed[r["op"]] += 1
+        ops = {}
+        for op, latencies in by_op.items():
+            latencies.sort()
+            ops[str(op)] = {
+                "count": len(latencies), "failed": failed[op],
+                "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99), "max_ms": latencies[-1],
+            }
+        return {
+            "commands": len(results),
+            "ok": sum(1 for r in results if r["ok"]),
+            "failed": sum(failed.values()),
+            "elapsed_s": elapsed,
+            "throughput": len(results) / elapsed if elapsed else 0.0,
+            "operations": ops,
+        }
+
+
+def run_batch(system_class, path=None, output=None, group_size=1, workers=1):
+    runner = BatchRunner(system_class, group_size=group_size, workers=workers)
+    results, summary = runner.run(list(read_commands(path)))
+    if output:
+        with open(output, "w") as f:
+            for r in results:
+                f.write(json.dumps(r, default=json_default) + "\n")
+    print(json.dumps(summary, indent=2))
+    if runner.pool and runner.pool is not get_pool():
+        runner.pool.closeall()
+    return summary
@@ -0,0 +1,306 @@
+"""Concurrent booking load test against a local Postgres.
+
+Example:
+    python benchmark.py --setup --workers 16 --duration 30 \
+        --mix buy=60,cancel=10,topup=10,list=20 --hot-fraction 0.8 --output bench.json
+
+With WALLET_MODE=ledger, run "main.py wallet adopt" after --setup so the seeded
+balances reach the wallet shards.
+"""
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from db_connect import ConnectionPool, PostgresConnection, db_logger
+from cache import TTLCache
+from query_stats import percentile
+from bus import BusManager
+from seat_map import SEAT_INVENTORY, BitmapBusManager
+from ticket import PURCHASE_OK, TicketManager
+from wallet_ledger import make_wallet_manager
+
+BENCH_PREFIX = "bench-"
+OPERATIONS = ("buy", "cancel", "topup", "list")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}', choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# --- Fixtures ---
+def setup(db, buses, seats, users, balance):
+    with db.transaction():
+        db.execute_query(
+            """INSERT INTO users (name, email, password, is_admin, wallet)
+               SELECT 'Bench user ' || n, %s || n || '@bench.local', 'bench', FALSE, %s
+               FROM generate_series(1, %s) AS n
+               ON CONFLICT (email) DO UPDATE SET wallet = EXCLUDED.wallet""",
+            (BENCH_PREFIX, balance, users)
+        )
+    manager = bus_manager_class()(db)
+    for n in range(1, buses + 1):
+        manager.add_bus(None, f"Bench bus {n}", f"{BENCH_PREFIX}{n}", seats, 10.0,
+                        "2030-01-01 08:00", "2030-01-01 12:00", "Bench-Route")
+
+
+def teardown(db):
+    with db.transaction():
+        db.execute_query("DELETE FROM buses WHERE bus_number LIKE %s", (BENCH_PREFIX + "%",))
+        db.execute_query(
+            "DELETE FROM transactions WHERE user_id IN (SELECT user_id FROM users WHERE email LIKE %s)",
+            (BENCH_PREFIX + "%",)
+        )
+        db.execute_query(
+            "DELETE FROM audit_log WHERE actor_id IN (SELECT user_id FROM users WHERE email LIKE %s)",
+            (BENCH_PREFIX + "%",)
+        )
+        db.execute_query("DELETE FROM users WHERE email LIKE %s", (BENCH_PREFIX + "%",))
+
+
+def bus_manager_class():
+    return BitmapBusManager if SEAT_INVENTORY == "bitmap" else BusManager
+
+
+def load_fixtures(db):
+    users = [r[0] for r in db.fetch_all("SELECT user_id FROM users WHERE email LIKE %s ORDER BY user_id", (BENCH_PREFIX + "%",))]
+    buses = db.fetch_all(
+        "SELECT bus_id, total_seats, price_per_seat FROM buses WHERE bus_number LIKE %s ORDER BY bus_id",
+        (BENCH_PREFIX + "%",)
+    )
+    db.commit()
+    return users, [(bus_id, seats, float(price)) for bus_id, seats, price in buses]
+
+
+# --- Workers ---
+class Worker(threading.Thread):
+    def __init__(self, bench, index):
+        super().__init__(name=f"bench-worker-{index}", daemon=True)
+        self.bench = bench
+        self.rng = random.Random(bench.seed + index)
+        self.latencies = defaultdict(list)
+        self.outcomes = Counter()
+        self.tickets = []  # (user_id, ticket_id) bought by this worker
+
+    def pick_bus(self):
+        buses = self.bench.buses
+        hot = buses[:self.bench.hot_buses]
+        if hot and self.rng.random() < self.bench.hot_fraction:
+            return self.rng.choice(hot)
+        return self.rng.choice(buses)
+
+    def pick_seat(self, total_seats):
+        # the first hot_seats seats of a bus take hot_fraction of the picks
+        hot_seats = min(self.bench.hot_seats, total_seats)
+        if hot_seats and self.rng.random() < self.bench.hot_fraction:
+            return self.rng.randint(1, hot_seats)
+        return self.rng.randint(1, total_seats)
+
+    def run_op(self, op, system):
+        bus_manager, tickets, wallet = system
+        user_id = self.rng.choice(self.bench.users)
+        if op == "buy":
+            bus_id, total_seats, price = self.pick_bus()
+            seat_number = self.pick_seat(total_seats)
+            seat = bus_manager.resolve_seat(bus_id, seat_number)
+            if not seat or not seat["available"]:
+                return "SEAT_TAKEN"
+            result = tickets.purchase(user_id, bus_id, seat["seat_id"], price, seat_number)
+            if result["status"] == PURCHASE_OK:
+                self.tickets.append((user_id, result["ticket_id"]))
+            return result["status"]
+        if op == "cancel":
+            if not self.tickets:
+                return "NOTHING_TO_CANCEL"
+            user_id, ticket_id = self.tickets.pop(self.rng.randrange(len(self.tickets)))
+            return "OK" if tickets.cancel_ticket(user_id, ticket_id) else "FAILED"
+        if op == "topup":
+            return "OK" if wallet.add_balance(user_id, 5.0, "Bench deposit") else "FAILED"
+        return "OK" if bus_manager.get_all_buses() else "EMPTY"
+
+    def run(self):
+        ops, weights = zip(*self.bench.mix.items())
+        with PostgresConnection(pool=self.bench.pool) as db:
+            cache = None if self.bench.use_cache else TTLCache(max_size=0)
+            bus_manager = bus_manager_class()(db, cache=cache)
+            wallet = make_wallet_manager(db)
+            system = (bus_manager, TicketManager(db, bus_manager, wallet), wallet)
+            self.bench.ready.wait()
+            while not self.bench.stop.is_set():
+                op = self.rng.choices(ops, weights)[0]
+                start = time.perf_counter()
+                try:
+                    outcome = self.run_op(op, system)
+                except Exception as e:
+                    outcome = f"EXCEPTION:{type(e).__name__}"
+                    db.rollback()
+                self.latencies[op].append(time.perf_counter() - start)
+                self.outcomes[(op, outcome)] += 1
+
+
+class LockMonitor(threading.Thread):
+    """Samples how many backends are waiting on locks"""
+
+    def __init__(self, bench, interval=0.2):
+        super().__init__(name="bench-lock-monitor", daemon=True)
+        self.bench = bench
+        self.interval = interval
+        self.samples = []
+
+    def run(self):
+        with PostgresConnection(pool=self.bench.pool) as db:
+            self.bench.ready.wait()
+            while not self.bench.stop.wait(self.interval):
+                row = db.fetch_one(
+                    "SELECT COUNT(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock' AND datname = current_database()"
+                )
+                db.commit()
+                if row:
+                    self.samples.append(row[0])
+
+
+class Benchmark:
+    def __init__(self, args, users, buses, pool):
+        self.mix = args.mix
+        self.workers = args.workers
+        self.duration = args.duration
+        self.hot_buses = args.hot_buses
+        self.hot_seats = args.hot_seats
+        self.hot_fraction = args.hot_fraction
+        self.use_cache = not args.no_cache
+        self.seed = args.seed
+        self.users = users
+        self.buses = buses
+        self.pool = pool
+        self.ready = threading.Event()
+        self.stop = threading.Event()
+
+    def run(self):
+        workers = [Worker(self, i) for i in range(self.workers)]
+        monitor = LockMonitor(self)
+        for t in workers + [monitor]:
+            t.start()
+        start = time.perf_counter()
+        self.ready.set()
+        time.sleep(self.duration)
+        self.stop.set()
+        for t in workers + [monitor]:
+            t.join()
+        elapsed = time.perf_counter() - start
+        return self.report(workers, monitor, elapsed)
+
+    def report(self, workers, monitor, elapsed):
+        latencies = defaultdict(list)
+        outcomes = Counter()
+        for w in workers:
+            for op, values in w.latencies.items():
+                latencies[op].extend(values)
+            outcomes.update(w.outcomes)
+
+        operations = {}
+        for op in sorted(latencies):
+            values = sorted(latencies[op])
+            op_outcomes = {outcome: n for (name, outcome), n in outcomes.items() if name == op}
+            failures = sum(n for outcome, n in op_outcomes.items() if outcome != "OK")
+            operations[op] = {
+                "count": len(values),
+                "throughput": len(values) / elapsed,
+                "failures": failures,
+                "outcomes": op_outcomes,
+                "latency_ms": {
+                    "p50": percentile(values, 50) * 1000,
+                    "p95": percentile(values, 95) * 1000,
+                    "p99": percentile(values, 99) * 1000,
+                    "max": values[-1] * 1000,
+                    "mean": sum(values) / len(values) * 1000,
+                },
+            }
+        total = sum(op["count"] for op in operations.values())
+        return {
+            "commit": git_commit(),
+            "config": {
+                "workers": self.workers,
+                "duration_s": self.duration,
+                "mix": self.mix,
+                "hot_buses": self.hot_buses,
+                "hot_seats": self.hot_seats,
+                "hot_fraction": self.hot_fraction,
+                "cache": self.use_cache,
+                "seat_inventory": SEAT_INVENTORY,
+                "buses": len(self.buses),
+                "users": len(self.users),
+            },
+            "elapsed_s": elapsed,
+            "throughput": total / elapsed,
+            "operations": operations,
+            "lock_waiters": {
+                "samples": len(monitor.samples),
+                "mean": sum(monitor.samples) / len(monitor.samples) if monitor.samples else 0,
+                "max": max(monitor.samples, default=0),
+            },
+            "pool": self.pool.stats(),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent booking benchmark")
+    parser.add_argument("--setup", action="store_true", help="Create bench users and buses first")
+    parser.add_argument("--teardown", action="store_true", help="Delete bench data afterwards")
+    parser.add_argument("--buses", type=int, default=20)
+    parser.add_argument("--seats", type=int, default=40)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--balance", type=float, default=100000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("buy=60,cancel=10,topup=10,list=20"))
+    parser.add_argument("--hot-buses", type=int, default=1, help="Number of popular buses")
+    parser.add_argument("--hot-seats", type=int, default=4, help="Number of popular seats per bus")
+    parser.add_argument("--hot-fraction", type=float, default=0.5, help="Share of picks going to hot buses/seats")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the bus listing cache")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(min_size=1, max_size=args.workers + 2)
+    try:
+        with PostgresConnection(pool=pool) as db:
+            if args.setup:
+                setup(db, args.buses, args.seats, args.users, args.balance)
+            users, buses = load_fixtures(db)
+        if not users or not buses:
+            raise SystemExit("No bench fixtures found; run with --setup")
+
+        result = Benchmark(args, users, buses, pool).run()
+        output = json.dumps(result, indent=2, default=str)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+            db_logger.info(f"Benchmark report written to {args.output}")
+        else:
+            print(output)
+
+        if args.teardown:
+            with PostgresConnection(pool=pool) as db:
+                teardown(db)
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,102 +1,331 @@
-from datetime import datetime
+import os
+import re
+import time
+from datetime import datetime, timedelta
 from audit_log import AuditLogger
-from db_connect import db_logger
+from cache import TTLCache
+from counters import BUS_DELETED_DELTA_SQL, LIVE_SEATS_SQL, SEAT_DELTA_SQL, SEAT_TAKEN_DELTA_SQL
+from db_connect import db_logger, replica_read
+from pagination import InvalidCursor, fetch_page
+
+# Bus metadata cache shared by every BusManager in the process (BUS_CACHE_TTL=0 disables it).
+# Free-seat counts on cached entries are re-read once older than BUS_AVAILABILITY_TTL seconds;
+# they are display-only (purchases check the seat itself), so a few seconds of staleness is fine.
+BUS_CACHE_TTL = float(os.getenv("BUS_CACHE_TTL", "60"))
+BUS_CACHE_SIZE = int(os.getenv("BUS_CACHE_SIZE", "1024"))
+BUS_AVAILABILITY_TTL = float(os.getenv("BUS_AVAILABILITY_TTL", "5"))
+
+bus_cache = TTLCache(max_size=BUS_CACHE_SIZE if BUS_CACHE_TTL > 0 else 0, ttl=BUS_CACHE_TTL)
+
+# Any-seat booking derives a seat's position from its number on a SEATS_PER_ROW-abreast
+# layout with the aisle in the middle (seat 1 is the front-left window).
+SEATS_PER_ROW = int(os.getenv("SEATS_PER_ROW", "4"))
+SEAT_PREFERENCES = ("window", "aisle", "front", "back")
+
+
+def parse_seat_preferences(value):
+    """Normalized preference tuple from a list or comma-separated string"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    prefs = {p.strip().lower() for p in value if p and p.strip()}
+    unknown = prefs - set(SEAT_PREFERENCES)
+    if unknown:
+        raise ValueError(f"Unknown seat preference: {', '.join(sorted(unknown))}")
+    if {"window", "aisle"} <= prefs or {"front", "back"} <= prefs:
+        raise ValueError("Conflicting seat preferences")
+    return tuple(sorted(prefs))
+
+
+def seat_order_sql(preferences, column="seat_number"):
+    """ORDER BY list putting free seats that match the preferences first"""
+    position = f"({column} - 1) %% {SEATS_PER_ROW}"
+    keys = []
+    if "window" in preferences:
+        keys.append(f"{position} NOT IN (0, {SEATS_PER_ROW - 1})")
+    if "aisle" in preferences:
+        keys.append(f"{position} NOT IN ({SEATS_PER_ROW // 2 - 1}, {SEATS_PER_ROW // 2})")
+    keys.append(f"{column} DESC" if "back" in preferences else column)
+    return ", ".join(keys)
+
+
+# Structured trips: the free-form route ("Tehran - Qom - Isfahan", "Tehran->Shiraz")
+# becomes ordered bus_stops rows and the departure/arrival strings become timestamps.
+ROUTE_SEPARATOR = re.compile(r"\s*(?:->|=>|\u2192|\u2013|\u2014|>|,|;|\||-)\s*")
+TRIP_TIME_FORMATS = ("%Y/%m/%d %H:%M", "%d.%m.%Y %H:%M", "%d/%m/%Y %H:%M", "%Y/%m/%d", "%d.%m.%Y")
+_CLOCK = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+
+def city_key(name):
+    """Case- and whitespace-insensitive stop key"""
+    return " ".join((name or "").split()).casefold()
+
+
+def parse_route(route):
+    """Ordered stop names of a free-form route"""
+    if not route:
+        return []
+    return [" ".join(stop.split()) for stop in ROUTE_SEPARATOR.split(route) if stop.strip()]
+
+
+def parse_trip_time(value, after=None):
+    """Timestamp of a departure/arrival string, or None when it names no date.
+    A bare "HH:MM" is taken as the first such time after `after` (arrival after departure)."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    text = " ".join(str(value or "").split())
+    if not text:
+        return None
+    clock = _CLOCK.match(text)
+    if clock:
+        if after is None or int(clock.group(1)) > 23 or int(clock.group(2)) > 59:
+            return None
+        at = after.replace(hour=int(clock.group(1)), minute=int(clock.group(2)), second=0, microsecond=0)
+        return at if at >= after else at + timedelta(days=1)
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for fmt in TRIP_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def trip_sync_params(rows):
+    """(bus_id, route, departure_time, arrival_time) rows -> params for TRIP_UPDATE_SQL and TRIP_STOPS_INSERT_SQL"""
+    trips = ([], [], [], [], [])
+    stops = ([], [], [], [])
+    for bus_id, route, departure_time, arrival_time in rows:
+        names = parse_route(route)
+        departure_at = parse_trip_time(departure_time)
+        for column, value in zip(trips, (bus_id, names[0] if names else None, names[-1] if names else None,
+                                         departure_at, parse_trip_time(arrival_time, departure_at))):
+            column.append(value)
+        for order, name in enumerate(names):
+            for column, value in zip(stops, (bus_id, order, name, city_key(name))):
+                column.append(value)
+    return trips, stops
+
+
+TRIP_SCHEMA_SQL = "SELECT to_regclass('bus_stops') IS NOT NULL"
+TRIP_SOURCE_SQL = "SELECT bus_id, route, departure_time, arrival_time FROM buses"
+TRIP_UPDATE_SQL = """
+    UPDATE buses b
+    SET origin = t.origin, destination = t.destination, departure_at = t.departure_at, arrival_at = t.arrival_at
+    FROM unnest(%s::INTEGER[], %s::VARCHAR[], %s::VARCHAR[], %s::TIMESTAMP[], %s::TIMESTAMP[])
+         AS t(bus_id, origin, destination, departure_at, arrival_at)
+    WHERE b.bus_id = t.bus_id
+"""
+TRIP_STOPS_DELETE_SQL = "DELETE FROM bus_stops WHERE bus_id = ANY(%s)"
+TRIP_STOPS_INSERT_SQL = """
+    INSERT INTO bus_stops (bus_id, stop_order, city, city_key)
+    SELECT * FROM unnest(%s::INTEGER[], %s::SMALLINT[], %s::VARCHAR[], %s::VARCHAR[])
+"""
+
+
+BUS_SELECT = """
+    SELECT bus_id, bus_name, bus_number, total_seats, price_per_seat,
+           departure_time, arrival_time, route, {live_seats}
+    FROM buses b
+""".format(live_seats=LIVE_SEATS_SQL)
+
+
+BUSES_PAGE_SQL = BUS_SELECT + """
+    WHERE TRUE {after}
+    ORDER BY COALESCE(departure_time, ''), bus_id
+    LIMIT %s
+"""
+BUSES_PAGE_KEYSET = ("(COALESCE(departure_time, ''), bus_id) > (%s, %s)", lambda row: (row[5] or "", row[0]))
+
 
 class BusManager:
-    def __init__(self, db):
+    SEAT_INVENTORY = "rows"
+
+    # (price_per_seat, seat_id, is_booked, available) for one seat of a bus
+    RESOLVE_SEAT_SQL = """
+        SELECT b.price_per_seat, s.seat_id, COALESCE(s.is_booked, FALSE),
+               s.seat_id IS NOT NULL AND NOT s.is_booked
+        FROM buses b
+        LEFT JOIN seats s ON s.bus_id = b.bus_id AND s.seat_number = %(seat_number)s
+        WHERE b.bus_id = %(bus_id)s
+    """
+    FREE_SEATS_SQL = "SELECT seat_id, seat_number FROM seats WHERE bus_id=%s AND is_booked=FALSE ORDER BY seat_number"
+
+    # Purchase-statement fragments (see ticket.PURCHASE_QUERY): claim one seat and
+    # queue the free-seat change (counters.py), returning (seat_id, seat_number).
+    SEAT_CLAIM_SQL = """
+        seat AS (
+            UPDATE seats SET is_booked = TRUE
+            WHERE seat_id = %(seat_id)s AND bus_id = %(bus_id)s AND is_booked = FALSE
+            RETURNING seat_id, seat_number
+        ),
+    """ + SEAT_TAKEN_DELTA_SQL
+    SEAT_EXISTS_SQL = "SELECT 1 FROM seats WHERE seat_id = %(seat_id)s AND bus_id = %(bus_id)s"
+
+    # Any free seat: buyers skip rows another transaction is claiming instead of queueing on them
+    # (the bus row is not touched, so nothing else serializes them)
+    ANY_SEAT_CLAIM_SQL = """
+        seat AS (
+            UPDATE seats SET is_booked = TRUE
+            WHERE seat_id = (
+                SELECT seat_id FROM seats
+                WHERE bus_id = %(bus_id)s AND is_booked = FALSE
+                ORDER BY {order}
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING seat_id, seat_number
+        ),
+    """ + SEAT_TAKEN_DELTA_SQL
+    ANY_SEAT_COLUMN = "seat_number"
+    _trips_ready = False  # bus_stops exists (migration 4); checked until it does
+    BUS_EXISTS_SQL = "SELECT 1 FROM buses WHERE bus_id = %(bus_id)s"
+    PRICE_SQL = "SELECT price_per_seat FROM buses WHERE bus_id = %s"
+
+    # Free a ticket's seat (by seat_id, else by number) and queue the counter change; returns bus_id once released
+    RELEASE_SEAT_SQL = """
+        WITH seat AS (
+            UPDATE seats SET is_booked = FALSE
+            WHERE is_booked AND bus_id = %(bus_id)s
+              AND (seat_id = %(seat_id)s OR (%(seat_id)s IS NULL AND seat_number = %(seat_number)s))
+            RETURNING bus_id
+        )
+        INSERT INTO counter_deltas (bus_id, seats)
+        SELECT bus_id, 1 FROM seat
+        RETURNING bus_id
+    """
+
+    def __init__(self, db, cache=None, availability_ttl=BUS_AVAILABILITY_TTL):
         self.db = db
         self.audit = AuditLogger(db)
+        self.cache = cache if cache is not None else bus_cache
+        self.availability_ttl = availability_ttl
 
     # --- Add bus ---
     def add_bus(self, admin_id, bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route):
         try:
-            # Check duplicate bus number
-            if self.db.fetch_one("SELECT bus_id FROM buses WHERE bus_number=%s", (bus_number,)):
-                db_logger.error("Bus number already exists")
-                return False
+            with self.db.transaction():
+                # Check duplicate bus number
+                if self.db.fetch_one("SELECT bus_id FROM buses WHERE bus_number=%s", (bus_number,)):
+                    db_logger.error("Bus number already exists")
+                    return False
 
-            # Insert bus
-            query = """INSERT INTO buses (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING bus_id"""
-            result = self.db.fetch_one(query, (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route))
-            if not result:
-                db_logger.error("Failed to insert bus")
-                return False
-            bus_id = result[0]
+                # Insert bus
+                query = """INSERT INTO buses (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route, available_seats)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING bus_id"""
+                result = self.db.fetch_one(query, (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route, total_seats))
+                if not result:
+                    self.db.rollback()
+                    db_logger.error("Failed to insert bus")
+                    return False
+                bus_id = result[0]
 
-            # Insert seats in batch
-            seat_values = [(bus_id, i) for i in range(1, total_seats+1)]
-            self.db.cur.executemany("INSERT INTO seats (bus_id, seat_number) VALUES (%s, %s);", seat_values)
+                # Insert seats in batch
+                seat_values = [(bus_id, i) for i in range(1, total_seats+1)]
+                self.db.cur.executemany("INSERT INTO seats (bus_id, seat_number) VALUES (%s, %s);", seat_values)
+                self.sync_trips([bus_id])
 
-            self.db.commit()
+            self.cache.invalidate(("buses",), ("routes",))
             db_logger.info(f"Bus '{bus_name}' added successfully with {total_seats} seats.")
             return True
         except Exception:
-            self.db.rollback()
             db_logger.exception(f"Error adding bus: {bus_name}", exc_info=True)
             return False
 
-    # --- Get all buses ---
+    # --- Cached reads ---
+    def _with_fresh_counts(self, entry):
+        # entry: {"counted_at": ..., "buses": [...]}; refresh free-seat counts past the staleness budget
+        now = time.monotonic()
+        if now - entry["counted_at"] > self.availability_ttl:
+            bus_ids = [b["bus_id"] for b in entry["buses"]]
+            counts = dict(self.db.fetch_all(
+                f"SELECT b.bus_id, {LIVE_SEATS_SQL} FROM buses b WHERE b.bus_id = ANY(%s)", (bus_ids,)
+            ))
+            for b in entry["buses"]:
+                b["available_seats"] = counts.get(b["bus_id"], b["available_seats"])
+            entry["counted_at"] = now
+        return [dict(b) for b in entry["buses"]]
+
     def get_all_buses(self):
+        entry = self.cache.get(("buses",))
+        if entry is None:
+            buses = self._fetch_all_buses()
+            if not buses:
+                return buses
+            entry = {"counted_at": time.monotonic(), "buses": buses}
+            self.cache.set(("buses",), entry)
+            return [dict(b) for b in buses]
+        return self._with_fresh_counts(entry)
+
+    def get_bus_by_id(self, bus_id):
+        entry = self.cache.get(("bus", bus_id))
+        if entry is None:
+            bus = self._fetch_bus_by_id(bus_id)
+            if not bus:
+                return bus
+            entry = {"counted_at": time.monotonic(), "buses": [bus]}
+            self.cache.set(("bus", bus_id), entry)
+            return dict(bus)
+        return self._with_fresh_counts(entry)[0]
+
+    def invalidate_cache(self, bus_id=None):
+        if bus_id is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(("buses",), ("bus", bus_id), ("routes",))
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    # --- Get all buses ---
+    @replica_read
+    def _fetch_all_buses(self):
         try:
-            query = """
-                SELECT b.bus_id, b.bus_name, b.bus_number, b.total_seats, b.price_per_seat,
-                       b.departure_time, b.arrival_time, b.route,
-                       COUNT(s.seat_id) FILTER (WHERE s.is_booked=FALSE) AS available_seats
-                FROM buses b
-                LEFT JOIN seats s ON b.bus_id = s.bus_id
-                GROUP BY b.bus_id
-                ORDER BY b.departure_time
-            """
-            results = self.db.fetch_all(query)
-            buses = []
-            for row in results:
-                bus_id, bus_name, bus_number, total_seats, price, departure_time, arrival_time, route, available_seats = row
-                buses.append({
-                    "bus_id": bus_id,
-                    "bus_name": bus_name,
-                    "bus_number": bus_number,
-                    "route": route,
-                    "departure_time": departure_time,
-                    "arrival_time": arrival_time,
-                    "price_per_seat": float(price),
-                    "total_seats": total_seats,
-                    "available_seats": available_seats
-                })
-            return buses
+            results = self.db.fetch_all(BUS_SELECT + " ORDER BY departure_time")
+            return [self._bus_row(row) for row in results]
         except Exception:
             db_logger.exception("Error getting buses", exc_info=True)
             return []
 
+    @staticmethod
+    def _bus_row(row):
+        bus_id, bus_name, bus_number, total_seats, price, departure_time, arrival_time, route, available_seats = row
+        return {
+            "bus_id": bus_id,
+            "bus_name": bus_name,
+            "bus_number": bus_number,
+            "route": route,
+            "departure_time": departure_time,
+            "arrival_time": arrival_time,
+            "price_per_seat": float(price),
+            "total_seats": total_seats,
+            "available_seats": available_seats
+        }
+
+    # --- Buses, one keyset page at a time ---
+    @replica_read
+    def get_buses_page(self, page_size=None, cursor=None):
+        try:
+            rows, next_cursor = fetch_page(self.db, "buses", BUSES_PAGE_SQL, (), cursor, page_size, *BUSES_PAGE_KEYSET)
+            return {"items": [self._bus_row(row) for row in rows], "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error getting buses page", exc_info=True)
+            return {"items": [], "next_cursor": None}
+
     # --- Get bus by ID ---
-    def get_bus_by_id(self, bus_id):
+    def _fetch_bus_by_id(self, bus_id):
         try:
-            query = """
-                SELECT b.bus_id, b.bus_name, b.bus_number, b.total_seats, b.price_per_seat,
-                       b.departure_time, b.arrival_time, b.route,
-                       COUNT(s.seat_id) FILTER (WHERE s.is_booked=FALSE) AS available_seats
-                FROM buses b
-                LEFT JOIN seats s ON b.bus_id = s.bus_id
-                WHERE b.bus_id=%s
-                GROUP BY b.bus_id
-            """
-            result = self.db.fetch_one(query, (bus_id,))
+            result = self.db.fetch_one(BUS_SELECT + " WHERE b.bus_id=%s", (bus_id,))
             if not result:
                 db_logger.info("Bus not found")
                 return None
-
-            bus_id, bus_name, bus_number, total_seats, price, departure_time, arrival_time, route, available_seats = result
-            return {
-                "bus_id": bus_id,
-                "bus_name": bus_name,
-                "bus_number": bus_number,
-                "total_seats": total_seats,
-                "price_per_seat": float(price),
-                "departure_time": departure_time,
-                "arrival_time": arrival_time,
-                "route": route,
-                "available_seats": available_seats
-            }
+            return self._bus_row(result)
         except Exception:
             db_logger.exception(f"Error getting bus: {bus_id}", exc_info=True)
             return None
@@ -104,18 +333,20 @@ class BusManager:
     # --- Delete bus ---
     def delete_bus(self, admin_id, bus_id):
         try:
-            bus = self.db.fetch_one("SELECT bus_name FROM buses WHERE bus_id=%s", (bus_id,))
-            if not bus:
-                db_logger.info("Bus not found")
-                return False
+            with self.db.transaction():
+                bus = self.db.fetch_one("SELECT bus_name FROM buses WHERE bus_id=%s", (bus_id,))
+                if not bus:
+                    db_logger.info("Bus not found")
+                    return False
 
-            self.db.execute_query("DELETE FROM buses WHERE bus_id=%s", (bus_id,))
-            self.db.commit()
-            self.audit.log(admin_id, f"Deleted bus {bus[0]} (ID {bus_id})")
+                self.db.execute_query("DELETE FROM buses WHERE bus_id=%s", (bus_id,))
+                # its rollups went with it; a delta row moves the report watermark
+                self.db.execute_query(BUS_DELETED_DELTA_SQL, (bus_id,))
+                self.audit.log(admin_id, f"Deleted bus {bus[0]} (ID {bus_id})")
+            self.invalidate_cache(bus_id)
             db_logger.info(f"Bus {bus[0]} deleted successfully")
             return True
         except Exception:
-            self.db.rollback()
             db_logger.exception(f"Error deleting bus: {bus_id}", exc_info=True)
             return False
 
@@ -123,30 +354,83 @@ class BusManager:
     def update_bus(self, admin_id, bus_id, bus_name, price_per_seat, departure_time, arrival_time, route):
         try:
             query = """UPDATE buses SET bus_name=%s, price_per_seat=%s, departure_time=%s, arrival_time=%s, route=%s WHERE bus_id=%s"""
-            self.db.execute_query(query, (bus_name, price_per_seat, departure_time, arrival_time, route, bus_id))
-            self.db.commit()
-            self.audit.log(admin_id, f"Updated bus {bus_name} (ID {bus_id})")
+            with self.db.transaction():
+                self.db.execute_query(query, (bus_name, price_per_seat, departure_time, arrival_time, route, bus_id))
+                self.sync_trips([bus_id])
+                self.audit.log(admin_id, f"Updated bus {bus_name} (ID {bus_id})")
+            self.invalidate_cache(bus_id)
             db_logger.info("Bus updated successfully.")
             return True
         except Exception:
-            self.db.rollback()
             db_logger.exception(f"Error updating bus: {bus_id}", exc_info=True)
             return False
 
+    # --- Structured trips ---
+    def sync_trips(self, bus_ids=None):
+        """Rewrite stops and departure/arrival timestamps of the given buses (all when None) from
+        their route and time strings. Raises, so the bus write it belongs to rolls back with it."""
+        if not BusManager._trips_ready:
+            row = self.db.fetch_one(TRIP_SCHEMA_SQL)
+            BusManager._trips_ready = bool(row and row[0])
+            if not BusManager._trips_ready:
+                return 0
+        if bus_ids is None:
+            self.db.cur.execute(TRIP_SOURCE_SQL)
+        else:
+            self.db.cur.execute(TRIP_SOURCE_SQL + " WHERE bus_id = ANY(%s)", (list(bus_ids),))
+        rows = self.db.cur.fetchall()
+        trips, stops = trip_sync_params(rows)
+        self.db.cur.execute(TRIP_UPDATE_SQL, trips)
+        self.db.cur.execute(TRIP_STOPS_DELETE_SQL, (trips[0],))
+        self.db.cur.execute(TRIP_STOPS_INSERT_SQL, stops)
+        return len(rows)
+
     # --- Get available seats ---
+    @replica_read
     def get_available_seats(self, bus_id):
         try:
-            query = "SELECT seat_id, seat_number FROM seats WHERE bus_id=%s AND is_booked=FALSE ORDER BY seat_number"
-            results = self.db.fetch_all(query, (bus_id,))
+            results = self.db.fetch_all(self.FREE_SEATS_SQL, (bus_id,))
             return [{"seat_id": s_id, "seat_number": num} for s_id, num in results]
         except Exception:
             db_logger.exception("Error fetching seats", exc_info=True)
             return []
 
+    # --- Resolve seat ---
+    def resolve_seat(self, bus_id, seat_number):
+        """Price and seat_id for one (bus_id, seat_number) pair, via the UNIQUE(bus_id, seat_number) index"""
+        try:
+            result = self.db.fetch_one(self.RESOLVE_SEAT_SQL, {"bus_id": bus_id, "seat_number": seat_number})
+            return self._seat_row(bus_id, seat_number, result) if result else None
+        except Exception:
+            db_logger.exception(f"Error resolving seat {seat_number} on bus {bus_id}", exc_info=True)
+            return None
+
+    def current_price(self, bus_id):
+        """Fare read past the bus cache, which may still hold a price update_bus has since changed"""
+        try:
+            result = self.db.fetch_one(self.PRICE_SQL, (bus_id,))
+            return result[0] if result else None
+        except Exception:
+            db_logger.exception(f"Error reading price of bus {bus_id}", exc_info=True)
+            return None
+
+    @staticmethod
+    def _seat_row(bus_id, seat_number, row):
+        price, seat_id, is_booked, available = row
+        return {
+            "bus_id": bus_id,
+            "seat_number": seat_number,
+            "price_per_seat": float(price),
+            "seat_id": seat_id,
+            "is_booked": bool(is_booked),
+            "available": bool(available),
+            "exists": bool(is_booked or available),  # False: the bus has no seat with that number
+        }
+
     # --- Reserve seat ---
     def reserve_seat(self, seat_id):
         try:
-            result = self.db.fetch_one("SELECT is_booked FROM seats WHERE seat_id=%s FOR UPDATE;", (seat_id,))
+            result = self.db.fetch_one("SELECT is_booked, bus_id FROM seats WHERE seat_id=%s FOR UPDATE;", (seat_id,))
             if not result:
                 db_logger.info("Seat not found.")
                 return False
@@ -156,7 +440,109 @@ class BusManager:
                 return False
 
             self.db.execute_query("UPDATE seats SET is_booked=TRUE WHERE seat_id=%s;", (seat_id,))
+            self.db.execute_query(SEAT_DELTA_SQL, (result[1], -1))
             return True
         except Exception:
             db_logger.exception(f"Error reserving seat: {seat_id}", exc_info=True)
             return False
+
+    # --- Release seat ---
+    def release_seat(self, seat_id):
+        try:
+            result = self.db.fetch_one(
+                "UPDATE seats SET is_booked=FALSE WHERE seat_id=%s AND is_booked=TRUE RETURNING bus_id;",
+                (seat_id,)
+            )
+            if not result:
+                db_logger.info("Seat not booked.")
+                return False
+
+            self.db.execute_query(SEAT_DELTA_SQL, (result[0], 1))
+            return True
+        except Exception:
+            db_logger.exception(f"Error releasing seat: {seat_id}", exc_info=True)
+            return False
+
+    # --- Seat-number API (shared with BitmapBusManager) ---
+    def reserve_seat_number(self, bus_id, seat_number):
+        try:
+            result = self.db.fetch_one(
+                "SELECT seat_id FROM seats WHERE bus_id=%s AND seat_number=%s;",
+                (bus_id, seat_number)
+            )
+            if not result:
+                db_logger.info("Seat not found.")
+                return False
+            return self.reserve_seat(result[0])
+        except Exception:
+            db_logger.exception(f"Error reserving seat {seat_number} on bus {bus_id}", exc_info=True)
+            return False
+
+    def release_seat_number(self, bus_id, seat_number):
+        try:
+            result = self.db.fetch_one(
+                "SELECT seat_id FROM seats WHERE bus_id=%s AND seat_number=%s;",
+                (bus_id, seat_number)
+            )
+            if not result:
+                db_logger.info("Seat not found.")
+                return False
+            return self.release_seat(result[0])
+        except Exception:
+            db_logger.exception(f"Error releasing seat {seat_number} on bus {bus_id}", exc_info=True)
+            return False
+
+    def any_seat_claim_sql(self, preferences=()):
+        return self.ANY_SEAT_CLAIM_SQL.format(order=seat_order_sql(preferences, self.ANY_SEAT_COLUMN))
+
+    def first_free_seat(self, bus_id):
+        try:
+            result = self.db.fetch_one(
+                "SELECT MIN(seat_number) FROM seats WHERE bus_id=%s AND is_booked=FALSE;",
+                (bus_id,)
+            )
+            return result[0] if result else None
+        except Exception:
+            db_logger.exception(f"Error finding free seat on bus {bus_id}", exc_info=True)
+            return None
+
+    def count_free_seats(self, bus_id):
+        try:
+            result = self.db.fetch_one(f"SELECT {LIVE_SEATS_SQL} FROM buses b WHERE b.bus_id=%s;", (bus_id,))
+            return result[0] if result and result[0] is not None else 0
+        except Exception:
+            db_logger.exception(f"Error counting free seats on bus {bus_id}", exc_info=True)
+            return 0
+
+    # --- Seat counter consistency ---
+    def check_seat_counters(self, repair=False):
+        """Compare buses.available_seats (plus pending deltas) with the seats table; optionally rewrite drifted counters"""
+        try:
+            query = f"""
+                SELECT b.bus_id, {LIVE_SEATS_SQL}, COALESCE(s.free, 0)
+                FROM buses b
+                LEFT JOIN (
+                    SELECT bus_id, COUNT(*) AS free FROM seats WHERE is_booked=FALSE GROUP BY bus_id
+                ) s ON s.bus_id = b.bus_id
+                WHERE b.seat_map IS NULL  -- bitmap buses have no seat rows
+                  AND {LIVE_SEATS_SQL} IS DISTINCT FROM COALESCE(s.free, 0)
+                ORDER BY b.bus_id
+            """
+            drifted = [
+                {"bus_id": bus_id, "stored": stored, "actual": actual}
+                for bus_id, stored, actual in self.db.fetch_all(query)
+            ]
+            if repair and drifted:
+                with self.db.transaction():
+                    # the pending deltas still get folded in, so store the difference to them
+                    self.db.cur.executemany(
+                        "UPDATE buses b SET available_seats = %s - COALESCE("
+                        "(SELECT SUM(seats) FROM counter_deltas d WHERE d.bus_id = b.bus_id), 0) WHERE bus_id=%s;",
+                        [(d["actual"], d["bus_id"]) for d in drifted]
+                    )
+                self.invalidate_cache()
+                db_logger.info(f"Repaired seat counters for {len(drifted)} buses.")
+            return drifted
+        except Exception:
+            db_logger.exception("Error checking seat counters", exc_info=True)
+            return []
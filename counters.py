@@ -0,0 +1,102 @@
+import os
+from db_connect import db_logger
+
+# Purchases and cancellations append their bus free-seat and ticket rollup changes to
+# counter_deltas instead of updating the shared buses / ticket_rollups rows, so buyers
+# of one bus do not queue on its row. fold() applies the pending rows in the background;
+# readers add the still-pending deltas to the stored counters. Folding happens in the
+# service's maintenance loop, at the end of (and every COUNTER_FOLD_EVERY commands in)
+# a batch run, and after CLI commands that queue changes, so the queue stays short.
+COUNTER_FOLD_BATCH = int(os.getenv("COUNTER_FOLD_BATCH", "10000"))
+# Commands a batch worker runs between inline folds; the CLI folds after each booking/cancellation
+COUNTER_FOLD_EVERY = int(os.getenv("COUNTER_FOLD_EVERY", "1000"))
+
+# Purchase-statement fragment (see bus.BusManager.SEAT_CLAIM_SQL): one seat fewer once claimed
+SEAT_TAKEN_DELTA_SQL = """
+        counter AS (
+            INSERT INTO counter_deltas (bus_id, seats)
+            SELECT %(bus_id)s, -1 FROM seat
+        )
+"""
+SEAT_DELTA_SQL = "INSERT INTO counter_deltas (bus_id, seats) VALUES (%s, %s)"
+BUS_DELETED_DELTA_SQL = "INSERT INTO counter_deltas (bus_id) VALUES (%s)"
+
+# Free seats of the bus aliased b: stored counter plus its pending deltas
+LIVE_SEATS_SQL = "(b.available_seats + COALESCE((SELECT SUM(d.seats) FROM counter_deltas d WHERE d.bus_id = b.bus_id), 0))"
+
+# Rollup buckets as stored plus pending deltas (several rows per bucket until folded)
+ROLLUP_ROWS_SQL = """(
+        SELECT bus_id, day, paid, cancelled, used, paid_revenue FROM ticket_rollups
+        UNION ALL
+        SELECT d.bus_id, d.day, d.paid, d.cancelled, d.used, d.paid_revenue FROM counter_deltas d
+        WHERE d.day IS NOT NULL AND EXISTS (SELECT 1 FROM buses b WHERE b.bus_id = d.bus_id)
+    ) r"""
+
+FOLD_LOCK_SQL = "SELECT version FROM counter_state FOR UPDATE"
+# Oldest pending rows first; buses and buckets get the summed changes, counter_state the
+# number of rows, so version + pending rows never goes down (see reports.watermark_query)
+FOLD_SQL = """
+    WITH folded AS (
+        DELETE FROM counter_deltas
+        WHERE delta_id IN (SELECT delta_id FROM counter_deltas ORDER BY delta_id LIMIT %(batch)s)
+        RETURNING bus_id, day, seats, paid, cancelled, used, paid_revenue
+    ),
+    seats AS (
+        UPDATE buses b
+        SET available_seats = b.available_seats + f.seats, ticket_version = b.ticket_version + f.changes
+        FROM (SELECT bus_id, SUM(seats) AS seats, COUNT(*) AS changes FROM folded GROUP BY bus_id) f
+        WHERE b.bus_id = f.bus_id
+    ),
+    rollups AS (
+        INSERT INTO ticket_rollups (bus_id, day, paid, cancelled, used, paid_revenue)
+        SELECT f.bus_id, f.day, SUM(f.paid), SUM(f.cancelled), SUM(f.used), SUM(f.paid_revenue)
+        FROM folded f
+        JOIN buses b ON b.bus_id = f.bus_id  -- buckets of deleted buses went with them
+        WHERE f.day IS NOT NULL
+        GROUP BY f.bus_id, f.day
+        ON CONFLICT (bus_id, day) DO UPDATE
+        SET paid = ticket_rollups.paid + EXCLUDED.paid,
+            cancelled = ticket_rollups.cancelled + EXCLUDED.cancelled,
+            used = ticket_rollups.used + EXCLUDED.used,
+            paid_revenue = ticket_rollups.paid_revenue + EXCLUDED.paid_revenue
+    ),
+    state AS (
+        UPDATE counter_state SET version = version + (SELECT COUNT(*) FROM folded)
+    )
+    SELECT COUNT(*) FROM folded
+"""
+
+
+class CounterManager:
+    """Background side of the deferred bus and rollup counters"""
+
+    def __init__(self, db, batch=COUNTER_FOLD_BATCH):
+        self.db = db
+        self.batch = batch
+
+    def fold_pending(self):
+        """Apply every pending delta inside the caller's transaction; returns the rows folded.
+        Concurrent folds queue on the counter_state row."""
+        self.db.fetch_one(FOLD_LOCK_SQL)
+        total = 0
+        while True:
+            row = self.db.fetch_one(FOLD_SQL, {"batch": self.batch})
+            folded = row[0] if row else 0
+            total += folded
+            if folded < self.batch:
+                return total
+
+    def fold(self):
+        try:
+            with self.db.transaction():
+                folded = self.fold_pending()
+            if folded:
+                db_logger.debug(f"Folded {folded} counter changes.")
+            return folded
+        except Exception:
+            db_logger.exception("Error folding counter changes")
+            return 0
+
+    def pending(self):
+        row = self.db.fetch_one("SELECT COUNT(*) FROM counter_deltas")
+        return row[0] if row else 0
@@ -1,7 +1,14 @@
 import psycopg2
+import psycopg2.extensions
+import functools
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
+from query_stats import (DB_EXPLAIN_SLOW, DB_SLOW_QUERY_MS, DB_STATS_ENABLED, is_read_only,
+                         is_write, log_slow_query, query_stats)
 
 load_dotenv()
 
@@ -10,6 +17,27 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
+# Full libpq DSN for the primary; overrides the DB_* parts above when set
+DB_PRIMARY_DSN = os.getenv("DB_PRIMARY_DSN")
+
+# Read replicas (comma-separated DSNs). Methods marked @replica_read run there while the
+# replica's measured lag is under DB_REPLICA_MAX_LAG seconds; a user's reads stay on the
+# primary for DB_READ_YOUR_WRITES seconds after their own writes.
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_LAG_CHECK = float(os.getenv("DB_REPLICA_LAG_CHECK", "1"))
+DB_REPLICA_RETRY = float(os.getenv("DB_REPLICA_RETRY", "30"))
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", "10"))
+DB_REPLICA_CHECKOUT_TIMEOUT = float(os.getenv("DB_REPLICA_CHECKOUT_TIMEOUT", "1"))
+DB_READ_YOUR_WRITES = float(os.getenv("DB_READ_YOUR_WRITES", str(DB_REPLICA_MAX_LAG + DB_REPLICA_LAG_CHECK)))
+
+# Connection pool (DB_POOL_MAX=0 keeps the old connect-per-use behaviour)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "0"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30"))
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "5"))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,30 +45,452 @@ logging.basicConfig(
 )
 db_logger = logging.getLogger("Database")
 
+
+def connect():
+    if DB_PRIMARY_DSN:
+        return psycopg2.connect(DB_PRIMARY_DSN)
+    return psycopg2.connect(
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+    )
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class RollbackOnly(Exception):
+    """rollback() inside a nested scope with no savepoint to return to; the transaction is doomed"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections shared by every PostgresConnection."""
+
+    def __init__(self, min_size=DB_POOL_MIN, max_size=10, idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                 max_lifetime=DB_POOL_MAX_LIFETIME, checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,
+                 ping_after=DB_POOL_PING_AFTER, connect_func=connect):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self._connect = connect_func
+        self._cond = threading.Condition()
+        self._idle = []         # [(con, returned_at)], most recently used last
+        self._created = {}      # id(con) -> created_at
+        self._checked_out = {}  # id(con) -> checked_out_at
+        self._size = 0
+        self._closed = False
+        self._metrics = {
+            "checkouts": 0,
+            "connects": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "waits": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "checkout_total": 0.0,
+            "checkout_max": 0.0,
+        }
+        for _ in range(min_size):
+            con = self._new_connection()
+            with self._cond:
+                self._size += 1
+                self._idle.append((con, time.monotonic()))
+
+    def _new_connection(self):
+        con = self._connect()
+        with self._cond:
+            self._created[id(con)] = time.monotonic()
+            self._metrics["connects"] += 1
+        return con
+
+    def _discard(self, con):
+        with self._cond:
+            self._created.pop(id(con), None)
+            self._metrics["discarded"] += 1
+        try:
+            con.close()
+        except Exception:
+            db_logger.error("Error closing pooled connection", exc_info=True)
+
+    def _expired(self, con, now):
+        return now - self._created.get(id(con), now) > self.max_lifetime
+
+    def _healthy(self, con, returned_at, now):
+        if con.closed:
+            return False
+        if now - returned_at < self.ping_after:
+            return True
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1")
+            con.rollback()
+            return True
+        except Exception:
+            db_logger.warning("Pooled connection failed health check, replacing it")
+            return False
+
+    def _prune_idle(self, now):
+        # Called with the lock held; drops idle connections past idle_timeout down to min_size
+        keep = []
+        for con, returned_at in self._idle:
+            too_many = self._size > self.min_size
+            if too_many and (now - returned_at > self.idle_timeout or self._expired(con, now)):
+                self._size -= 1
+                self._discard(con)
+            else:
+                keep.append((con, returned_at))
+        self._idle = keep
+
+    # --- Checkout / return ---
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    now = time.monotonic()
+                    self._prune_idle(now)
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise PoolTimeout(f"No connection available within {self.checkout_timeout}s")
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    con = self._new_connection()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                break
+
+            con, returned_at = entry
+            now = time.monotonic()
+            if not self._expired(con, now) and self._healthy(con, returned_at, now):
+                break
+            with self._cond:
+                self._size -= 1
+                self._discard(con)
+
+        now = time.monotonic()
+        wait = now - start
+        with self._cond:
+            self._checked_out[id(con)] = now
+            self._metrics["checkouts"] += 1
+            if waited:
+                self._metrics["waits"] += 1
+            self._metrics["wait_total"] += wait
+            self._metrics["wait_max"] = max(self._metrics["wait_max"], wait)
+        return con
+
+    def putconn(self, con, discard=False):
+        now = time.monotonic()
+        with self._cond:
+            checked_out_at = self._checked_out.pop(id(con), None)
+            if checked_out_at is not None:
+                held = now - checked_out_at
+                self._metrics["checkout_total"] += held
+                self._metrics["checkout_max"] = max(self._metrics["checkout_max"], held)
+
+        if not discard and not con.closed:
+            try:
+                # never hand out a connection with an open transaction
+                if con.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    con.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or con.closed or self._closed or self._expired(con, now):
+                self._size -= 1
+                self._discard(con)
+            else:
+                self._idle.append((con, now))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for con, _ in self._idle:
+                self._size -= 1
+                self._discard(con)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._checked_out),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        checkouts = stats["checkouts"] or 1
+        stats["wait_avg"] = stats["wait_total"] / checkouts
+        stats["checkout_avg"] = stats["checkout_total"] / checkouts
+        return stats
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool configured from env, or None when DB_POOL_MAX is unset/0."""
+    global _default_pool
+    if DB_POOL_MAX <= 0:
+        return None
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool(min_size=min(DB_POOL_MIN, DB_POOL_MAX), max_size=DB_POOL_MAX)
+            db_logger.info(f"Connection pool created (min={_default_pool.min_size}, max={DB_POOL_MAX})")
+        return _default_pool
+
+
+# --- Read replicas ---
+REPLICA_LAG_SQL = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class Replica:
+    def __init__(self, dsn, max_size=DB_REPLICA_POOL_MAX, checkout_timeout=DB_REPLICA_CHECKOUT_TIMEOUT):
+        self.dsn = dsn
+        self.pool = ConnectionPool(min_size=0, max_size=max_size, checkout_timeout=checkout_timeout,
+                                   connect_func=self._connect)
+        self.lag = None          # seconds behind the primary at the last check
+        self.checked_at = 0.0
+        self.down_until = 0.0
+        self.reads = 0
+
+    def _connect(self):
+        con = psycopg2.connect(self.dsn)
+        con.set_session(readonly=True, autocommit=True)
+        return con
+
+    def measure_lag(self, con):
+        with con.cursor() as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            in_recovery, lag = cur.fetchone()
+        if not in_recovery:
+            db_logger.warning(f"Replica {self.name} is not in recovery; not routing reads to it")
+            lag = None
+        self.lag = float(lag) if lag is not None else None
+        self.checked_at = time.monotonic()
+        return self.lag
+
+    @property
+    def name(self):
+        return self.dsn.split("@")[-1]  # host part only, never the password
+
+    def stats(self):
+        return {"replica": self.name, "lag": self.lag, "reads": self.reads,
+                "down": self.down_until > time.monotonic(), "pool": self.pool.stats()}
+
+
+class ReplicaRouter:
+    """Picks a replica connection for a read, or None when the read must go to the primary"""
+
+    def __init__(self, dsns, max_lag=DB_REPLICA_MAX_LAG, lag_check=DB_REPLICA_LAG_CHECK,
+                 retry_after=DB_REPLICA_RETRY, read_your_writes=DB_READ_YOUR_WRITES):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.max_lag = max_lag
+        self.lag_check = lag_check
+        self.retry_after = retry_after
+        self.read_your_writes = read_your_writes
+        self._lock = threading.Lock()
+        self._next = 0
+        self._writes = {}  # actor -> monotonic time of their last committed write
+        self.counters = {"replica_reads": 0, "primary_reads": 0, "sticky": 0, "lagging": 0, "unavailable": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # --- Read-your-writes ---
+    def note_write(self, actor):
+        now = time.monotonic()
+        with self._lock:
+            self._writes[actor] = now
+            if len(self._writes) > 10000:
+                self._writes = {a: t for a, t in self._writes.items() if now - t < self.read_your_writes}
+
+    def sticky(self, actor):
+        with self._lock:
+            wrote_at = self._writes.get(actor)
+        return wrote_at is not None and time.monotonic() - wrote_at < self.read_your_writes
+
+    # --- Checkout ---
+    def checkout(self):
+        """(replica, connection) of a healthy replica within max_lag, else None"""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        now = time.monotonic()
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.down_until > now:
+                continue
+            con = None
+            try:
+                con = replica.pool.getconn()
+                if now - replica.checked_at >= self.lag_check:
+                    replica.measure_lag(con)
+            except Exception as e:
+                if con is not None:
+                    replica.pool.putconn(con, discard=True)
+                replica.down_until = now + self.retry_after
+                db_logger.warning(f"Replica {replica.name} unavailable for {self.retry_after:.0f}s: {e}")
+                continue
+            if replica.lag is None or replica.lag > self.max_lag:
+                replica.pool.putconn(con)
+                self._count("lagging")
+                continue
+            replica.reads += 1
+            self._count("replica_reads")
+            return replica, con
+        self._count("unavailable")
+        return None
+
+    def checkin(self, replica, con, broken=False):
+        replica.pool.putconn(con, discard=broken)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["replicas"] = [r.stats() for r in self.replicas]
+        return stats
+
+    def closeall(self):
+        for replica in self.replicas:
+            replica.pool.closeall()
+
+
+_default_router = None
+
+
+def get_router():
+    """Process-wide ReplicaRouter from DB_REPLICA_DSNS, or None without replicas"""
+    global _default_router
+    if not DB_REPLICA_DSNS:
+        return None
+    with _default_pool_lock:
+        if _default_router is None:
+            _default_router = ReplicaRouter(DB_REPLICA_DSNS)
+            db_logger.info(f"Routing marked reads over {len(DB_REPLICA_DSNS)} replicas (max lag {DB_REPLICA_MAX_LAG}s)")
+        return _default_router
+
+
+def replica_read(method):
+    """Run a manager read method (self.db) on a replica when PostgresConnection.reading() allows it"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.db.reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every statement to the PostgresConnection that owns it."""
+
+    owner = None
+
+    def execute(self, query, vars=None):
+        if self.owner is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception as e:
+            self.owner._after_query(self, query, vars, time.perf_counter() - start, e)
+            raise
+        self.owner._after_query(self, query, vars, time.perf_counter() - start)
+        return result
+
+    def executemany(self, query, vars_list):
+        if self.owner is None:
+            return super().executemany(query, vars_list)
+        start = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception as e:
+            self.owner._after_query(self, query, None, time.perf_counter() - start, e)
+            raise
+        self.owner._after_query(self, query, None, time.perf_counter() - start)
+        return result
+
+
 class PostgresConnection:
+    def __init__(self, pool=None, router=None):
+        self.pool = pool
+        self.router = router if router is not None else get_router()
+        self.actor = None          # user the current work is done for (read-your-writes key)
+        self.con = None
+        self.cur = None
+        self._primary_cur = None
+        self._reader = None        # (replica, con) while a reading() scope is routed
+        self._tx_wrote = False     # the open transaction has written; its reads stay on the primary
+        self._last_write = 0.0
+        self._scopes = []          # one entry per open transaction() scope: savepoint name or None
+        self._rollback_only = False
+        self._doomed = set()       # savepoints a nested rollback() returned to; undone again on scope exit
+        self.query_hooks = []      # hook(sql, params, elapsed, rowcount, error) after every statement
+        self._explaining = False
+
     def __enter__(self):
         try:
-            db_logger.info("Connecting to database ...")
-            self.con = psycopg2.connect(
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                host=DB_HOST,
-                port=DB_PORT,
-            )
-            self.cur = self.con.cursor()
-            db_logger.info("Connection established successfully!")
+            if self.pool:
+                self.con = self.pool.getconn()
+            else:
+                db_logger.info("Connecting to database ...")
+                self.con = connect()
+            self.cur = self._primary_cur = self.con.cursor(cursor_factory=TimedCursor)
+            self.cur.owner = self
+            if not self.pool:
+                db_logger.info("Connection established successfully!")
             return self
         except Exception as e:
             db_logger.error(f"Error connecting to database: {e}")
+            if self.pool and self.con:
+                self.pool.putconn(self.con, discard=True)
             raise e
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.cur:
             self.cur.close()
         if self.con:
-            self.con.close()
-        db_logger.info("Connection closed.")
+            if self.pool:
+                self.pool.putconn(self.con)
+            else:
+                self.con.close()
+                db_logger.info("Connection closed.")
+        self.cur = self._primary_cur = None
+        self.con = None
 
     def create_tables(self):
         try:
@@ -65,7 +515,10 @@ class PostgresConnection:
                     price_per_seat DECIMAL(10,2) NOT NULL,
                     departure_time VARCHAR(50),
                     arrival_time VARCHAR(50),
-                    route VARCHAR(200)
+                    route VARCHAR(200),
+                    available_seats INTEGER,
+                    seat_map BYTEA,
+                    ticket_version BIGINT NOT NULL DEFAULT 0
                 )
             """)
             # SEATS
@@ -78,6 +531,18 @@ class PostgresConnection:
                     UNIQUE(bus_id, seat_number)
                 )
             """)
+            # Maintained free-seat counter; backfill buses created before it existed
+            self.cur.execute("ALTER TABLE buses ADD COLUMN IF NOT EXISTS available_seats INTEGER")
+            # Bitmap seat inventory (NULL for buses using seat rows)
+            self.cur.execute("ALTER TABLE buses ADD COLUMN IF NOT EXISTS seat_map BYTEA")
+            # Bumped with every seat/ticket change on the bus; report memoization watermark
+            self.cur.execute("ALTER TABLE buses ADD COLUMN IF NOT EXISTS ticket_version BIGINT NOT NULL DEFAULT 0")
+            self.cur.execute("""
+                UPDATE buses b SET available_seats = (
+                    SELECT COUNT(*) FROM seats s WHERE s.bus_id = b.bus_id AND s.is_booked = FALSE
+                )
+                WHERE b.available_seats IS NULL
+            """)
             # TICKETS
             self.cur.execute("""
                 CREATE TABLE IF NOT EXISTS tickets (
@@ -85,11 +550,13 @@ class PostgresConnection:
                     user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
                     bus_id INTEGER REFERENCES buses(bus_id) ON DELETE CASCADE,
                     seat_id INTEGER REFERENCES seats(seat_id) ON DELETE CASCADE,
+                    seat_number INTEGER,
                     purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     price DECIMAL(10,2) NOT NULL,
                     status VARCHAR(20) DEFAULT 'PAID'
                 )
             """)
+            self.cur.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS seat_number INTEGER")
             # TRANSACTIONS
             self.cur.execute("""
                 CREATE TABLE IF NOT EXISTS transactions (
@@ -109,6 +576,18 @@ class PostgresConnection:
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # TICKET ROLLUPS (per bus, per purchase day)
+            self.cur.execute("""
+                CREATE TABLE IF NOT EXISTS ticket_rollups (
+                    bus_id INTEGER REFERENCES buses(bus_id) ON DELETE CASCADE,
+                    day DATE NOT NULL,
+                    paid INTEGER NOT NULL DEFAULT 0,
+                    cancelled INTEGER NOT NULL DEFAULT 0,
+                    used INTEGER NOT NULL DEFAULT 0,
+                    paid_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bus_id, day)
+                )
+            """)
             # REPORTS
             self.cur.execute("""
                 CREATE TABLE IF NOT EXISTS reports (
@@ -116,9 +595,20 @@ class PostgresConnection:
                     report_type VARCHAR(50),
                     generated_by INTEGER REFERENCES users(user_id),
                     generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    details TEXT
+                    details TEXT,
+                    params TEXT,
+                    watermark TEXT,
+                    result TEXT
                 )
             """)
+            # Memoized report lookup: latest row per (type, params)
+            self.cur.execute("ALTER TABLE reports ADD COLUMN IF NOT EXISTS params TEXT")
+            self.cur.execute("ALTER TABLE reports ADD COLUMN IF NOT EXISTS watermark TEXT")
+            self.cur.execute("ALTER TABLE reports ADD COLUMN IF NOT EXISTS result TEXT")
+            self.cur.execute("""
+                CREATE INDEX IF NOT EXISTS reports_memo_idx
+                ON reports (report_type, params, generated_at DESC)
+            """)
             self.con.commit()
             db_logger.info ("Tables successfully created.")
 
@@ -140,6 +630,52 @@ class PostgresConnection:
                     self.con.rollback()
                     db_logger.info("Error creating default admin!")
 
+    # --- Query timing ---
+    def add_query_hook(self, hook):
+        self.query_hooks.append(hook)
+
+    def remove_query_hook(self, hook):
+        if hook in self.query_hooks:
+            self.query_hooks.remove(hook)
+
+    def _after_query(self, cur, sql, params, elapsed, error=None):
+        rowcount = cur.rowcount if error is None else -1
+        if self.router and cur is self._primary_cur and error is None and is_write(sql):
+            self._tx_wrote = True
+        if DB_STATS_ENABLED:
+            query_stats.record(sql, params, elapsed, rowcount, error)
+        for hook in self.query_hooks:
+            try:
+                hook(sql, params, elapsed, rowcount, error)
+            except Exception:
+                db_logger.error("Query hook failed", exc_info=True)
+        if error is None and elapsed * 1000 >= DB_SLOW_QUERY_MS and not self._explaining:
+            plan = self._explain(cur.connection, sql, params) if DB_EXPLAIN_SLOW and is_read_only(sql) else None
+            log_slow_query(sql, params, elapsed, rowcount, plan)
+
+    def _explain(self, con, sql, params):
+        """EXPLAIN ANALYZE of a slow read-only statement on the connection that ran it, inside
+        a savepoint so a failure cannot abort the caller's transaction."""
+        self._explaining = True
+        cur = con.cursor()
+        savepoint = not con.autocommit
+        try:
+            if savepoint:
+                cur.execute("SAVEPOINT query_explain")
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+            plan = [row[0] for row in cur.fetchall()]
+            if savepoint:
+                cur.execute("RELEASE SAVEPOINT query_explain")
+            return plan
+        except Exception as e:
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT query_explain")
+            db_logger.warning(f"Could not capture plan for slow query: {e}")
+            return None
+        finally:
+            cur.close()
+            self._explaining = False
+
     # --- Query Helpers ---
     def execute_query(self, query, params=None):
         try:
@@ -174,16 +710,167 @@ class PostgresConnection:
             db_logger.error("Error fetching data", exc_info= True)
             return []
 
+    # --- Streaming ---
+    def stream(self, query, params=None, batch_size=2000):
+        """Yield rows through a named (server-side) cursor, batch_size rows per round trip.
+        Must be consumed inside the transaction that opened it."""
+        self._stream_seq = getattr(self, "_stream_seq", 0) + 1
+        cur = self.con.cursor(name=f"stream_{id(self)}_{self._stream_seq}")
+        cur.itersize = batch_size
+        try:
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+
+    def copy_to(self, query, params, file, header=True):
+        """COPY (query) TO STDOUT as CSV straight into file"""
+        sql = self.cur.mogrify(query, params).decode() if params else query
+        options = "FORMAT csv, HEADER" if header else "FORMAT csv"
+        self.cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH ({options})", file)
+
+    # --- Read routing ---
+    def _wrote(self, committed):
+        if self._tx_wrote and committed:
+            self._last_write = time.monotonic()
+            self.router.note_write(self.actor)
+        self._tx_wrote = False
+
+    def _can_use_replica(self):
+        if not self.router or self._tx_wrote or self.cur is not self._primary_cur:
+            return False
+        if self.actor is None:
+            # no user to key on: this connection's own writes decide
+            sticky = time.monotonic() - self._last_write < self.router.read_your_writes
+        else:
+            sticky = self.router.sticky(self.actor)
+        if sticky:
+            self.router._count("sticky")
+        return not sticky
+
+    @contextmanager
+    def reading(self):
+        """Scope whose statements run on a replica when one is fresh enough and the reads
+        cannot miss this user's recent or uncommitted writes; otherwise on the primary."""
+        picked = self.router.checkout() if self._can_use_replica() else None
+        if picked is None:
+            if self.router:
+                self.router._count("primary_reads")
+            yield self
+            return
+        replica, con = picked
+        cur = con.cursor(cursor_factory=TimedCursor)
+        cur.owner = self
+        self._reader = picked
+        self.cur = cur
+        broken = False
+        try:
+            yield self
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.cur = self._primary_cur
+            self._reader = None
+            cur.close()
+            self.router.checkin(replica, con, broken)
+
     def commit(self):
+        if self._scopes:
+            # the outermost transaction() scope commits
+            return
         try:
             self.con.commit()
+            self._wrote(True)
         except Exception:
             db_logger.error("Error commiting", exc_info=True)
 
     def rollback(self):
+        """Undo the current scope: back to the nearest enclosing savepoint, or the whole
+        transaction when called outside nested scopes. A nested scope with no savepoint
+        above it cannot be undone on its own; the transaction is marked rollback-only
+        and RollbackOnly is raised so enclosing code sees the failure."""
+        savepoint = next((name for name in reversed(self._scopes) if name), None)
+        if savepoint is None and len(self._scopes) > 1:
+            self._rollback_only = True
+            raise RollbackOnly("Rollback inside a nested transaction scope without a savepoint")
         try:
+            if savepoint:
+                self.cur.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                if savepoint != self._scopes[-1]:
+                    # inner scopes keep running; whatever they do next goes too
+                    self._doomed.add(savepoint)
+                return
             self.con.rollback()
+            self._wrote(False)
+            if self._scopes:
+                # the unit of work is gone; make sure nothing after this gets committed
+                self._rollback_only = True
         except Exception:
             db_logger.error("Error rolling back", exc_info= True)
 
+    # --- Unit of work ---
+    @contextmanager
+    def transaction(self, savepoint=False):
+        """Transaction scope: the outermost scope commits once, nested scopes join it
+        or, with savepoint=True, can be rolled back on their own. A scope opened inside a
+        routed reading() runs on the primary."""
+        reader_cur = None
+        if self.cur is not self._primary_cur:
+            reader_cur, self.cur = self.cur, self._primary_cur
+            last_write = self._last_write
+        outermost = not self._scopes
+        name = None
+        if outermost:
+            self._rollback_only = False
+            self._doomed.clear()
+        elif savepoint:
+            name = f"uow_{len(self._scopes)}"
+            self.cur.execute(f"SAVEPOINT {name}")
+        self._scopes.append(name)
+        try:
+            yield self
+        except BaseException:
+            self._scopes.pop()
+            if outermost:
+                self._rollback_only = False
+                self.con.rollback()
+                self._wrote(False)
+            elif name:
+                self._doomed.discard(name)
+                self.cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                self.cur.execute(f"RELEASE SAVEPOINT {name}")
+            else:
+                self._rollback_only = True
+            raise
+        else:
+            self._scopes.pop()
+            if outermost:
+                if self._rollback_only:
+                    self._rollback_only = False
+                    self.con.rollback()
+                    self._wrote(False)
+                else:
+                    self.con.commit()
+                    self._wrote(True)
+            elif name:
+                if name in self._doomed:
+                    self._doomed.discard(name)
+                    self.cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                self.cur.execute(f"RELEASE SAVEPOINT {name}")
+        finally:
+            # back to the replica only if nothing was written that later reads must see
+            if reader_cur is not None and not self._tx_wrote and self._last_write == last_write:
+                self.cur = reader_cur
+
+    @property
+    def in_transaction(self):
+        return bool(self._scopes)
+
+    @property
+    def rollback_only(self):
+        """The open transaction can no longer commit; its outermost scope will roll it back"""
+        return self._rollback_only
+
    
\ No newline at end of file
@@ -0,0 +1,99 @@
+import json
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+from db_connect import db_logger
+
+# name -> (columns, query); filters are appended as AND clauses
+EXPORTS = {
+    "tickets": (
+        ("ticket_id", "user_id", "bus_id", "seat_id", "seat_number", "purchase_date", "price", "status"),
+        "SELECT ticket_id, user_id, bus_id, seat_id, seat_number, purchase_date, price, status FROM tickets",
+        "purchase_date",
+    ),
+    "transactions": (
+        ("transaction_id", "user_id", "type", "amount", "timestamp"),
+        "SELECT transaction_id, user_id, type, amount, timestamp FROM transactions",
+        "timestamp",
+    ),
+    "audit_log": (
+        ("log_id", "actor_id", "action", "timestamp"),
+        "SELECT log_id, actor_id, action, timestamp FROM audit_log",
+        "timestamp",
+    ),
+    "reports": (
+        ("report_id", "report_type", "generated_by", "generated_at", "details"),
+        "SELECT report_id, report_type, generated_by, generated_at, details FROM reports",
+        "generated_at",
+    ),
+}
+
+FORMATS = ("csv", "ndjson")
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+class Exporter:
+    """Constant-memory table exports: CSV via COPY TO STDOUT, NDJSON via a server-side cursor"""
+
+    def __init__(self, db, batch_size=5000):
+        self.db = db
+        self.batch_size = batch_size
+
+    def _query(self, table, user_id=None, since=None, until=None):
+        if table not in EXPORTS:
+            raise ValueError(f"Unknown export '{table}', choose from {', '.join(EXPORTS)}")
+        columns, query, time_column = EXPORTS[table]
+        clauses, params = [], []
+        if user_id is not None:
+            if "user_id" not in columns:
+                raise ValueError(f"'{table}' cannot be filtered by user")
+            clauses.append("user_id = %s")
+            params.append(user_id)
+        if since is not None:
+            clauses.append(f"{time_column} >= %s")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{time_column} < %s")
+            params.append(until)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += f" ORDER BY {columns[0]}"
+        return columns, query, tuple(params)
+
+    def rows(self, table, **filters):
+        """Generator over export rows as dicts"""
+        columns, query, params = self._query(table, **filters)
+        for row in self.db.stream(query, params, self.batch_size):
+            yield dict(zip(columns, row))
+
+    def export(self, table, out, fmt="csv", **filters):
+        """Write table to the text file out; returns the number of rows (None for CSV, which streams via COPY)"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}'")
+        if fmt == "csv":
+            _, query, params = self._query(table, **filters)
+            self.db.copy_to(query, params, out)
+            db_logger.info(f"Exported {table} as CSV")
+            return None
+
+        count = 0
+        for record in self.rows(table, **filters):
+            out.write(json.dumps(record, default=_json_value))
+            out.write("\n")
+            count += 1
+        db_logger.info(f"Exported {count} {table} rows as NDJSON")
+        return count
+
+
+def export_to_path(db, table, path=None, fmt="csv", **filters):
+    if not path or path == "-":
+        return Exporter(db).export(table, sys.stdout, fmt, **filters)
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        return Exporter(db).export(table, out, fmt, **filters)
@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import os
+from decimal import Decimal, InvalidOperation
+from audit_log import AuditLogger
+from bus import BusManager
+from db_connect import db_logger
+
+COLUMNS = ("bus_name", "bus_number", "total_seats", "price_per_seat", "departure_time", "arrival_time", "route")
+REQUIRED = ("bus_name", "bus_number", "total_seats", "price_per_seat")
+MAX_SEATS = 1000
+# Column limits of the buses table; rows over them are rejected here instead of failing the COPY
+MAX_LENGTHS = {"bus_name": 100, "bus_number": 50, "departure_time": 50, "arrival_time": 50, "route": 200}
+MAX_PRICE = Decimal("99999999.99")  # DECIMAL(10,2)
+
+# Buses come from the COPY-loaded staging table; duplicates of existing bus
+# numbers are skipped by ON CONFLICT and reported back from the missing rows.
+IMPORT_ROWS_SQL = """
+    WITH inserted AS (
+        INSERT INTO buses (bus_name, bus_number, total_seats, price_per_seat,
+                           departure_time, arrival_time, route, available_seats)
+        SELECT bus_name, bus_number, total_seats, price_per_seat,
+               departure_time, arrival_time, route, total_seats
+        FROM bus_import
+        ORDER BY line
+        ON CONFLICT (bus_number) DO NOTHING
+        RETURNING bus_id, bus_number, total_seats
+    ),
+    seats AS (
+        INSERT INTO seats (bus_id, seat_number)
+        SELECT i.bus_id, n FROM inserted i, generate_series(1, i.total_seats) AS n
+    )
+    SELECT bus_number, bus_id FROM inserted
+"""
+
+IMPORT_BITMAP_SQL = """
+    INSERT INTO buses (bus_name, bus_number, total_seats, price_per_seat,
+                       departure_time, arrival_time, route, available_seats, seat_map)
+    SELECT bus_name, bus_number, total_seats, price_per_seat,
+           departure_time, arrival_time, route, total_seats,
+           decode(repeat('00', (total_seats + 7) / 8), 'hex')
+    FROM bus_import
+    ORDER BY line
+    ON CONFLICT (bus_number) DO NOTHING
+    RETURNING bus_number, bus_id
+"""
+
+
+def read_records(path, fmt=None):
+    """Yield (line_number, dict) from a CSV (with header) or JSONL file"""
+    fmt = fmt or ("jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson", ".json") else "csv")
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = {"_error": f"invalid JSON: {e}"}
+                yield line_number, record
+
+
+def validate(record):
+    """Normalized row tuple for the staging table, or an error message"""
+    if not isinstance(record, dict):
+        return None, "record must be an object"
+    if "_error" in record:
+        return None, record["_error"]
+    values = {c: record.get(c) for c in COLUMNS}
+    for column in COLUMNS:
+        if column in MAX_LENGTHS and values[column] is not None and not isinstance(values[column], str):
+            values[column] = str(values[column])
+        if isinstance(values[column], str):
+            values[column] = values[column].strip() or None
+    missing = [c for c in REQUIRED if values[c] in (None, "")]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    for column, limit in MAX_LENGTHS.items():
+        if values[column] is not None and len(values[column]) > limit:
+            return None, f"{column} longer than {limit} characters"
+    try:
+        total_seats = int(values["total_seats"])
+    except (TypeError, ValueError):
+        return None, "total_seats must be an integer"
+    if not 1 <= total_seats <= MAX_SEATS:
+        return None, f"total_seats must be between 1 and {MAX_SEATS}"
+    try:
+        price = Decimal(str(values["price_per_seat"]))
+    except InvalidOperation:
+        return None, "price_per_seat must be a number"
+    if not price.is_finite() or price < 0:
+        return None, "price_per_seat must be non-negative"
+    # checked before and after rounding: 99999999.995 rounds up past the column's range
+    if price > MAX_PRICE or price.quantize(Decimal("0.01")) > MAX_PRICE:
+        return None, f"price_per_seat must be at most {MAX_PRICE}"
+    values["total_seats"] = total_seats
+    values["price_per_seat"] = price.quantize(Decimal("0.01"))
+    return tuple(values[c] for c in COLUMNS), None
+
+
+class FleetImporter:
+    """Loads many buses in one transaction: COPY into a staging table, then set-based bus and seat inserts"""
+
+    def __init__(self, db, bus_manager=None):
+        self.db = db
+        self.bus_manager = bus_manager
+        self.audit = AuditLogger(db)
+
+    def import_records(self, admin_id, records):
+        """records: iterable of (line_number, dict). Returns {"inserted": n, "errors": [...]}"""
+        errors = []
+        staged = {}  # bus_number -> line
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for line, record in records:
+            row, error = validate(record)
+            if error:
+                bus_number = record.get("bus_number") if isinstance(record, dict) else None
+                errors.append({"line": line, "bus_number": bus_number, "error": error})
+                continue
+            bus_number = row[1]
+            if bus_number in staged:
+                errors.append({"line": line, "bus_number": bus_number, "error": f"duplicate of line {staged[bus_number]}"})
+                continue
+            staged[bus_number] = line
+            writer.writerow((line,) + row)
+
+        if not staged:
+            return {"inserted": 0, "errors": errors}
+
+        bitmap = getattr(self.bus_manager, "SEAT_INVENTORY", "rows") == "bitmap"
+        try:
+            with self.db.transaction():
+                self.db.cur.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS bus_import (
+                        line INTEGER,
+                        bus_name VARCHAR(100),
+                        bus_number VARCHAR(50),
+                        total_seats INTEGER,
+                        price_per_seat DECIMAL(10,2),
+                        departure_time VARCHAR(50),
+                        arrival_time VARCHAR(50),
+                        route VARCHAR(200)
+                    ) ON COMMIT DROP
+                """)
+                self.db.cur.execute("TRUNCATE bus_import")
+                buf.seek(0)
+                self.db.cur.copy_expert(
+                    "COPY bus_import (line, " + ", ".join(COLUMNS) + ") FROM STDIN WITH (FORMAT csv)", buf
+                )
+                self.db.cur.execute(IMPORT_BITMAP_SQL if bitmap else IMPORT_ROWS_SQL)
+                inserted = dict(self.db.cur.fetchall())  # bus_number -> bus_id
+                (self.bus_manager or BusManager(self.db)).sync_trips(list(inserted.values()))
+                self.audit.log(admin_id, f"Imported {len(inserted)} buses")
+        except Exception:
+            db_logger.exception("Error importing buses")
+            raise
+
+        for bus_number, line in staged.items():
+            if bus_number not in inserted:
+                errors.append({"line": line, "bus_number": bus_number, "error": "bus number already exists"})
+        errors.sort(key=lambda e: e["line"])
+
+        if self.bus_manager is not None:
+            self.bus_manager.cache.invalidate(("buses",), ("routes",))
+        db_logger.info(f"Imported {len(inserted)} buses, {len(errors)} rows rejected.")
+        return {"inserted": len(inserted), "errors": errors}
+
+    def import_file(self, admin_id, path, fmt=None):
+        return self.import_records(admin_id, read_records(path, fmt))
@@ -1,4 +1,6 @@
 from db_connect import PostgresConnection
+from migrations import Migrator
 
 with PostgresConnection() as db:
     db.create_tables()
+    Migrator(db).migrate()
@@ -1,26 +1,43 @@
 import argparse
-from db_connect import PostgresConnection
+import os
+from db_connect import PostgresConnection, get_pool
 from users import UserManager
-from bus import BusManager
+from seat_map import make_bus_manager
+from bus import SEAT_PREFERENCES
 from ticket import TicketManager
-from wallet import WalletManager
-from audit_log import AuditLogger
+from wallet_ledger import LedgerWalletManager, WALLET_MODE, make_wallet_manager
+from audit_log import AuditLogger, close_audit_writer
 from reports import ReportManager
+from search import SEARCH_MIN_SEATS, SearchManager
+from export import EXPORTS, FORMATS, export_to_path
+from rollups import RollupManager
+from counters import CounterManager
+from fleet_import import FleetImporter
+from migrations import Migrator
+from partitions import PARTITION_ARCHIVE_DIR, PARTITION_PREMAKE, PARTITION_RETENTION_MONTHS, PARTITIONED_TABLES, PartitionManager
+from query_stats import DB_STATS_FILE, QueryStats, flush_query_stats
+from batch import run_batch
+from server import SERVICE_CONCURRENCY, SERVICE_HOST, SERVICE_PORT, serve
 from db_connect import db_logger
 
 
+# Commands that queue seat and rollup counter changes (counters.py)
+COUNTER_COMMANDS = ("book", "cancel")
+
+
 class BusReservationSystem:
     def __init__(self, db):
         self.db = db
         self.user_manager = UserManager(self.db)
-        self.bus_manager = BusManager(self.db)
-        self.ticket_manager = TicketManager(self.db)
-        self.wallet_manager = WalletManager(self.db)
+        self.bus_manager = make_bus_manager(self.db)
+        self.wallet_manager = make_wallet_manager(self.db)
+        self.ticket_manager = TicketManager(self.db, self.bus_manager, self.wallet_manager)
         self.audit = AuditLogger(self.db)
         self.report_manager = ReportManager(self.db)
+        self.search_manager = SearchManager(self.db)
 
     def register(self, name, email, password):
-        self.user_manager.register_user(name, email, password)
+        return self.user_manager.register_user(name, email, password)
 
     def login(self, email, password):
         return self.user_manager.login_user(email, password)
@@ -32,26 +49,48 @@ class BusReservationSystem:
             db_logger.info(f"Bus '{bus_name}' added successfully.")
         else:
             db_logger.info(f"Failed to add bus: {bus_name} ({bus_number})")
+        return success
+
+    def import_buses(self, admin_id, path, fmt=None):
+        try:
+            result = FleetImporter(self.db, self.bus_manager).import_file(admin_id, path, fmt)
+        except Exception as e:
+            print(f"Import failed, no buses were added: {e}")
+            return None
+        for e in result["errors"]:
+            print(f"Line {e['line']} ({e['bus_number']}): {e['error']}")
+        print(f"Imported {result['inserted']} buses, {len(result['errors'])} rows rejected.")
+        return result
 
     def book_ticket(self, user_id, bus_id, seat_number):
-        buses = self.bus_manager.get_all_buses()
-        bus = next((b for b in buses if b["bus_id"] == bus_id), None)
-        if not bus:
+        seat = self.bus_manager.resolve_seat(bus_id, seat_number)
+        if not seat:
             db_logger.info("Bus not found.")
-            return
+            return False
+        if not seat["exists"]:
+            db_logger.info(f"Seat {seat_number} not found on bus {bus_id}.")
+            return False
 
-        price = bus["price_per_seat"]
-        seats = self.bus_manager.get_available_seats(bus_id)
-        seat = next((s for s in seats if s["seat_number"] == seat_number), None)
-        if not seat:
+        price = seat["price_per_seat"]
+        if not seat["available"]:
             db_logger.info("Seat not available.")
-            return
+            return False
 
-        success = self.ticket_manager.buy_ticket(user_id, bus_id, seat["seat_id"], price)
+        success = self.ticket_manager.buy_ticket(user_id, bus_id, seat["seat_id"], price, seat_number)
         if success:
             self.audit.log(user_id, f"Booked seat {seat_number} on bus {bus_id}")
         else:
             db_logger.info(f"Failed to book seat {seat_number} on bus {bus_id}")
+        return success
+
+    def book_any_seat(self, user_id, bus_id, preferences=None):
+        result = self.ticket_manager.purchase_any_seat(user_id, bus_id, preferences)
+        if result["ticket_id"]:
+            self.audit.log(user_id, f"Booked seat {result['seat_number']} on bus {bus_id}")
+            print(f"Booked seat {result['seat_number']} (ticket {result['ticket_id']}).")
+        else:
+            db_logger.info(f"Failed to book a seat on bus {bus_id}")
+        return result
 
     def cancel_ticket(self, user_id, ticket_id):
         success = self.ticket_manager.cancel_ticket(user_id, ticket_id)
@@ -59,6 +98,7 @@ class BusReservationSystem:
             self.audit.log(user_id, f"Cancelled ticket {ticket_id}")
         else:
             db_logger.info(f"Failed to cancel ticket {ticket_id}")
+        return success
 
     def add_money(self, user_id, amount):
         success = self.wallet_manager.add_balance(user_id, amount, "Wallet deposit")
@@ -66,23 +106,138 @@ class BusReservationSystem:
             self.audit.log(user_id, f"Wallet topped up by ${amount:.2f}")
         else:
             db_logger.info(f"Failed to add ${amount:.2f} to wallet for user {user_id}")
+        return success
 
     def show_balance(self, user_id):
         balance = self.wallet_manager.get_balance(user_id)
         print(f"Wallet Balance: ${balance:.2f}")
 
-    def show_transactions(self, user_id):
-        self.wallet_manager.show_transactions(user_id)
+    def show_transactions(self, user_id, page_size=None, cursor=None, since=None):
+        page = self.wallet_manager.get_transactions_page(user_id, page_size, cursor, since)
+        if not page["items"]:
+            db_logger.info(f"No transactions found for user {user_id}.")
+            return
+        for t in page["items"]:
+            print(f"[{t['timestamp']}] ({t['type']}) {t['amount']:.2f} (id={t['transaction_id']})")
+        self._print_next_page(page)
 
-    def show_buses(self):
-        buses = self.bus_manager.get_all_buses()
-        if not buses:
+    def show_buses(self, page_size=None, cursor=None):
+        page = self.bus_manager.get_buses_page(page_size, cursor)
+        if not page["items"]:
             db_logger.info("No buses found")
             return
         print("Available Buses:")
-        for b in buses:
+        for b in page["items"]:
             print(f"ID {b['bus_id']} - {b['bus_name']} | Route: {b['route']} | "
                   f"Seats: {b['available_seats']}/{b['total_seats']} | Price: ${b['price_per_seat']:.2f}")
+        self._print_next_page(page)
+
+    def search_trips(self, origin=None, destination=None, date_from=None, date_to=None, min_seats=SEARCH_MIN_SEATS,
+                     max_price=None, page_size=None, cursor=None):
+        try:
+            page = self.search_manager.search(origin, destination, date_from, date_to, min_seats, max_price,
+                                              page_size, cursor)
+        except ValueError as e:
+            db_logger.error(str(e))
+            return
+        if not page["items"]:
+            db_logger.info("No trips found")
+            return
+        for t in page["items"]:
+            departs = t["departure_at"] or t["departure_time"] or "?"
+            print(f"ID {t['bus_id']} - {t['bus_name']} | {t['origin']} -> {t['destination']} | "
+                  f"Departs: {departs} | Price: ${t['price_per_seat']:.2f} | Free seats: {t['available_seats']}")
+        self._print_next_page(page)
+
+    def complete_city(self, prefix, origin=None, limit=10):
+        for c in self.search_manager.complete(prefix, limit, origin):
+            print(f"{c['city']} ({c['trips']} trips)")
+
+    @staticmethod
+    def _print_next_page(page):
+        if page["next_cursor"]:
+            print(f"More results: --cursor {page['next_cursor']}")
+
+    def check_seat_counters(self, repair=False):
+        drifted = self.bus_manager.check_seat_counters(repair)
+        if not drifted:
+            print("Seat counters are consistent.")
+            return
+        for d in drifted:
+            print(f"Bus {d['bus_id']}: stored {d['stored']}, actual {d['actual']}")
+        print(f"{len(drifted)} buses {'repaired' if repair else 'drifted'}.")
+
+    def check_rollups(self, rebuild=False):
+        rollups = RollupManager(self.db)
+        if rebuild:
+            rollups.rebuild()
+        drift = rollups.verify()
+        if not drift:
+            print("Revenue rollups match tickets.")
+            return
+        for d in drift:
+            print(f"Bus {d['bus_id']} on {d['day']}: stored {d['stored']}, actual {d['actual']}")
+        print(f"{len(drift)} rollup buckets drifted; run with --rebuild to recompute.")
+
+    def fold_counters(self):
+        counters = CounterManager(self.db)
+        folded = counters.fold()
+        print(f"Folded {folded} queued counter changes; {counters.pending()} pending.")
+
+    def wallet_maintenance(self, admin_id, action, user_id=None, shards=None, repair=False):
+        if not isinstance(self.wallet_manager, LedgerWalletManager):
+            print(f"Wallet maintenance needs WALLET_MODE=ledger (current: {WALLET_MODE}).")
+            return None
+        if action == "adopt":
+            adopted = self.wallet_manager.adopt()
+            print(f"Ledger wallet adopted for {adopted} accounts.")
+            self.audit.log(admin_id, f"Ledger wallet adopted for {adopted} accounts")
+        elif action == "snapshot":
+            updated = self.wallet_manager.snapshot()
+            print(f"Snapshots updated for {updated} accounts.")
+            self.audit.log(admin_id, f"Wallet snapshots updated for {updated} accounts")
+        elif action == "shards":
+            if user_id is None or shards is None:
+                print("shards needs --user-id and --shards")
+                return None
+            if self.wallet_manager.rebalance(user_id, shards):
+                print(f"User {user_id} wallet spread over {shards} shards.")
+                self.audit.log(admin_id, f"User {user_id} wallet spread over {shards} shards")
+        else:
+            drift = self.wallet_manager.reconcile(repair)
+            for d in drift:
+                print(f"User {d['user_id']}: shards {d['shards']}, ledger {d['ledger']}")
+            print(f"{len(drift)} wallets {'rebalanced' if repair else 'drifted'}." if drift else "Wallets match the ledger.")
+            self.audit.log(admin_id, f"Wallet reconcile: {len(drift)} wallets {'rebalanced' if repair else 'drifted'}")
+            return drift
+
+    def manage_partitions(self, admin_id, action, months=None, archive_dir=None, keep=False, table=None):
+        partitions = PartitionManager(self.db)
+        if action == "ensure":
+            created = partitions.ensure_partitions(PARTITION_PREMAKE if months is None else months)
+            print(f"Created {len(created)} partitions." + (f" ({', '.join(created)})" if created else ""))
+            self.audit.log(admin_id, f"Created {len(created)} history partitions")
+        elif action == "retain":
+            archived = partitions.retain(PARTITION_RETENTION_MONTHS if months is None else months,
+                                         archive_dir or PARTITION_ARCHIVE_DIR, not keep, table)
+            for path in archived:
+                print(f"Archived {path}")
+            print(f"{len(archived)} partitions archived{' and kept detached' if keep and archived else ''}.")
+            self.audit.log(admin_id, f"Archived {len(archived)} history partitions"
+                                     + (" (kept detached)" if keep else "") + (f" of {table}" if table else ""))
+        else:
+            for name in ([table] if table else PARTITIONED_TABLES):
+                if not partitions.is_partitioned(name):
+                    print(f"{name}: not partitioned (run migrate)")
+                    continue
+                for p in partitions.partitions(name):
+                    bounds = "DEFAULT" if p["default"] else f"{p['from'] or 'MINVALUE'} .. {p['to'] or 'MAXVALUE'}"
+                    print(f"{p['name']:32} {bounds:44} ~{p['rows']} rows")
+
+    def prune_reports(self, admin_id, days=None):
+        deleted = self.report_manager.prune_reports(days)
+        print(f"Deleted {deleted} old reports.")
+        self.audit.log(admin_id, f"Pruned {deleted} old reports")
 
     def show_income_report(self, admin_id, bus_id=None):
         if bus_id:
@@ -96,11 +251,91 @@ class BusReservationSystem:
         stats = self.report_manager.get_trip_statistics(admin_id)
         print(f"Total Trips: {stats['trips']}, Tickets Sold: {stats['tickets']}, Income: ${stats['income']:.2f}")
 
-    def show_audit_log(self, limit=10):
-        self.audit.show_logs(limit)
+    def export(self, admin_id, table, path=None, fmt="csv", user_id=None, since=None, until=None):
+        try:
+            export_to_path(self.db, table, path, fmt, user_id=user_id, since=since, until=until)
+        except ValueError as e:
+            db_logger.error(str(e))
+            return False
+        self.audit.log(admin_id, f"Exported {table} as {fmt}" + (f" for user {user_id}" if user_id is not None else ""))
+        return True
 
+    def show_audit_log(self, limit=10, cursor=None, since=None):
+        next_cursor = self.audit.show_logs(limit, cursor, since)
+        if next_cursor:
+            print(f"More results: --cursor {next_cursor}")
 
-def main():
+
+def run_command(system, args):
+    if args.command == "register":
+        system.register(args.name, args.email, args.password)
+
+    elif args.command == "login":
+        system.login(args.email, args.password)
+
+    elif args.command == "addbus":
+        system.add_bus(args.admin_id, args.name, args.number, args.seats, args.price, args.departure, args.arrival, args.route)
+
+    elif args.command == "importbuses":
+        system.import_buses(args.admin_id, args.path, args.format)
+
+    elif args.command == "book":
+        if args.seat_number is None:
+            system.book_any_seat(args.user_id, args.bus_id, args.prefer)
+        else:
+            system.book_ticket(args.user_id, args.bus_id, args.seat_number)
+
+    elif args.command == "cancel":
+        system.cancel_ticket(args.user_id, args.ticket_id)
+
+    elif args.command == "addmoney":
+        system.add_money(args.user_id, args.amount)
+
+    elif args.command == "balance":
+        system.show_balance(args.user_id)
+
+    elif args.command == "transactions":
+        system.show_transactions(args.user_id, args.page_size, args.cursor, args.since)
+
+    elif args.command == "buses":
+        system.show_buses(args.page_size, args.cursor)
+
+    elif args.command == "search":
+        if args.complete is not None:
+            system.complete_city(args.complete, args.origin)
+        else:
+            system.search_trips(args.origin, args.destination, args.date or args.after, args.date or args.before,
+                                args.min_seats, args.max_price, args.page_size, args.cursor)
+
+    elif args.command == "seatcounts":
+        system.check_seat_counters(args.repair)
+
+    elif args.command == "rollups":
+        system.check_rollups(args.rebuild)
+
+    elif args.command == "counters":
+        system.fold_counters()
+
+    elif args.command == "report":
+        system.show_income_report(args.admin_id, args.bus)
+
+    elif args.command == "prunereports":
+        system.prune_reports(args.admin_id, args.days)
+
+    elif args.command == "stats":
+        system.show_stats(args.admin_id)
+
+    elif args.command == "audit":
+        system.show_audit_log(args.limit, args.cursor, args.since)
+
+    elif args.command == "wallet":
+        system.wallet_maintenance(args.admin_id, args.action, args.user_id, args.shards, args.repair)
+
+    elif args.command == "export":
+        system.export(args.admin_id, args.table, args.output, args.format, args.user_id, args.since, args.until)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Bus Reservation System CLI")
     sub = parser.add_subparsers(dest="command", required=True)
 
@@ -126,11 +361,18 @@ def main():
     addbus.add_argument("arrival")
     addbus.add_argument("route")
 
+    # Bulk import buses
+    importbuses = sub.add_parser("importbuses", help="Import many buses from CSV/JSONL (admin only)")
+    importbuses.add_argument("admin_id", type=int)
+    importbuses.add_argument("path")
+    importbuses.add_argument("--format", choices=("csv", "jsonl"), help="Default: from file extension")
+
     # Book ticket
     book = sub.add_parser("book", help="Book a ticket")
     book.add_argument("user_id", type=int)
     book.add_argument("bus_id", type=int)
-    book.add_argument("seat_number", type=int)
+    book.add_argument("seat_number", type=int, nargs="?", help="Omit to get the best free seat")
+    book.add_argument("--prefer", help=f"Any-seat preferences, comma separated: {', '.join(SEAT_PREFERENCES)}")
 
     # Cancel ticket
     cancel = sub.add_parser("cancel", help="Cancel a ticket")
@@ -149,15 +391,49 @@ def main():
     # Transactions
     trans = sub.add_parser("transactions", help="Show wallet transactions")
     trans.add_argument("user_id", type=int)
+    trans.add_argument("--page-size", type=int, default=50)
+    trans.add_argument("--cursor", help="Continuation token from the previous page")
+    trans.add_argument("--since", help="Only transactions at or after this timestamp")
 
     # Show buses
     buses = sub.add_parser("buses", help="Show all buses")
+    buses.add_argument("--page-size", type=int, default=50)
+    buses.add_argument("--cursor", help="Continuation token from the previous page")
+
+    # Trip search
+    search = sub.add_parser("search", help="Search trips by city pair, date, free seats and price")
+    search.add_argument("--from", dest="origin", help="Origin stop")
+    search.add_argument("--to", dest="destination", help="Destination stop (after the origin on the route)")
+    search.add_argument("--date", help="Departure day (YYYY-MM-DD)")
+    search.add_argument("--after", help="Departing at or after this date/time")
+    search.add_argument("--before", help="Departing up to this date (inclusive) or before this time")
+    search.add_argument("--min-seats", type=int, default=SEARCH_MIN_SEATS)
+    search.add_argument("--max-price", type=float, help="Price ceiling per seat")
+    search.add_argument("--page-size", type=int, default=20)
+    search.add_argument("--cursor", help="Continuation token from the previous page")
+    search.add_argument("--complete", metavar="PREFIX", help="List stops starting with PREFIX (reachable from --from)")
+
+    # Seat counters
+    seatcounts = sub.add_parser("seatcounts", help="Check bus free-seat counters against seats (admin only)")
+    seatcounts.add_argument("--repair", action="store_true", help="Rewrite drifted counters")
+
+    # Revenue rollups
+    rollups = sub.add_parser("rollups", help="Verify or rebuild revenue rollups (admin only)")
+    rollups.add_argument("--rebuild", action="store_true", help="Recompute rollups from tickets")
+
+    # Deferred counters
+    sub.add_parser("counters", help="Fold queued seat and rollup counter changes now (admin only)")
 
     # Reports
     rep = sub.add_parser("report", help="Show income reports")
     rep.add_argument("admin_id", type=int)
     rep.add_argument("--bus", type=int, help="Bus ID to report income for")
 
+    # Report retention
+    prune = sub.add_parser("prunereports", help="Delete old stored reports (admin only)")
+    prune.add_argument("admin_id", type=int)
+    prune.add_argument("--days", type=int, help="Retention window in days (default: REPORT_RETENTION_DAYS)")
+
     # Stats
     stat = sub.add_parser("stats", help="Show system stats")
     stat.add_argument("admin_id", type=int)
@@ -165,48 +441,128 @@ def main():
     # Audit log
     audit = sub.add_parser("audit", help="Show audit log")
     audit.add_argument("--limit", type=int, default=30)
+    audit.add_argument("--cursor", help="Continuation token from the previous page")
+    audit.add_argument("--since", help="Only entries at or after this timestamp")
+
+    # Export
+    export = sub.add_parser("export", help="Stream a table to CSV/NDJSON (admin only)")
+    export.add_argument("admin_id", type=int)
+    export.add_argument("table", choices=list(EXPORTS))
+    export.add_argument("--format", choices=FORMATS, default="csv")
+    export.add_argument("--output", help="File to write (default: stdout)")
+    export.add_argument("--user-id", type=int, help="Only rows for this user")
+    export.add_argument("--since", help="Only rows at or after this timestamp")
+    export.add_argument("--until", help="Only rows before this timestamp")
+
+    # Ledger wallet maintenance
+    wallet = sub.add_parser("wallet", help="Ledger wallet maintenance (WALLET_MODE=ledger, admin only)")
+    wallet.add_argument("admin_id", type=int)
+    wallet.add_argument("action", choices=("reconcile", "snapshot", "adopt", "shards"))
+    wallet.add_argument("--repair", action="store_true", help="reconcile: rebalance drifted accounts")
+    wallet.add_argument("--user-id", type=int, help="shards: account to split")
+    wallet.add_argument("--shards", type=int, help="shards: number of sub-balances")
+
+    # History partitions
+    partitions = sub.add_parser("partitions", help="Manage monthly history partitions (admin only)")
+    partitions.add_argument("admin_id", type=int)
+    partitions.add_argument("action", choices=("list", "ensure", "retain"))
+    partitions.add_argument("--months", type=int,
+                            help="ensure: months ahead (default: PARTITION_PREMAKE); "
+                                 "retain: months kept (default: PARTITION_RETENTION_MONTHS)")
+    partitions.add_argument("--archive-dir", help="retain: where archived partitions are written as .csv.gz")
+    partitions.add_argument("--keep", action="store_true", help="retain: detach archived partitions without dropping them")
+    partitions.add_argument("--table", choices=list(PARTITIONED_TABLES))
+
+    # Schema migrations
+    migrate = sub.add_parser("migrate", help="Apply pending schema migrations (admin only)")
+    migrate.add_argument("--target", type=int, help="Stop after this migration version")
+    migrate.add_argument("--status", action="store_true", help="Only list applied and pending migrations")
+
+    # Query statistics
+    dbstats = sub.add_parser("dbstats", help="Show per-statement latency collected in DB_STATS_FILE")
+    dbstats.add_argument("--sort", choices=("total", "p95", "count", "mean"), default="total")
+    dbstats.add_argument("--limit", type=int, default=20)
+    dbstats.add_argument("--reset", action="store_true", help="Clear the collected statistics")
+
+    # Service mode
+    serve = sub.add_parser("serve", help="Run the long-lived JSON line service")
+    serve.add_argument("--host", default=SERVICE_HOST)
+    serve.add_argument("--port", type=int, default=SERVICE_PORT)
+    serve.add_argument("--socket", help="Listen on this unix socket instead of TCP")
+    serve.add_argument("--concurrency", type=int, default=SERVICE_CONCURRENCY, help="Requests run at once")
+    serve.add_argument("--async", dest="use_async", action="store_true",
+                       help="Run requests as coroutines on psycopg 3 connections instead of worker threads")
+
+    # Batch replay
+    batch = sub.add_parser("batch", help="Run many service-format JSONL commands over one connection")
+    batch.add_argument("path", nargs="?", default="-", help="JSONL file of {op, params} lines (default: stdin)")
+    batch.add_argument("--group", type=int, default=1, help="Commands per transaction")
+    batch.add_argument("--workers", type=int, default=1, help="Parallel connections; one user's commands stay in order")
+    batch.add_argument("--output", help="Write per-command results and latency as JSONL")
+
+    return parser
+
+
+def show_db_stats(sort="total", limit=20, reset=False):
+    if not DB_STATS_FILE:
+        print("Set DB_STATS_FILE to collect query statistics across runs.")
+        return
+    if reset:
+        if os.path.exists(DB_STATS_FILE):
+            os.remove(DB_STATS_FILE)
+        print("Query statistics cleared.")
+        return
+    stats = QueryStats()
+    stats.load(DB_STATS_FILE)
+    rows = stats.summary(sort, limit)
+    if not rows:
+        print("No statements recorded yet.")
+        return
+    for r in rows:
+        print(f"{r['count']:>7} calls  total {r['total_ms']:>10.1f} ms  mean {r['mean_ms']:>8.2f}  "
+              f"p95 <={r['p95_ms']:<6}  p99 <={r['p99_ms']:<6}  rows {r['rows']:>8}  slow {r['slow']}  errors {r['errors']}")
+        print(f"    {r['sql'][:200]}")
+        print(f"    from {', '.join(f'{c} ({n})' for c, n in r['callers'].items())}")
 
-    args = parser.parse_args()
-
-    # --- Use context manager for DB connection ---
-    with PostgresConnection() as db:
-        system = BusReservationSystem(db)
-
-        if args.command == "register":
-            system.register(args.name, args.email, args.password)
-
-        elif args.command == "login":
-            system.login(args.email, args.password)
-
-        elif args.command == "addbus":
-            system.add_bus(args.admin_id, args.name, args.number, args.seats, args.price, args.departure, args.arrival, args.route)
-
-        elif args.command == "book":
-            system.book_ticket(args.user_id, args.bus_id, args.seat_number)
-
-        elif args.command == "cancel":
-            system.cancel_ticket(args.user_id, args.ticket_id)
-
-        elif args.command == "addmoney":
-            system.add_money(args.user_id, args.amount)
-
-        elif args.command == "balance":
-            system.show_balance(args.user_id)
 
-        elif args.command == "transactions":
-            system.show_transactions(args.user_id)
-
-        elif args.command == "buses":
-            system.show_buses()
-
-        elif args.command == "report":
-            system.show_income_report(args.admin_id, args.bus)
-
-        elif args.command == "stats":
-            system.show_stats(args.admin_id)
+def main():
+    args = build_parser().parse_args()
+
+    if args.command == "dbstats":
+        show_db_stats(args.sort, args.limit, args.reset)
+        return
+    if args.command == "batch":
+        run_batch(BusReservationSystem, args.path, args.output, args.group, args.workers)
+        close_audit_writer()
+        flush_query_stats()
+        return
+    if args.command == "serve":
+        if args.use_async:
+            from async_managers import AsyncReservationSystem
+            serve(AsyncReservationSystem, args.host, args.port, args.socket, args.concurrency, use_async=True)
+        else:
+            serve(BusReservationSystem, args.host, args.port, args.socket, args.concurrency)
+        return
 
-        elif args.command == "audit":
-            system.show_audit_log(args.limit)
+    # --- Use context manager for DB connection ---
+    with PostgresConnection(pool=get_pool()) as db:
+        db.actor = getattr(args, "user_id", None)
+        if args.command == "migrate":
+            # manages its own transactions (CREATE INDEX CONCURRENTLY cannot run inside one)
+            Migrator(db).run(args.target, args.status)
+        elif args.command == "partitions":
+            # one transaction per partition, so a long retention run does not hold every lock at once
+            BusReservationSystem(db).manage_partitions(args.admin_id, args.action, args.months, args.archive_dir, args.keep, args.table)
+        else:
+            # --- One unit of work (one commit) per command ---
+            with db.transaction():
+                run_command(BusReservationSystem(db), args)
+            if args.command in COUNTER_COMMANDS:
+                # no service loop folds the queued seat/rollup changes of a CLI-only deployment
+                CounterManager(db).fold()
+
+    close_audit_writer()
+    flush_query_stats()
 
 
 if __name__ == "__main__":
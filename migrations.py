@@ -0,0 +1,248 @@
+import re
+from bus import BusManager
+from db_connect import db_logger
+from partitions import partition_table_sql
+
+# Versioned schema changes, applied in order and recorded in schema_migrations.
+# "concurrent" migrations run statement by statement in autocommit mode so they
+# can use CREATE INDEX CONCURRENTLY without blocking writes. A statement may also
+# be a callable taking the connection, for data backfills that need Python.
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "hot path indexes",
+        "concurrent": True,
+        "statements": [
+            # get_user_tickets / get_user_tickets_page
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS tickets_user_purchase_idx"
+            " ON tickets (user_id, purchase_date DESC, ticket_id DESC)",
+            # per-bus revenue, rollup rebuilds and seat release lookups
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS tickets_bus_status_idx ON tickets (bus_id, status)",
+            # show_transactions / get_transactions_page
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_user_time_idx"
+            " ON transactions (user_id, timestamp DESC, transaction_id DESC)",
+            # show_logs / get_logs_page
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS audit_log_time_idx ON audit_log (timestamp DESC, log_id DESC)",
+            # free-seat lookups (get_available_seats, first_free_seat)
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS seats_free_idx ON seats (bus_id, seat_number) WHERE is_booked = FALSE",
+            # get_buses_page ordering
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS buses_departure_idx ON buses ((COALESCE(departure_time, '')), bus_id)",
+            # view_reports_page ordering
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS reports_generated_idx ON reports (generated_at DESC, report_id DESC)",
+        ],
+    },
+    {
+        "version": 2,
+        "name": "ledger wallet",
+        "concurrent": False,
+        "statements": [
+            # sub-balance count per account (WALLET_MODE=ledger)
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS wallet_shards SMALLINT NOT NULL DEFAULT 1",
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS shard SMALLINT",
+            """CREATE TABLE IF NOT EXISTS wallet_shards (
+                user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+                shard SMALLINT NOT NULL,
+                balance DECIMAL(12,2) NOT NULL DEFAULT 0 CHECK (balance >= 0),
+                PRIMARY KEY (user_id, shard)
+            )""",
+            """CREATE TABLE IF NOT EXISTS wallet_snapshots (
+                user_id INTEGER PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+                balance DECIMAL(14,2) NOT NULL,
+                last_transaction_id INTEGER NOT NULL,
+                taken_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )""",
+            # ledger deltas since a snapshot
+            "CREATE INDEX IF NOT EXISTS transactions_user_id_idx ON transactions (user_id, transaction_id)",
+        ],
+    },
+    {
+        "version": 3,
+        "name": "time partitioned history",
+        "concurrent": False,
+        "statements": [
+            partition_table_sql("tickets"),
+            partition_table_sql("transactions"),
+            partition_table_sql("audit_log"),
+            # Partitioned indexes adopt the matching version 1/2 indexes on the legacy
+            # partitions instead of rebuilding them, and cascade to every new partition.
+            "CREATE INDEX IF NOT EXISTS tickets_user_purchase_part_idx"
+            " ON tickets (user_id, purchase_date DESC, ticket_id DESC)",
+            "CREATE INDEX IF NOT EXISTS tickets_bus_status_part_idx ON tickets (bus_id, status)",
+            "CREATE INDEX IF NOT EXISTS transactions_user_time_part_idx"
+            " ON transactions (user_id, timestamp DESC, transaction_id DESC)",
+            "CREATE INDEX IF NOT EXISTS transactions_user_id_part_idx ON transactions (user_id, transaction_id)",
+            "CREATE INDEX IF NOT EXISTS audit_log_time_part_idx ON audit_log (timestamp DESC, log_id DESC)",
+            # archived-before horizon per table (rollup verify/rebuild skip archived days)
+            """CREATE TABLE IF NOT EXISTS partition_retention (
+                table_name VARCHAR(63) PRIMARY KEY,
+                archived_before TIMESTAMP NOT NULL
+            )""",
+        ],
+    },
+    {
+        "version": 4,
+        "name": "structured trips",
+        "concurrent": False,
+        "statements": [
+            # parsed from route / departure_time / arrival_time by BusManager.sync_trips
+            "ALTER TABLE buses ADD COLUMN IF NOT EXISTS origin VARCHAR(200)",
+            "ALTER TABLE buses ADD COLUMN IF NOT EXISTS destination VARCHAR(200)",
+            "ALTER TABLE buses ADD COLUMN IF NOT EXISTS departure_at TIMESTAMP",
+            "ALTER TABLE buses ADD COLUMN IF NOT EXISTS arrival_at TIMESTAMP",
+            """CREATE TABLE IF NOT EXISTS bus_stops (
+                bus_id INTEGER REFERENCES buses(bus_id) ON DELETE CASCADE,
+                stop_order SMALLINT NOT NULL,
+                city VARCHAR(200) NOT NULL,
+                city_key VARCHAR(200) NOT NULL,
+                PRIMARY KEY (bus_id, stop_order)
+            )""",
+            # search by origin/destination stop
+            "CREATE INDEX IF NOT EXISTS bus_stops_city_idx ON bus_stops (city_key, bus_id, stop_order)",
+            # search date range and ordering (search.TRIP_SORT_KEY)
+            "CREATE INDEX IF NOT EXISTS buses_departure_at_idx"
+            " ON buses ((COALESCE(departure_at, 'infinity'::TIMESTAMP)), bus_id)",
+            lambda db: BusManager(db).sync_trips(),
+        ],
+    },
+    {
+        "version": 5,
+        "name": "deferred counters",
+        "concurrent": False,
+        "statements": [
+            # seat and rollup changes queued by purchases, folded by counters.CounterManager;
+            # no foreign key, so a purchase never locks the bus row
+            """CREATE TABLE IF NOT EXISTS counter_deltas (
+                delta_id BIGSERIAL PRIMARY KEY,
+                bus_id INTEGER NOT NULL,
+                day DATE,
+                seats INTEGER NOT NULL DEFAULT 0,
+                paid INTEGER NOT NULL DEFAULT 0,
+                cancelled INTEGER NOT NULL DEFAULT 0,
+                used INTEGER NOT NULL DEFAULT 0,
+                paid_revenue DECIMAL(14,2) NOT NULL DEFAULT 0
+            )""",
+            "CREATE INDEX IF NOT EXISTS counter_deltas_bus_idx ON counter_deltas (bus_id)",
+            # single row: changes folded so far (report watermark, see reports.watermark_query)
+            """CREATE TABLE IF NOT EXISTS counter_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version BIGINT NOT NULL DEFAULT 0
+            )""",
+            "INSERT INTO counter_state DEFAULT VALUES ON CONFLICT DO NOTHING",
+        ],
+    },
+    {
+        "version": 6,
+        "name": "ledger snapshot horizon",
+        "concurrent": False,
+        "statements": [
+            # writing transaction of each ledger row; existing rows stay NULL (added without a
+            # default so the table is not rewritten), they are all settled
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS xact xid8",
+            "ALTER TABLE transactions ALTER COLUMN xact SET DEFAULT pg_current_xact_id()",
+            # oldest transaction still open when the snapshot was taken (see wallet_ledger.PENDING_ROW_SQL)
+            "ALTER TABLE wallet_snapshots ADD COLUMN IF NOT EXISTS horizon xid8",
+            "CREATE INDEX IF NOT EXISTS transactions_user_xact_idx ON transactions (user_id, xact)",
+        ],
+    },
+]
+
+_CONCURRENT_INDEX = re.compile(r"INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+class Migrator:
+    def __init__(self, db, migrations=MIGRATIONS):
+        self.db = db
+        self.migrations = sorted(migrations, key=lambda m: m["version"])
+
+    def _ensure_table(self):
+        with self.db.transaction():
+            self.db.cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(200) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+    def applied_versions(self):
+        self._ensure_table()
+        with self.db.transaction():
+            self.db.cur.execute("SELECT version FROM schema_migrations")
+            return {row[0] for row in self.db.cur.fetchall()}
+
+    def pending(self, target=None):
+        applied = self.applied_versions()
+        return [
+            m for m in self.migrations
+            if m["version"] not in applied and (target is None or m["version"] <= target)
+        ]
+
+    def _record(self, migration):
+        self.db.cur.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (migration["version"], migration["name"])
+        )
+
+    def _drop_invalid_index(self, statement):
+        # a failed CREATE INDEX CONCURRENTLY leaves an INVALID index that IF NOT EXISTS would skip
+        match = _CONCURRENT_INDEX.search(statement)
+        if not match:
+            return
+        self.db.cur.execute("""
+            SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = %s AND NOT i.indisvalid
+        """, (match.group(1),))
+        if self.db.cur.fetchone():
+            db_logger.warning(f"Dropping invalid index {match.group(1)} left by an earlier attempt")
+            self.db.cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+    def _apply(self, migration):
+        if migration.get("concurrent"):
+            if self.db.in_transaction:
+                raise RuntimeError("Concurrent migrations cannot run inside a transaction scope")
+            self.db.con.commit()
+            self.db.con.autocommit = True
+            try:
+                for statement in migration["statements"]:
+                    self._drop_invalid_index(statement)
+                    self.db.cur.execute(statement)
+            finally:
+                self.db.con.autocommit = False
+            with self.db.transaction():
+                self._record(migration)
+        else:
+            with self.db.transaction():
+                for statement in migration["statements"]:
+                    if callable(statement):
+                        statement(self.db)
+                    else:
+                        self.db.cur.execute(statement)
+                self._record(migration)
+
+    def migrate(self, target=None):
+        """Apply pending migrations up to target; returns the versions applied"""
+        applied = []
+        for migration in self.pending(target):
+            db_logger.info(f"Applying migration {migration['version']}: {migration['name']}")
+            try:
+                self._apply(migration)
+            except Exception:
+                db_logger.exception(f"Migration {migration['version']} failed")
+                raise
+            applied.append(migration["version"])
+        db_logger.info(f"Schema up to date ({len(applied)} migrations applied).")
+        return applied
+
+    def status(self):
+        applied = self.applied_versions()
+        return [
+            {"version": m["version"], "name": m["name"], "applied": m["version"] in applied}
+            for m in self.migrations
+        ]
+
+    def run(self, target=None, status_only=False):
+        if status_only:
+            for m in self.status():
+                print(f"{m['version']:>4}  {'applied' if m['applied'] else 'pending':8} {m['name']}")
+            return []
+        return self.migrate(target)
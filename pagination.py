@@ -0,0 +1,99 @@
+import base64
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+_KEY_REF = re.compile(r"\{(\d+)\}")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"n": str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "n" in value:
+            return Decimal(value["n"])
+    return value
+
+
+def encode_cursor(kind, values):
+    """Opaque continuation token holding the sort key of the last row of a page"""
+    payload = json.dumps({"k": kind, "v": [_encode_value(v) for v in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(kind, token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["k"] != kind:
+            raise InvalidCursor(f"Cursor belongs to '{payload['k']}', not '{kind}'")
+        return [_decode_value(v) for v in payload["v"]]
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+
+
+def _page_query(kind, query, params, cursor, page_size, keyset):
+    page_size = max(1, min(int(page_size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    params = tuple(params or ())
+    if cursor:
+        values = decode_cursor(kind, cursor)
+        refs = [int(i) for i in _KEY_REF.findall(keyset)]
+        if refs:
+            # {n} refers to the n-th sort key, so a key can appear twice
+            keyset = _KEY_REF.sub("%s", keyset)
+            values = [values[i] for i in refs]
+        sql = query.format(after=f"AND {keyset}")
+        params += tuple(values)
+    else:
+        sql = query.format(after="")
+    return sql, params + (page_size + 1,), page_size
+
+
+def _page_result(kind, rows, page_size, key_of):
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = encode_cursor(kind, key_of(rows[-1])) if has_more else None
+    return rows, next_cursor
+
+
+def fetch_page(db, kind, query, params, cursor, page_size, keyset, key_of):
+    """Run one keyset page of query.
+
+    query has an {after} slot placed in its WHERE clause and ends with LIMIT %s;
+    keyset is the row-comparison for rows after the cursor, e.g.
+    "(t.purchase_date, t.ticket_id) < (%s, %s)", or with {n} references to the
+    sort keys when one is needed twice, e.g. an extra plain bound on a partition
+    key: "t.purchase_date <= {0} AND (t.purchase_date, t.ticket_id) < ({0}, {1})".
+    Returns (rows, next_cursor).
+    """
+    sql, params, page_size = _page_query(kind, query, params, cursor, page_size, keyset)
+    return _page_result(kind, db.fetch_all(sql, params), page_size, key_of)
+
+
+async def afetch_page(db, kind, query, params, cursor, page_size, keyset, key_of):
+    """fetch_page for an AsyncPostgresConnection"""
+    sql, params, page_size = _page_query(kind, query, params, cursor, page_size, keyset)
+    return _page_result(kind, await db.fetch_all(sql, params), page_size, key_of)
@@ -0,0 +1,241 @@
+import gzip
+import os
+import re
+from datetime import datetime
+from db_connect import db_logger
+from wallet_ledger import PENDING_ROW_SQL, WALLET_MODE
+
+# History tables range-partitioned by time: table -> (partition key, id column).
+# One partition per calendar month (<table>_pYYYYMM), plus <table>_legacy holding
+# everything written before the switch-over and <table>_default for rows no
+# monthly partition covers yet.
+PARTITIONED_TABLES = {
+    "tickets": ("purchase_date", "ticket_id"),
+    "transactions": ("timestamp", "transaction_id"),
+    "audit_log": ("timestamp", "log_id"),
+}
+PARTITION_PREMAKE = int(os.getenv("PARTITION_PREMAKE", "3"))  # months created ahead of time
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "24"))
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", "archive")
+
+PARTITION_BOUNDS_SQL = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::BIGINT
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+"""
+_RANGE_BOUND = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    years, index = divmod(month.month - 1 + count, 12)
+    return datetime(month.year + years, index + 1, 1)
+
+
+def _bound(text):
+    text = text.strip()
+    if text in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(text.strip("'"))
+
+
+def partition_table_sql(table, premake=PARTITION_PREMAKE):
+    """DO block turning a plain history table into a partitioned one (no-op if it already is).
+    The old heap is attached as <table>_legacy instead of being copied, so the switch-over
+    costs one validation scan rather than a rewrite of the whole table."""
+    key, id_column = PARTITIONED_TABLES[table]
+    return f"""
+        DO $$
+        DECLARE
+            upper_bound TIMESTAMP;
+            fk RECORD;
+            next_month TIMESTAMP;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = '{table}'::regclass) THEN
+                RETURN;
+            END IF;
+            ALTER TABLE {table} RENAME TO {table}_legacy;
+            ALTER TABLE {table}_legacy DROP CONSTRAINT IF EXISTS {table}_pkey;
+            UPDATE {table}_legacy SET {key} = '-infinity' WHERE {key} IS NULL;
+            ALTER TABLE {table}_legacy ALTER COLUMN {key} SET NOT NULL;
+
+            CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                PARTITION BY RANGE ({key});
+            -- unique keys of a partitioned table must contain the partition key
+            ALTER TABLE {table} ADD PRIMARY KEY ({id_column}, {key});
+            FOR fk IN SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint
+                      WHERE conrelid = '{table}_legacy'::regclass AND contype = 'f' LOOP
+                EXECUTE format('ALTER TABLE {table} ADD CONSTRAINT %I %s', fk.conname, fk.def);
+            END LOOP;
+            -- keep the id sequence alive when the legacy partition is dropped by retention
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY {table}.{id_column}',
+                           pg_get_serial_sequence('{table}_legacy', '{id_column}'));
+
+            SELECT GREATEST(date_trunc('month', LOCALTIMESTAMP),
+                            COALESCE(date_trunc('month', MAX({key})), '-infinity')) + INTERVAL '1 month'
+              INTO upper_bound FROM {table}_legacy;
+            EXECUTE format('ALTER TABLE {table} ATTACH PARTITION {table}_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                           upper_bound);
+            CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;
+            FOR next_month IN SELECT generate_series(upper_bound, upper_bound + INTERVAL '{max(premake - 1, 0)} months',
+                                                INTERVAL '1 month') LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+                               '{table}_p' || to_char(next_month, 'YYYYMM'), next_month,
+                               next_month + INTERVAL '1 month');
+            END LOOP;
+        END $$
+    """
+
+
+class PartitionManager:
+    """Monthly partitions of the history tables: create ahead of time, archive and drop past retention"""
+
+    def __init__(self, db, tables=PARTITIONED_TABLES):
+        self.db = db
+        self.tables = tables
+
+    def is_partitioned(self, table):
+        row = self.db.fetch_one("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (table,))
+        return row is not None
+
+    def partitions(self, table):
+        """Partitions of table ordered by range; None bounds are unbounded"""
+        parts = []
+        for name, bound, rows in self.db.fetch_all(PARTITION_BOUNDS_SQL, (table,)):
+            match = _RANGE_BOUND.search(bound or "")
+            parts.append({
+                "name": name,
+                "default": not match,
+                "from": _bound(match.group(1)) if match else None,
+                "to": _bound(match.group(2)) if match else None,
+                "rows": max(rows, 0),
+            })
+        return sorted(parts, key=lambda p: (not p["default"], p["from"] or datetime.min))
+
+    @staticmethod
+    def _overlaps(parts, start, end):
+        return any(
+            not p["default"]
+            and (p["from"] is None or p["from"] < end)
+            and (p["to"] is None or start < p["to"])
+            for p in parts
+        )
+
+    # --- Future partitions ---
+    def create_partition(self, table, month):
+        """Partition for one calendar month; rows already in the default partition move into it"""
+        key = self.tables[table][0]
+        name = f"{table}_p{month:%Y%m}"
+        default = f"{table}_default"
+        bounds = (month, add_months(month, 1))
+        in_range = f"{key} >= %s AND {key} < %s"
+        with self.db.transaction():
+            stray = self.db.fetch_one(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})", bounds)
+            stray = bool(stray and stray[0])
+            if stray:
+                # a new range may not overlap rows the default partition already holds
+                self.db.cur.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+            self.db.cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+            if stray:
+                self.db.cur.execute(f"INSERT INTO {name} SELECT * FROM {default} WHERE {in_range}", bounds)
+                self.db.cur.execute(f"DELETE FROM {default} WHERE {in_range}", bounds)
+                self.db.cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+        db_logger.info(f"Created partition {name}.")
+        return name
+
+    def ensure_partitions(self, months_ahead=PARTITION_PREMAKE, now=None):
+        """Create missing monthly partitions from this month to months_ahead months out; returns their names"""
+        start = month_start(now or datetime.now())
+        created = []
+        for table in self.tables:
+            try:
+                if not self.is_partitioned(table):
+                    db_logger.debug(f"{table} is not partitioned; run migrate")
+                    continue
+                parts = self.partitions(table)
+                for offset in range(months_ahead + 1):
+                    month = add_months(start, offset)
+                    if not self._overlaps(parts, month, add_months(month, 1)):
+                        created.append(self.create_partition(table, month))
+            except Exception:
+                db_logger.exception(f"Error creating partitions for {table}")
+        return created
+
+    # --- Retention ---
+    def _unsnapshotted(self, source, params=()):
+        # ledger balances are snapshot + pending rows; rows no snapshot holds yet must stay
+        row = self.db.fetch_one(f"""
+            SELECT EXISTS (
+                SELECT 1 FROM ({source}) t
+                LEFT JOIN wallet_snapshots s ON s.user_id = t.user_id
+                WHERE {PENDING_ROW_SQL}
+            )""", params)
+        return bool(row and row[0])
+
+    def _archive(self, table, source, params, path, delete_sql=None):
+        """COPY source to a gzipped CSV, then run delete_sql; the file only gets its final name after commit"""
+        if os.path.exists(path):
+            raise FileExistsError(f"{path} already exists")
+        if table == "transactions" and WALLET_MODE == "ledger" and self._unsnapshotted(source, params):
+            raise RuntimeError("ledger rows newer than the wallet snapshots; run 'wallet snapshot' first")
+        partial = path + ".part"
+        try:
+            with self.db.transaction():
+                with gzip.open(partial, "wt", encoding="utf-8", newline="") as out:
+                    self.db.copy_to(source, params, out)
+                for statement in delete_sql or ():
+                    self.db.cur.execute(statement, params if "%s" in statement else None)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        os.replace(partial, path)
+
+    def _record_horizon(self, table, cutoff):
+        self.db.cur.execute("""
+            INSERT INTO partition_retention (table_name, archived_before) VALUES (%s, %s)
+            ON CONFLICT (table_name) DO UPDATE
+            SET archived_before = GREATEST(partition_retention.archived_before, EXCLUDED.archived_before)
+        """, (table, cutoff))
+
+    def retain(self, months=PARTITION_RETENTION_MONTHS, archive_dir=PARTITION_ARCHIVE_DIR, drop=True,
+               table=None, now=None):
+        """Archive rows older than the retention window to archive_dir and take them out of the table.
+        Whole monthly partitions are detached (and dropped unless drop=False); the legacy partition,
+        which has no lower bound, is trimmed row by row instead. Returns the archive files written."""
+        cutoff = add_months(month_start(now or datetime.now()), -months)
+        os.makedirs(archive_dir, exist_ok=True)
+        archived = []
+        for name in ([table] if table else self.tables):
+            key = self.tables[name][0]
+            try:
+                if not self.is_partitioned(name):
+                    db_logger.warning(f"{name} is not partitioned; run migrate before retention")
+                    continue
+                for part in self.partitions(name):
+                    if part["default"] or (part["from"] is not None and part["to"] > cutoff):
+                        continue
+                    if part["to"] is not None and part["to"] <= cutoff:
+                        path = os.path.join(archive_dir, f"{part['name']}.csv.gz")
+                        statements = [f"ALTER TABLE {name} DETACH PARTITION {part['name']}"]
+                        if drop:
+                            statements.append(f"DROP TABLE {part['name']}")
+                        self._archive(name, f"SELECT * FROM {part['name']}", (), path, statements)
+                    else:
+                        row = self.db.fetch_one(f"SELECT EXISTS (SELECT 1 FROM {part['name']} WHERE {key} < %s)", (cutoff,))
+                        if not (row and row[0]):
+                            continue
+                        path = os.path.join(archive_dir, f"{part['name']}_before_{cutoff:%Y%m}.csv.gz")
+                        self._archive(name, f"SELECT * FROM {part['name']} WHERE {key} < %s", (cutoff,), path,
+                                      [f"DELETE FROM {part['name']} WHERE {key} < %s"])
+                    with self.db.transaction():
+                        self._record_horizon(name, cutoff)
+                    archived.append(path)
+                    db_logger.info(f"Archived {part['name']} rows before {cutoff:%Y-%m-%d} to {path}")
+            except Exception:
+                db_logger.exception(f"Error applying retention to {name}")
+        return archived
@@ -0,0 +1,253 @@
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from functools import lru_cache
+
+# Per-statement timing. DB_STATS_FILE persists the counters across one-shot CLI runs
+# (read back by the dbstats command); statements slower than DB_SLOW_QUERY_MS are logged
+# with redacted parameters and, with DB_EXPLAIN_SLOW=1, an EXPLAIN ANALYZE plan of read-only ones.
+DB_STATS_ENABLED = os.getenv("DB_STATS", "1") != "0"
+DB_STATS_FILE = os.getenv("DB_STATS_FILE")
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_EXPLAIN_SLOW = os.getenv("DB_EXPLAIN_SLOW", "0") == "1"
+
+# Upper bounds of the latency buckets in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+slow_logger = logging.getLogger("SlowQuery")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_COMMENT = re.compile(r"--[^\n]*")
+_CONTROL = ("SAVEPOINT", "RELEASE", "ROLLBACK", "COMMIT", "BEGIN", "SET", "SHOW", "EXPLAIN")
+_WRITE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|FOR\s+UPDATE|FOR\s+SHARE|NEXTVAL|SETVAL)\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Statement shape with literals and placeholders replaced by ?"""
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors="replace")
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip().rstrip(";")
+
+
+@lru_cache(maxsize=2048)
+def is_read_only(sql):
+    """Safe to re-run under EXPLAIN ANALYZE: a plain SELECT without locking or writing CTEs"""
+    shape = normalize_sql(sql).upper()
+    return shape.startswith(("SELECT", "WITH")) and not _WRITE.search(shape)
+
+
+@lru_cache(maxsize=2048)
+def is_write(sql):
+    """Changes data or takes row locks; transaction control and session commands do not count"""
+    return not is_read_only(sql) and not normalize_sql(sql).upper().startswith(_CONTROL)
+
+
+def percentile_rank(count, p):
+    """0-based index of the p-th percentile among count sorted values (nearest rank)"""
+    return min(count - 1, max(0, math.ceil(p / 100 * count) - 1))
+
+
+def percentile(sorted_values, p):
+    """p-th percentile of an ascending list, None when empty; shared by benchmark and batch reports"""
+    if not sorted_values:
+        return None
+    return sorted_values[percentile_rank(len(sorted_values), p)]
+
+
+def redact_params(params):
+    """Parameter types only, never values"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [type(v).__name__ for v in params]
+    return type(params).__name__
+
+
+def _caller():
+    # first frame outside the database layer, e.g. "ticket.TicketManager.purchase"
+    frame = sys._getframe(2)
+    while frame and frame.f_globals.get("__name__") in ("db_connect", "async_db", "query_stats", "contextlib"):
+        frame = frame.f_back
+    if not frame:
+        return "?"
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.callers = Counter()
+
+    def add(self, elapsed_ms, rowcount, error, caller):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.min_ms = elapsed_ms if self.min_ms is None else min(self.min_ms, elapsed_ms)
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if rowcount and rowcount > 0:
+            self.rows += rowcount
+        if error:
+            self.errors += 1
+        if elapsed_ms >= DB_SLOW_QUERY_MS:
+            self.slow += 1
+        self.buckets[_bucket(elapsed_ms)] += 1
+        self.callers[caller] += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (same rank as percentile())"""
+        if not self.count:
+            return None
+        rank = percentile_rank(self.count, p)
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen > rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total_ms += other.total_ms
+        if other.min_ms is not None:
+            self.min_ms = other.min_ms if self.min_ms is None else min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.rows += other.rows
+        self.slow += other.slow
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.callers.update(other.callers)
+
+    def to_dict(self):
+        return {
+            "count": self.count, "errors": self.errors, "total_ms": self.total_ms,
+            "min_ms": self.min_ms, "max_ms": self.max_ms, "rows": self.rows, "slow": self.slow,
+            "buckets": self.buckets, "callers": dict(self.callers),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for key in ("count", "errors", "total_ms", "min_ms", "max_ms", "rows", "slow"):
+            setattr(stats, key, data.get(key, getattr(stats, key)))
+        if len(data.get("buckets", ())) == len(stats.buckets):
+            stats.buckets = list(data["buckets"])
+        stats.callers = Counter(data.get("callers", {}))
+        return stats
+
+
+def _bucket(elapsed_ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if elapsed_ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+
+class QueryStats:
+    """Latency histograms and row counts per normalized statement"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = {}
+
+    def record(self, sql, params, elapsed, rowcount, error=None):
+        key = normalize_sql(sql)
+        caller = _caller()
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                stats = self._statements[key] = StatementStats()
+            stats.add(elapsed * 1000, rowcount, error, caller)
+
+    def snapshot(self):
+        with self._lock:
+            return {sql: StatementStats.from_dict(s.to_dict()) for sql, s in self._statements.items()}
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+
+    def summary(self, sort="total", limit=20):
+        rows = []
+        for sql, s in self.snapshot().items():
+            rows.append({
+                "sql": sql, "count": s.count, "errors": s.errors, "rows": s.rows, "slow": s.slow,
+                "total_ms": s.total_ms, "mean_ms": s.total_ms / s.count if s.count else 0,
+                "p50_ms": s.percentile(50), "p95_ms": s.percentile(95), "p99_ms": s.percentile(99),
+                "max_ms": s.max_ms, "callers": dict(s.callers.most_common(3)),
+            })
+        key = {"total": "total_ms", "p95": "p95_ms", "count": "count", "mean": "mean_ms"}.get(sort, "total_ms")
+        rows.sort(key=lambda r: r[key] or 0, reverse=True)
+        return rows[:limit] if limit else rows
+
+    # --- Persistence ---
+    def load(self, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            for sql, s in data.get("statements", {}).items():
+                loaded = StatementStats.from_dict(s)
+                if sql in self._statements:
+                    self._statements[sql].merge(loaded)
+                else:
+                    self._statements[sql] = loaded
+
+    def save(self, path):
+        """Merge this process's counters into path and start counting afresh"""
+        merged = QueryStats()
+        merged.load(path)
+        with self._lock:
+            for sql, s in self._statements.items():
+                if sql in merged._statements:
+                    merged._statements[sql].merge(s)
+                else:
+                    merged._statements[sql] = StatementStats.from_dict(s.to_dict())
+            self._statements.clear()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"statements": {sql: s.to_dict() for sql, s in merged._statements.items()}}, f)
+        os.replace(tmp, path)
+
+
+query_stats = QueryStats()
+
+
+def flush_query_stats(path=DB_STATS_FILE):
+    if path and DB_STATS_ENABLED:
+        try:
+            query_stats.save(path)
+        except OSError as e:
+            slow_logger.error(f"Could not write query stats to {path}: {e}")
+
+
+def log_slow_query(sql, params, elapsed, rowcount, plan=None):
+    message = f"{elapsed * 1000:.1f} ms, {rowcount} rows, caller {_caller()}: {normalize_sql(sql)} params={redact_params(params)}"
+    if plan:
+        message += "\n" + "\n".join(plan)
+    slow_logger.warning(message)
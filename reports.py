@@ -1,86 +1,154 @@
+import json
+import os
 from datetime import datetime
 from audit_log import AuditLogger
-from db_connect import db_logger
+from db_connect import db_logger, replica_read
+from pagination import InvalidCursor, fetch_page
+from rollups import RollupManager
+
+# Days of report history to keep when pruning (the latest row per report/params is always kept)
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "30"))
+
+SAVE_REPORT_SQL = (
+    "INSERT INTO reports (report_type, generated_by, details, params, watermark, result)"
+    " VALUES (%s, %s, %s, %s, %s, %s)"
+)
+LATEST_REPORT_SQL = """
+    SELECT watermark, result FROM reports
+    WHERE report_type = %s AND params = %s
+    ORDER BY generated_at DESC, report_id DESC LIMIT 1
+"""
+
+
+def watermark_query(bus_id=None):
+    """Number of ticket changes committed on the covered buses: changes already folded into the
+    counters plus those still queued in counter_deltas (see counters.py). Every purchase,
+    cancellation or bus deletion adds one, so the value only grows, whatever order concurrent
+    transactions commit in."""
+    if bus_id is None:
+        return "SELECT version + (SELECT COUNT(*) FROM counter_deltas) FROM counter_state", None
+    return (
+        "SELECT b.ticket_version + (SELECT COUNT(*) FROM counter_deltas d WHERE d.bus_id = b.bus_id)"
+        " FROM buses b WHERE b.bus_id = %s",
+        (bus_id,),
+    )
+
 
 class ReportManager:
-    def __init__(self, db):
+    def __init__(self, db, retention_days=REPORT_RETENTION_DAYS):
         self.db = db
         self.audit = AuditLogger(db)
-      
-    def _save_report(self, admin_id, report_type, details):
+        self.rollups = RollupManager(db)
+        self.retention_days = retention_days
+
+    def _save_report(self, admin_id, report_type, details, params=None, watermark=None, result=None):
         try:
-            self.db.execute_query(
-                "INSERT INTO reports (report_type, generated_by, details) VALUES (%s, %s, %s)",
-                (report_type, admin_id, details)
-            )
-            self.audit.log(admin_id, f"Generated report: {report_type}")
+            with self.db.transaction():
+                self.db.execute_query(SAVE_REPORT_SQL, (report_type, admin_id, details, params, watermark, result))
+                self.audit.log(admin_id, f"Generated report: {report_type}")
         except Exception:
             db_logger.exception(f"Error saving report: {report_type}")
 
+    # --- Memoization ---
+    def _watermark(self, bus_id=None):
+        result = self.db.fetch_one(*watermark_query(bus_id))
+        return str(result[0]) if result else None
+
+    def _memoized(self, admin_id, report_type, params, compute, describe):
+        """Stored result of the latest identical report if no ticket changed since, otherwise compute and store"""
+        key = json.dumps(params, sort_keys=True)
+        # read the watermark first: a change committed while computing only causes a later recompute
+        watermark = self._watermark(params.get("bus_id"))
+        if watermark:
+            row = self.db.fetch_one(LATEST_REPORT_SQL, (report_type, key))
+            if row and row[0] == watermark and row[1] is not None:
+                self.audit.log(admin_id, f"Viewed report: {report_type}")
+                return json.loads(row[1])
+
+        result = compute()
+        self._save_report(admin_id, report_type, describe(result), key, watermark, json.dumps(result))
+        return result
+
+    def prune_reports(self, retention_days=None):
+        """Delete report rows older than the retention window, keeping the newest row per report/params"""
+        days = self.retention_days if retention_days is None else retention_days
+        try:
+            with self.db.transaction():
+                self.db.execute_query(
+                    """DELETE FROM reports r
+                       WHERE r.generated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+                         AND r.report_id <> (
+                             SELECT report_id FROM reports l
+                             WHERE l.report_type = r.report_type AND l.params IS NOT DISTINCT FROM r.params
+                             ORDER BY l.generated_at DESC, l.report_id DESC LIMIT 1
+                         )""",
+                    (days,)
+                )
+                deleted = self.db.cur.rowcount
+            db_logger.info(f"Pruned {deleted} reports older than {days} days.")
+            return deleted
+        except Exception:
+            db_logger.exception("Error pruning reports")
+            return 0
+
     # total revenue
+    @replica_read
     def get_total_revenue(self, admin_id):
         try:
-            result = self.db.fetch_one("SELECT SUM(price) FROM tickets WHERE status = 'PAID'")
-            total = float(result[0]) if result and result[0] else 0.0
-            details = f"Total revenue from all tickets: ${total:.2f}"
-            self._save_report(admin_id, "TOTAL_REVENUE", details)
-            return total
+            return self._memoized(
+                admin_id, "TOTAL_REVENUE", {},
+                lambda: self.rollups.totals()["revenue"],
+                lambda total: f"Total revenue from all tickets: ${total:.2f}",
+            )
         except Exception:
             db_logger.exception(f"Error fetching total revenue")
             return 0.0
 
+    @replica_read
     def get_revenue_by_bus(self, admin_id, bus_id):
         try:
-            result = self.db.fetch_one(
-                "SELECT SUM(price) FROM tickets WHERE bus_id = %s AND status = 'PAID'",
-                (bus_id,)
+            return self._memoized(
+                admin_id, "BUS_REVENUE", {"bus_id": bus_id},
+                lambda: self.rollups.totals(bus_id)["revenue"],
+                lambda total: f"Revenue for bus {bus_id}: ${total:.2f}",
             )
-            total = float(result[0]) if result and result[0] else 0.0
-            details = f"Revenue for bus {bus_id}: ${total:.2f}"
-            self._save_report(admin_id, "BUS_REVENUE", details)
-            return total
         except Exception:
             db_logger.exception(f"Error fetching bus revenue")
             return 0.0
 
     #-----Statistics-----
+    @replica_read
     def get_ticket_statistics(self, admin_id):
         try:
-            query = """
-            SELECT 
-                COUNT(*) FILTER (WHERE status = 'PAID') AS sold,
-                COUNT(*) FILTER (WHERE status = 'CANCELLED') AS cancelled,
-                COUNT(*) FILTER (WHERE status = 'USED') AS used
-            FROM tickets;
-            """
-            result = self.db.fetch_one(query)
-            sold, cancelled, used = result if result else (0, 0, 0)
-            details = f"Tickets - Sold: {sold}, Cancelled: {cancelled}, Used: {used}"
-            self._save_report(admin_id, "TICKET_STATS", details)
-            return {"sold": sold, "cancelled": cancelled, "used": used}
+            def compute():
+                totals = self.rollups.totals()
+                return {"sold": totals["paid"], "cancelled": totals["cancelled"], "used": totals["used"]}
+
+            return self._memoized(
+                admin_id, "TICKET_STATS", {}, compute,
+                lambda s: f"Tickets - Sold: {s['sold']}, Cancelled: {s['cancelled']}, Used: {s['used']}",
+            )
         except Exception:
             db_logger.exception("Error fetching ticket stats")
             return {}
 
+    @replica_read
     def get_trip_statistics(self, admin_id):
         """total trips and used seats"""
         try:
-            query = """
-            SELECT 
-                COUNT(DISTINCT bus_id) AS total_trips,
-                COUNT(ticket_id) AS total_tickets,
-                SUM(price) AS total_income
-            FROM tickets WHERE status = 'PAID';
-            """
-            result = self.db.fetch_one(query)
-            trips, tickets, income = result if result else (0, 0, 0.0)
-            details = f"Trips: {trips}, Tickets sold: {tickets}, Income: ${income:.2f}"
-            self._save_report(admin_id, "TRIP_STATS", details)
-            return {"trips": trips, "tickets": tickets, "income": income}
+            def compute():
+                totals = self.rollups.totals()
+                return {"trips": totals["trips"], "tickets": totals["paid"], "income": totals["revenue"]}
+
+            return self._memoized(
+                admin_id, "TRIP_STATS", {}, compute,
+                lambda s: f"Trips: {s['trips']}, Tickets sold: {s['tickets']}, Income: ${s['income']:.2f}",
+            )
         except Exception:
             db_logger.exception("Error fetching trip stats")
             return {}
 
+    @replica_read
     def view_reports(self, admin_id):
         try:
             query = """
@@ -98,3 +166,25 @@ class ReportManager:
             db_logger.exception("Error viewing reports")
             return []
             
+
+    @replica_read
+    def view_reports_page(self, admin_id, page_size=None, cursor=None):
+        try:
+            query = """
+            SELECT report_id, report_type, generated_at, details
+            FROM reports
+            WHERE TRUE {after}
+            ORDER BY generated_at DESC, report_id DESC
+            LIMIT %s
+            """
+            rows, next_cursor = fetch_page(
+                self.db, "reports", query, (), cursor, page_size,
+                "(generated_at, report_id) < (%s, %s)",
+                lambda row: (row[2], row[0]),
+            )
+            return {"items": rows, "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error viewing reports page")
+            return {"items": [], "next_cursor": None}
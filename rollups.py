@@ -0,0 +1,160 @@
+from counters import ROLLUP_ROWS_SQL, CounterManager
+from db_connect import db_logger
+
+# Purchase-statement fragment (see ticket.PURCHASE_QUERY): count a new PAID
+# ticket in its (bus, day) bucket. Queued as a delta row (counters.py) so
+# bookings on the same bus never contend on one summary row.
+ROLLUP_PURCHASE_SQL = """
+    rollup AS (
+        INSERT INTO counter_deltas (bus_id, day, paid, paid_revenue)
+        SELECT %(bus_id)s, CURRENT_DATE, 1, %(price)s FROM ticket
+    )
+"""
+
+# Same buckets recomputed from tickets; used by rebuild and verify. Only days
+# from %(since)s on: older tickets may have been archived by partition retention.
+ROLLUP_SOURCE_SQL = """
+    SELECT bus_id, purchase_date::date AS day,
+           COUNT(*) FILTER (WHERE status = 'PAID') AS paid,
+           COUNT(*) FILTER (WHERE status = 'CANCELLED') AS cancelled,
+           COUNT(*) FILTER (WHERE status = 'USED') AS used,
+           COALESCE(SUM(price) FILTER (WHERE status = 'PAID'), 0) AS paid_revenue
+    FROM tickets
+    WHERE bus_id IS NOT NULL AND purchase_date >= %(since)s
+    GROUP BY bus_id, purchase_date::date
+"""
+
+# Stored buckets plus pending deltas, summed per bucket before counting trips
+TOTALS_SQL = """
+    SELECT COALESCE(SUM(paid), 0), COALESCE(SUM(cancelled), 0), COALESCE(SUM(used), 0),
+           COALESCE(SUM(paid_revenue), 0), COUNT(DISTINCT bus_id) FILTER (WHERE paid > 0)
+    FROM (
+        SELECT bus_id, day, SUM(paid) AS paid, SUM(cancelled) AS cancelled, SUM(used) AS used,
+               SUM(paid_revenue) AS paid_revenue
+        FROM {rows}
+        {where}
+        GROUP BY bus_id, day
+    ) t
+"""
+
+
+def status_change_query(bus_id, purchase_date, price, old_status, new_status):
+    """(sql, params) moving one ticket between status counters of its purchase-day bucket"""
+    columns = {"PAID": "paid", "CANCELLED": "cancelled", "USED": "used"}
+    old_col, new_col = columns[old_status], columns[new_status]
+    revenue = (1 if new_status == "PAID" else 0) - (1 if old_status == "PAID" else 0)
+    sql = f"""INSERT INTO counter_deltas (bus_id, day, {old_col}, {new_col}, paid_revenue)
+              VALUES (%s, %s::date, -1, 1, %s * %s)"""
+    return sql, (bus_id, purchase_date, revenue, price)
+
+
+def totals_query(bus_id=None):
+    if bus_id is None:
+        return TOTALS_SQL.format(rows=ROLLUP_ROWS_SQL, where=""), None
+    return TOTALS_SQL.format(rows=ROLLUP_ROWS_SQL, where="WHERE bus_id = %s"), (bus_id,)
+
+
+def totals_row(result):
+    paid, cancelled, used, revenue, trips = result if result else (0, 0, 0, 0, 0)
+    return {
+        "paid": paid,
+        "cancelled": cancelled,
+        "used": used,
+        "revenue": float(revenue),
+        "trips": trips,
+    }
+
+
+class RollupManager:
+    """Per-bus, per-day ticket counters and revenue kept in step with tickets"""
+
+    def __init__(self, db):
+        self.db = db
+
+    # --- Incremental maintenance ---
+    def record_status_change(self, bus_id, purchase_date, price, old_status, new_status):
+        """Move one ticket between status counters of its purchase-day bucket"""
+        return self.db.execute_query(*status_change_query(bus_id, purchase_date, price, old_status, new_status))
+
+    # --- Reads ---
+    def totals(self, bus_id=None):
+        return totals_row(self.db.fetch_one(*totals_query(bus_id)))
+
+    def daily(self, since=None, until=None):
+        query = f"""
+            SELECT day, SUM(paid), SUM(cancelled), SUM(used), SUM(paid_revenue)
+            FROM {ROLLUP_ROWS_SQL}
+            WHERE (%s::date IS NULL OR day >= %s::date) AND (%s::date IS NULL OR day < %s::date)
+            GROUP BY day
+            ORDER BY day
+        """
+        rows = self.db.fetch_all(query, (since, since, until, until))
+        return [
+            {"day": day, "paid": paid, "cancelled": cancelled, "used": used, "revenue": float(revenue)}
+            for day, paid, cancelled, used, revenue in rows
+        ]
+
+    # --- Drift ---
+    def retained_since(self):
+        """Start of the ticket history still in the database; '-infinity' until retention archived any"""
+        if not self.db.fetch_one("SELECT to_regclass('partition_retention')")[0]:
+            return "-infinity"
+        row = self.db.fetch_one("SELECT archived_before FROM partition_retention WHERE table_name = 'tickets'")
+        return row[0] if row else "-infinity"
+
+    def verify(self):
+        """Buckets whose counters (pending deltas included) differ from a fresh aggregate over tickets"""
+        try:
+            query = f"""
+                SELECT COALESCE(r.bus_id, s.bus_id), COALESCE(r.day, s.day),
+                       r.paid, s.paid, r.cancelled, s.cancelled, r.used, s.used,
+                       r.paid_revenue, s.paid_revenue
+                FROM (
+                    SELECT bus_id, day, SUM(paid) AS paid, SUM(cancelled) AS cancelled, SUM(used) AS used,
+                           SUM(paid_revenue) AS paid_revenue
+                    FROM {ROLLUP_ROWS_SQL}
+                    GROUP BY bus_id, day
+                ) r
+                FULL OUTER JOIN ({ROLLUP_SOURCE_SQL}) s ON s.bus_id = r.bus_id AND s.day = r.day
+                WHERE COALESCE(r.day, s.day) >= %(since)s::date
+                  AND (r.paid, r.cancelled, r.used, r.paid_revenue)
+                      IS DISTINCT FROM (s.paid, s.cancelled, s.used, s.paid_revenue)
+                ORDER BY 1, 2
+            """
+            rows = self.db.fetch_all(query, {"since": self.retained_since()})
+            drift = []
+            for bus_id, day, r_paid, s_paid, r_cancelled, s_cancelled, r_used, s_used, r_revenue, s_revenue in rows:
+                drift.append({
+                    "bus_id": bus_id,
+                    "day": day,
+                    "stored": (r_paid, r_cancelled, r_used, r_revenue),
+                    "actual": (s_paid, s_cancelled, s_used, s_revenue),
+                })
+            return drift
+        except Exception:
+            db_logger.exception("Error verifying rollups")
+            return []
+
+    def rebuild(self):
+        """Recompute every bucket from tickets; blocks ticket writes while it runs.
+        Buckets of archived days are kept as they are."""
+        try:
+            with self.db.transaction():
+                self.db.execute_query("LOCK TABLE tickets IN SHARE MODE")
+                # pending deltas of archived days must land before the recount replaces the rest
+                CounterManager(self.db).fold_pending()
+                params = {"since": self.retained_since()}
+                self.db.execute_query("DELETE FROM ticket_rollups WHERE day >= %(since)s::date", params)
+                self.db.execute_query(f"""
+                    INSERT INTO ticket_rollups (bus_id, day, paid, cancelled, used, paid_revenue)
+                    {ROLLUP_SOURCE_SQL}
+                """, params)
+                count = self.db.cur.rowcount
+                # recomputed buckets invalidate every stored report (reports.watermark_query)
+                self.db.execute_query("UPDATE counter_state SET version = version + 1")
+                self.db.execute_query("UPDATE buses SET ticket_version = ticket_version + 1")
+            db_logger.info(f"Rebuilt {count} rollup buckets.")
+            return True
+        except Exception:
+            db_logger.exception("Error rebuilding rollups")
+            return False
@@ -0,0 +1,160 @@
+import bisect
+import os
+from datetime import date, datetime, timedelta
+from bus import BusManager, bus_cache, city_key
+from counters import LIVE_SEATS_SQL
+from db_connect import db_logger, replica_read
+from pagination import InvalidCursor, fetch_page
+
+# Route index for autocomplete: built from bus_stops, kept in the bus cache and
+# dropped whenever a bus is added, updated or imported.
+ROUTE_INDEX_TTL = float(os.getenv("ROUTE_INDEX_TTL", "300"))
+SEARCH_MIN_SEATS = int(os.getenv("SEARCH_MIN_SEATS", "1"))
+
+# Trips without a parseable departure sort last (and never match a date range)
+TRIP_SORT_KEY = "COALESCE(b.departure_at, 'infinity'::TIMESTAMP)"
+
+TRIP_SELECT = """
+    SELECT b.bus_id, b.bus_name, b.bus_number, b.total_seats, b.price_per_seat,
+           b.departure_time, b.arrival_time, b.route, {live_seats},
+           b.departure_at, b.arrival_at, {origin}, {destination}
+    FROM buses b
+"""
+TRIP_STOP_NAME_SQL = "(SELECT MIN(city) FROM bus_stops s WHERE s.bus_id = b.bus_id AND s.city_key = %s)"
+SEARCH_KEYSET = (f"({TRIP_SORT_KEY}, b.bus_id) > (%s, %s)", lambda row: (row[9] or "infinity", row[0]))
+
+ROUTE_CITIES_SQL = "SELECT city_key, MIN(city), COUNT(DISTINCT bus_id) FROM bus_stops GROUP BY city_key"
+ROUTE_PAIRS_SQL = """
+    SELECT DISTINCT o.city_key, d.city_key
+    FROM bus_stops o
+    JOIN bus_stops d ON d.bus_id = o.bus_id AND d.stop_order > o.stop_order
+"""
+
+
+def _moment(value, end=False):
+    """datetime from a date/datetime/ISO string; a bare date as end bound covers that whole day"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, str):
+        try:
+            value = date.fromisoformat(value) if len(value.strip()) == 10 else datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError(f"Invalid date '{value}', use YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return datetime(value.year, value.month, value.day) + (timedelta(days=1) if end else timedelta())
+
+
+def search_query(origin=None, destination=None, date_from=None, date_to=None, min_seats=SEARCH_MIN_SEATS,
+                 max_price=None):
+    """(sql, params) for fetch_page: trips stopping at origin and later at destination, departing in
+    [date_from, date_to], with at least min_seats free seats at no more than max_price"""
+    origin_key, destination_key = city_key(origin), city_key(destination)
+    start, end = _moment(date_from), _moment(date_to, end=True)
+    if start and end and start >= end:
+        raise ValueError("date_from must be before date_to")
+    clauses, params = [], []
+    # EXISTS rather than joins: a route that stops in a city twice must still yield the trip
+    # once, or the (sort key, bus_id) keyset would repeat it
+    if origin_key and destination_key:
+        clauses.append("""EXISTS (
+            SELECT 1 FROM bus_stops o
+            JOIN bus_stops d ON d.bus_id = o.bus_id AND d.stop_order > o.stop_order
+            WHERE o.bus_id = b.bus_id AND o.city_key = %s AND d.city_key = %s
+        )""")
+        params += [origin_key, destination_key]
+    elif origin_key or destination_key:
+        clauses.append("EXISTS (SELECT 1 FROM bus_stops s WHERE s.bus_id = b.bus_id AND s.city_key = %s)")
+        params.append(origin_key or destination_key)
+    if start or end:
+        clauses.append(f"{TRIP_SORT_KEY} >= COALESCE(%s, '-infinity'::TIMESTAMP)")
+        clauses.append(f"{TRIP_SORT_KEY} < COALESCE(%s, 'infinity'::TIMESTAMP)")
+        params += [start, end]
+    if min_seats:
+        clauses.append(f"{LIVE_SEATS_SQL} >= %s")
+        params.append(int(min_seats))
+    if max_price is not None:
+        clauses.append("b.price_per_seat <= %s")
+        params.append(max_price)
+    # the searched stops are shown as the trip's ends
+    columns = [key for key in (origin_key, destination_key) if key]
+    sql = TRIP_SELECT.format(
+        live_seats=LIVE_SEATS_SQL,
+        origin=TRIP_STOP_NAME_SQL if origin_key else "b.origin",
+        destination=TRIP_STOP_NAME_SQL if destination_key else "b.destination",
+    )
+    sql += " WHERE " + (" AND ".join(clauses) or "TRUE")
+    sql += " {after} ORDER BY " + TRIP_SORT_KEY + ", b.bus_id LIMIT %s"
+    return sql, tuple(columns + params)
+
+
+def trip_row(row):
+    trip = BusManager._bus_row(row[:9])
+    trip.update(departure_at=row[9], arrival_at=row[10], origin=row[11], destination=row[12])
+    return trip
+
+
+class RouteIndex:
+    """Sorted stop keys for prefix lookups plus which stops can be reached from which"""
+
+    def __init__(self, cities, pairs):
+        self._names = {}
+        self._trips = {}
+        for key, name, trips in cities:
+            self._names[key] = name
+            self._trips[key] = trips
+        self._keys = sorted(self._names)
+        self._reachable = {}
+        for origin, destination in pairs:
+            self._reachable.setdefault(origin, set()).add(destination)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def complete(self, prefix="", limit=10, origin=None):
+        """Stops starting with prefix, most served first; with origin, only stops reachable from it"""
+        key = city_key(prefix)
+        allowed = self._reachable.get(city_key(origin), set()) if origin else None
+        matches = []
+        for i in range(bisect.bisect_left(self._keys, key), len(self._keys)):
+            candidate = self._keys[i]
+            if not candidate.startswith(key):
+                break
+            if allowed is None or candidate in allowed:
+                matches.append(candidate)
+        matches.sort(key=lambda k: (-self._trips[k], k))
+        return [{"city": self._names[k], "trips": self._trips[k]} for k in matches[:max(0, int(limit))]]
+
+
+class SearchManager:
+    def __init__(self, db, cache=None):
+        self.db = db
+        self.cache = cache if cache is not None else bus_cache
+
+    @replica_read
+    def search(self, origin=None, destination=None, date_from=None, date_to=None, min_seats=SEARCH_MIN_SEATS,
+               max_price=None, page_size=None, cursor=None):
+        query, params = search_query(origin, destination, date_from, date_to, min_seats, max_price)
+        try:
+            rows, next_cursor = fetch_page(self.db, "search", query, params, cursor, page_size, *SEARCH_KEYSET)
+            return {"items": [trip_row(row) for row in rows], "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error searching trips")
+            return {"items": [], "next_cursor": None}
+
+    # --- Autocomplete ---
+    @replica_read
+    def _load_route_index(self):
+        try:
+            return RouteIndex(self.db.fetch_all(ROUTE_CITIES_SQL), self.db.fetch_all(ROUTE_PAIRS_SQL))
+        except Exception:
+            db_logger.exception("Error loading route index")
+            return RouteIndex((), ())
+
+    def route_index(self):
+        return self.cache.get_or_load(("routes",), self._load_route_index, ROUTE_INDEX_TTL)
+
+    def complete(self, prefix="", limit=10, origin=None):
+        return self.route_index().complete(prefix, limit, origin)
@@ -0,0 +1,305 @@
+import os
+import threading
+import psycopg2
+from bus import BusManager
+from db_connect import db_logger, replica_read
+
+# "rows" keeps one seats row per seat, "bitmap" stores a seat_map per bus
+SEAT_INVENTORY = os.getenv("SEAT_INVENTORY", "rows")
+
+# Tail of the bitmap purchase-statement fragments: the claimed seat from whichever branch
+# matched, and the queued counter change for a seats-row claim (bitmap claims update the
+# bus row they already lock)
+ROW_SEAT_FRAGMENT_SQL = """
+        seat AS (
+            SELECT seat_id, seat_number FROM map_seat
+            UNION ALL
+            SELECT seat_id, seat_number FROM row_seat
+        ),
+        counter AS (
+            INSERT INTO counter_deltas (bus_id, seats)
+            SELECT %(bus_id)s, -1 FROM row_seat
+        )
+"""
+
+
+class SeatBitmap:
+    """Booked-seat bitmap; seat n is bit (n-1), least significant bit first like Postgres get_bit(bytea)."""
+
+    def __init__(self, total_seats, data=None):
+        size = (total_seats + 7) // 8
+        self.total_seats = total_seats
+        self._bits = bytearray(data) if data is not None else bytearray(size)
+        if len(self._bits) != size:
+            raise ValueError(f"Seat map for {total_seats} seats must be {size} bytes")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, total_seats, data):
+        return cls(total_seats, bytes(data))
+
+    def to_bytes(self):
+        return bytes(self._bits)
+
+    def _position(self, seat_number):
+        if not 1 <= seat_number <= self.total_seats:
+            raise IndexError(f"Seat {seat_number} out of range 1..{self.total_seats}")
+        index = seat_number - 1
+        return index >> 3, 1 << (index & 7)
+
+    def is_booked(self, seat_number):
+        byte, mask = self._position(seat_number)
+        return bool(self._bits[byte] & mask)
+
+    def set(self, seat_number):
+        """Mark a seat booked; False if it already was"""
+        byte, mask = self._position(seat_number)
+        with self._lock:
+            if self._bits[byte] & mask:
+                return False
+            self._bits[byte] |= mask
+            return True
+
+    def clear(self, seat_number):
+        """Mark a seat free; False if it already was"""
+        byte, mask = self._position(seat_number)
+        with self._lock:
+            if not self._bits[byte] & mask:
+                return False
+            self._bits[byte] &= ~mask
+            return True
+
+    def first_free(self):
+        for byte, value in enumerate(self._bits):
+            if value != 0xFF:
+                free = ~value & (value + 1)  # lowest clear bit
+                seat_number = byte * 8 + free.bit_length()
+                return seat_number if seat_number <= self.total_seats else None
+        return None
+
+    def count_free(self):
+        return self.total_seats - int.from_bytes(self._bits, "little").bit_count()
+
+    def free_seats(self):
+        return [n for n in range(1, self.total_seats + 1) if not self.is_booked(n)]
+
+    def __len__(self):
+        return self.total_seats
+
+
+class BitmapBusManager(BusManager):
+    """BusManager storing each bus's seats as a bytea bitmap on buses.seat_map instead of seats rows.
+    Buses created before the switch keep their seats rows (seat_map IS NULL) and are served from
+    those: each statement below has a bitmap and a seats-row branch, only one of which matches."""
+
+    SEAT_INVENTORY = "bitmap"
+
+    SEAT_CLAIM_SQL = """
+        map_seat AS (
+            UPDATE buses
+            SET seat_map = set_bit(seat_map, %(seat_number)s - 1, 1),
+                available_seats = available_seats - 1,
+                ticket_version = ticket_version + 1
+            WHERE bus_id = %(bus_id)s
+              AND %(seat_number)s BETWEEN 1 AND total_seats
+              AND get_bit(seat_map, %(seat_number)s - 1) = 0
+            RETURNING NULL::INTEGER AS seat_id, %(seat_number)s::INTEGER AS seat_number
+        ),
+        row_seat AS (
+            UPDATE seats SET is_booked = TRUE
+            WHERE seat_id = %(seat_id)s AND bus_id = %(bus_id)s AND is_booked = FALSE
+            RETURNING seat_id, seat_number
+        ),
+    """ + ROW_SEAT_FRAGMENT_SQL
+    SEAT_EXISTS_SQL = (
+        "SELECT 1 FROM buses WHERE bus_id = %(bus_id)s AND seat_map IS NOT NULL"
+        " AND %(seat_number)s BETWEEN 1 AND total_seats"
+        " UNION ALL " + BusManager.SEAT_EXISTS_SQL
+    )
+    # The whole map is one row, so there is nothing to skip: pick the best free bit from the
+    # snapshot and set it only if it is still clear once the row lock is held (else retry).
+    ANY_SEAT_CLAIM_SQL = """
+        map_seat AS (
+            UPDATE buses
+            SET seat_map = set_bit(buses.seat_map, pick.seat_number - 1, 1),
+                available_seats = buses.available_seats - 1,
+                ticket_version = buses.ticket_version + 1
+            FROM (
+                SELECT seat_number FROM buses b, generate_series(1, b.total_seats) AS seat_number
+                WHERE b.bus_id = %(bus_id)s AND b.seat_map IS NOT NULL AND get_bit(b.seat_map, seat_number - 1) = 0
+                ORDER BY {order}
+                LIMIT 1
+            ) pick
+            WHERE buses.bus_id = %(bus_id)s AND get_bit(buses.seat_map, pick.seat_number - 1) = 0
+            RETURNING NULL::INTEGER AS seat_id, pick.seat_number::INTEGER AS seat_number
+        ),
+        row_seat AS (
+            UPDATE seats SET is_booked = TRUE
+            WHERE seat_id = (
+                SELECT seat_id FROM seats
+                WHERE bus_id = %(bus_id)s AND is_booked = FALSE
+                ORDER BY {order}
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING seat_id, seat_number
+        ),
+    """ + ROW_SEAT_FRAGMENT_SQL
+    ANY_SEAT_COLUMN = "seat_number"
+    RESOLVE_SEAT_SQL = """
+        SELECT price_per_seat, NULL::INTEGER, COALESCE(c.bit = 1, FALSE), COALESCE(c.bit = 0, FALSE)
+        FROM buses,
+             LATERAL (SELECT CASE WHEN %(seat_number)s BETWEEN 1 AND total_seats
+                                  THEN get_bit(seat_map, %(seat_number)s - 1) END AS bit) c
+        WHERE bus_id = %(bus_id)s AND seat_map IS NOT NULL
+        UNION ALL
+    """ + BusManager.RESOLVE_SEAT_SQL + " AND b.seat_map IS NULL"
+    FREE_SEATS_SQL = """
+        WITH bus AS (SELECT %s::INTEGER AS bus_id)
+        SELECT NULL::INTEGER, n FROM bus JOIN buses b USING (bus_id), generate_series(1, b.total_seats) AS n
+        WHERE b.seat_map IS NOT NULL AND get_bit(b.seat_map, n - 1) = 0
+        UNION ALL
+        SELECT s.seat_id, s.seat_number FROM bus JOIN seats s USING (bus_id) WHERE s.is_booked = FALSE
+        ORDER BY 2
+    """
+    BUS_EXISTS_SQL = BusManager.BUS_EXISTS_SQL
+    RELEASE_SEAT_SQL = """
+        WITH map_seat AS (
+            UPDATE buses
+            SET seat_map = set_bit(seat_map, %(seat_number)s - 1, 0), available_seats = available_seats + 1,
+                ticket_version = ticket_version + 1
+            WHERE bus_id = %(bus_id)s AND %(seat_id)s IS NULL AND %(seat_number)s BETWEEN 1 AND total_seats
+              AND get_bit(seat_map, %(seat_number)s - 1) = 1
+            RETURNING bus_id
+        ),
+        row_seat AS (
+            UPDATE seats SET is_booked = FALSE
+            WHERE is_booked AND bus_id = %(bus_id)s
+              AND (seat_id = %(seat_id)s OR (%(seat_id)s IS NULL AND seat_number = %(seat_number)s))
+            RETURNING bus_id
+        ),
+        counter AS (
+            INSERT INTO counter_deltas (bus_id, seats)
+            SELECT bus_id, 1 FROM row_seat
+        )
+        SELECT bus_id FROM map_seat
+        UNION ALL
+        SELECT bus_id FROM row_seat
+    """
+    ROW_BUS_SQL = "SELECT seat_map IS NULL FROM buses WHERE bus_id = %s"
+
+    # --- Add bus ---
+    def add_bus(self, admin_id, bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route):
+        try:
+            query = """INSERT INTO buses (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route, available_seats, seat_map)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                       ON CONFLICT (bus_number) DO NOTHING RETURNING bus_id"""
+            seat_map = psycopg2.Binary(SeatBitmap(total_seats).to_bytes())
+            with self.db.transaction():
+                result = self.db.fetch_one(query, (bus_name, bus_number, total_seats, price_per_seat, departure_time, arrival_time, route, total_seats, seat_map))
+                if not result:
+                    self.db.rollback()
+                    db_logger.error("Bus number already exists")
+                    return False
+                self.sync_trips([result[0]])
+
+            self.cache.invalidate(("buses",), ("routes",))
+            db_logger.info(f"Bus '{bus_name}' added successfully with {total_seats} seats.")
+            return True
+        except Exception:
+            db_logger.exception(f"Error adding bus: {bus_name}", exc_info=True)
+            return False
+
+    def get_seat_map(self, bus_id):
+        try:
+            result = self.db.fetch_one("SELECT total_seats, seat_map FROM buses WHERE bus_id=%s;", (bus_id,))
+            if not result or result[1] is None:
+                db_logger.info("Bus not found")
+                return None
+            return SeatBitmap.from_bytes(result[0], result[1])
+        except Exception:
+            db_logger.exception(f"Error loading seat map: {bus_id}", exc_info=True)
+            return None
+
+    # --- Seats ---
+    # get_available_seats, and reserve_seat / release_seat by seat_id (only seats-row buses
+    # have seat ids), are BusManager's; the seat-number API goes by the bus's inventory.
+    def _uses_seat_rows(self, bus_id):
+        result = self.db.fetch_one(self.ROW_BUS_SQL, (bus_id,))
+        return bool(result and result[0])
+
+    def reserve_seat_number(self, bus_id, seat_number):
+        try:
+            if self._uses_seat_rows(bus_id):
+                return super().reserve_seat_number(bus_id, seat_number)
+            query = """
+                UPDATE buses
+                SET seat_map = set_bit(seat_map, %s - 1, 1), available_seats = available_seats - 1,
+                    ticket_version = ticket_version + 1
+                WHERE bus_id = %s AND %s BETWEEN 1 AND total_seats AND get_bit(seat_map, %s - 1) = 0
+                RETURNING bus_id
+            """
+            if not self.db.fetch_one(query, (seat_number, bus_id, seat_number, seat_number)):
+                db_logger.info("Seat not found or already booked.")
+                return False
+            return True
+        except Exception:
+            db_logger.exception(f"Error reserving seat {seat_number} on bus {bus_id}", exc_info=True)
+            return False
+
+    def release_seat_number(self, bus_id, seat_number):
+        try:
+            if self._uses_seat_rows(bus_id):
+                return super().release_seat_number(bus_id, seat_number)
+            query = """
+                UPDATE buses
+                SET seat_map = set_bit(seat_map, %s - 1, 0), available_seats = available_seats + 1,
+                    ticket_version = ticket_version + 1
+                WHERE bus_id = %s AND %s BETWEEN 1 AND total_seats AND get_bit(seat_map, %s - 1) = 1
+                RETURNING bus_id
+            """
+            if not self.db.fetch_one(query, (seat_number, bus_id, seat_number, seat_number)):
+                db_logger.info("Seat not booked.")
+                return False
+            return True
+        except Exception:
+            db_logger.exception(f"Error releasing seat {seat_number} on bus {bus_id}", exc_info=True)
+            return False
+
+    def first_free_seat(self, bus_id):
+        if self._uses_seat_rows(bus_id):
+            return super().first_free_seat(bus_id)
+        seat_map = self.get_seat_map(bus_id)
+        return seat_map.first_free() if seat_map else None
+
+    # --- Seat counter consistency ---
+    def check_seat_counters(self, repair=False):
+        """BusManager's check for the seats-row buses, then the bitmap buses against their maps"""
+        row_drifted = super().check_seat_counters(repair)
+        try:
+            rows = self.db.fetch_all(
+                "SELECT bus_id, available_seats, total_seats, seat_map FROM buses WHERE seat_map IS NOT NULL ORDER BY bus_id"
+            )
+            drifted = []
+            for bus_id, stored, total_seats, seat_map in rows:
+                actual = SeatBitmap.from_bytes(total_seats, seat_map).count_free()
+                if stored != actual:
+                    drifted.append({"bus_id": bus_id, "stored": stored, "actual": actual})
+            if repair and drifted:
+                with self.db.transaction():
+                    self.db.cur.executemany(
+                        "UPDATE buses SET available_seats=%s WHERE bus_id=%s;",
+                        [(d["actual"], d["bus_id"]) for d in drifted]
+                    )
+                self.invalidate_cache()
+                db_logger.info(f"Repaired seat counters for {len(drifted)} buses.")
+            return sorted(row_drifted + drifted, key=lambda d: d["bus_id"])
+        except Exception:
+            db_logger.exception("Error checking seat counters", exc_info=True)
+            return row_drifted
+
+
+def make_bus_manager(db):
+    if SEAT_INVENTORY == "bitmap":
+        return BitmapBusManager(db)
+    return BusManager(db)
@@ -0,0 +1,357 @@
+import asyncio
+import inspect
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from db_connect import ConnectionPool, PostgresConnection, db_logger, get_pool, get_router
+from audit_log import close_audit_writer
+from bus import bus_cache
+from counters import CounterManager
+from pagination import InvalidCursor
+from partitions import PartitionManager
+from query_stats import flush_query_stats
+from search import SEARCH_MIN_SEATS
+from wallet_ledger import LedgerWalletManager, WALLET_MODE
+
+# Long-running service: one JSON request per line in, one JSON response per line out.
+#   {"id": 1, "op": "book", "params": {"user_id": 3, "bus_id": 7, "seat_number": 12}}
+#   {"id": 1, "ok": true, "result": true}
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8765"))
+SERVICE_CONCURRENCY = int(os.getenv("SERVICE_CONCURRENCY", "8"))
+SERVICE_QUEUE_TIMEOUT = float(os.getenv("SERVICE_QUEUE_TIMEOUT", "5"))
+SERVICE_DRAIN_TIMEOUT = float(os.getenv("SERVICE_DRAIN_TIMEOUT", "30"))
+SERVICE_MAX_LINE = int(os.getenv("SERVICE_MAX_LINE", "65536"))
+# Ledger wallet snapshot + shard reconciliation period (0 disables)
+WALLET_MAINTENANCE_INTERVAL = float(os.getenv("WALLET_MAINTENANCE_INTERVAL", "300"))
+# Creation of upcoming monthly history partitions (0 disables)
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+# Folding of queued seat and rollup counter changes into buses / ticket_rollups (0 disables)
+COUNTER_FOLD_INTERVAL = float(os.getenv("COUNTER_FOLD_INTERVAL", "2"))
+MAINTENANCE_LOOPS = 3  # wallet, partition and counter maintenance
+
+
+def _user(user):
+    if not user:
+        return None
+    return {"user_id": user.user_id, "name": user.name, "email": user.email, "is_admin": user.is_admin}
+
+
+def _report(system, p):
+    if p.get("bus_id"):
+        return system.report_manager.get_revenue_by_bus(p["admin_id"], p["bus_id"])
+    return system.report_manager.get_total_revenue(p["admin_id"])
+
+
+# op -> handler(system, params); every handler runs in one transaction scope
+OPERATIONS = {
+    "register": lambda s, p: s.register(p["name"], p["email"], p["password"]),
+    "login": lambda s, p: _user(s.login(p["email"], p["password"])),
+    "addbus": lambda s, p: s.add_bus(p["admin_id"], p["name"], p["number"], p["seats"], p["price"],
+                                     p["departure"], p["arrival"], p["route"]),
+    "book": lambda s, p: (s.book_ticket(p["user_id"], p["bus_id"], p["seat_number"]) if p.get("seat_number") is not None
+                          else s.book_any_seat(p["user_id"], p["bus_id"], p.get("prefer"))),
+    "cancel": lambda s, p: s.cancel_ticket(p["user_id"], p["ticket_id"]),
+    "addmoney": lambda s, p: s.add_money(p["user_id"], p["amount"]),
+    "balance": lambda s, p: s.wallet_manager.get_balance(p["user_id"]),
+    "transactions": lambda s, p: s.wallet_manager.get_transactions_page(p["user_id"], p.get("page_size"), p.get("cursor"),
+                                                                        p.get("since")),
+    "tickets": lambda s, p: s.ticket_manager.get_user_tickets_page(p["user_id"], p.get("page_size"), p.get("cursor"),
+                                                                   p.get("since")),
+    "buses": lambda s, p: s.bus_manager.get_buses_page(p.get("page_size"), p.get("cursor")),
+    "bus": lambda s, p: s.bus_manager.get_bus_by_id(p["bus_id"]),
+    "seats": lambda s, p: s.bus_manager.get_available_seats(p["bus_id"]),
+    "search": lambda s, p: s.search_manager.search(p.get("origin"), p.get("destination"), p.get("date_from"),
+                                                   p.get("date_to"), p.get("min_seats", SEARCH_MIN_SEATS), p.get("max_price"),
+                                                   p.get("page_size"), p.get("cursor")),
+    "complete": lambda s, p: s.search_manager.complete(p.get("prefix", ""), p.get("limit", 10), p.get("origin")),
+    "report": _report,
+    "stats": lambda s, p: s.report_manager.get_trip_statistics(p["admin_id"]),
+    "audit": lambda s, p: s.audit.get_logs_page(p.get("page_size"), p.get("cursor"), p.get("since")),
+}
+
+
+async def _alogin(s, p):
+    return _user(await s.login(p["email"], p["password"]))
+
+
+# Same operations for AsyncReservationSystem, whose methods return awaitables
+ASYNC_OPERATIONS = dict(OPERATIONS, login=_alogin)
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)  # Decimal keeps its exact digits
+
+
+class ReservationService:
+    """Keeps a warm pool and one BusReservationSystem per worker thread between requests"""
+
+    def __init__(self, system_class, pool=None, concurrency=SERVICE_CONCURRENCY,
+                 queue_timeout=SERVICE_QUEUE_TIMEOUT, drain_timeout=SERVICE_DRAIN_TIMEOUT):
+        self.system_class = system_class
+        self.concurrency = concurrency
+        self.pool = pool or self._default_pool()
+        self.queue_timeout = queue_timeout
+        self.drain_timeout = drain_timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="service")
+        self._local = threading.local()
+        self._slots = None
+        self._server = None
+        self._clients = set()
+        self._in_flight = 0
+        self._idle = None
+        self._stopping = False
+        self.started_at = time.time()
+        self.counters = {"requests": 0, "errors": 0, "rejected": 0, "connections": 0}
+
+    def _default_pool(self):
+        return get_pool() or ConnectionPool(min_size=self.concurrency, max_size=self.concurrency)
+
+    async def _dispatch(self, op, params):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._run, op, params)
+
+    def _pool_stats(self):
+        return self.pool.stats()
+
+    async def _open_pool(self):
+        pass
+
+    async def _close_pool(self):
+        self.pool.closeall()
+
+    # --- Worker side (runs in executor threads) ---
+    def _system(self):
+        system = getattr(self._local, "system", None)
+        if system is None:
+            db = PostgresConnection(pool=self.pool)
+            system = self._local.system = self.system_class(db)
+        return system
+
+    def _run(self, op, params):
+        system = self._system()
+        system.db.actor = params.get("user_id")  # read-your-writes key for replica routing
+        with system.db as db:
+            with db.transaction():
+                return OPERATIONS[op](system, params)
+
+    def _maintenance_db(self):
+        return PostgresConnection(pool=self.pool)
+
+    def _wallet_maintenance(self):
+        with self._maintenance_db() as db:
+            wallets = LedgerWalletManager(db)
+            wallets.snapshot()
+            wallets.reconcile(repair=True)
+
+    def _partition_maintenance(self):
+        with self._maintenance_db() as db:
+            PartitionManager(db).ensure_partitions()
+
+    def _counter_maintenance(self):
+        with self._maintenance_db() as db:
+            CounterManager(db).fold()
+
+    async def _maintenance_loop(self, interval, job, name):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self.executor, job)
+            except Exception:
+                db_logger.exception(f"{name} maintenance failed")
+
+    # --- Request handling ---
+    def stats(self):
+        return {
+            "uptime": time.time() - self.started_at,
+            "in_flight": self._in_flight,
+            "concurrency": self.concurrency,
+            "counters": dict(self.counters),
+            "pool": self._pool_stats(),
+            "bus_cache": bus_cache.stats(),
+            "replicas": get_router().stats() if get_router() else None,
+        }
+
+    async def handle(self, request):
+        op = request.get("op")
+        params = request.get("params") or {}
+        if op == "ping":
+            return "pong"
+        if op == "server_stats":
+            return self.stats()
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown op '{op}'")
+        if not isinstance(params, dict):
+            raise ValueError("params must be an object")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected"] += 1
+            raise RuntimeError("Server busy, try again")
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            return await self._dispatch(op, params)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+            self._slots.release()
+
+    async def _respond(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+        except ValueError as e:
+            self.counters["errors"] += 1
+            return {"id": None, "ok": False, "error": f"Bad request: {e}"}
+        self.counters["requests"] += 1
+        response = {"id": request.get("id")}
+        try:
+            response.update(ok=True, result=await self.handle(request))
+        except KeyError as e:
+            response.update(ok=False, error=f"Missing parameter {e}")
+        except (ValueError, TypeError, InvalidCursor, RuntimeError) as e:
+            response.update(ok=False, error=str(e))
+        except Exception:
+            db_logger.exception(f"Error handling {request.get('op')}")
+            response.update(ok=False, error="Internal error")
+        if not response["ok"]:
+            self.counters["errors"] += 1
+        return response
+
+    async def _client(self, reader, writer):
+        self.counters["connections"] += 1
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            while not self._stopping:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(b'{"id": null, "ok": false, "error": "Request too large"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self._respond(line)
+                writer.write(json.dumps(response, default=json_default).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    # --- Lifecycle ---
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT, socket_path=None):
+        await self._open_pool()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        if socket_path:
+            self._server = await asyncio.start_unix_server(self._client, socket_path, limit=SERVICE_MAX_LINE)
+            db_logger.info(f"Service listening on {socket_path}")
+        else:
+            self._server = await asyncio.start_server(self._client, host, port, limit=SERVICE_MAX_LINE)
+            db_logger.info(f"Service listening on {host}:{port}")
+
+        maintenance = []
+        if WALLET_MODE == "ledger" and WALLET_MAINTENANCE_INTERVAL > 0:
+            maintenance.append(asyncio.create_task(
+                self._maintenance_loop(WALLET_MAINTENANCE_INTERVAL, self._wallet_maintenance, "Wallet")))
+        if PARTITION_MAINTENANCE_INTERVAL > 0:
+            maintenance.append(asyncio.create_task(
+                self._maintenance_loop(PARTITION_MAINTENANCE_INTERVAL, self._partition_maintenance, "Partition")))
+        if COUNTER_FOLD_INTERVAL > 0:
+            maintenance.append(asyncio.create_task(
+                self._maintenance_loop(COUNTER_FOLD_INTERVAL, self._counter_maintenance, "Counter")))
+
+        await stop.wait()
+        for task in maintenance:
+            task.cancel()
+        await self.shutdown()
+
+    async def shutdown(self):
+        """Stop accepting, let in-flight requests finish, then release connections"""
+        db_logger.info("Shutting down service ...")
+        self._stopping = True
+        self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            db_logger.warning(f"{self._in_flight} requests still running after {self.drain_timeout}s")
+        # wait_closed() also waits for open client connections (Python 3.12+), so end them first
+        clients = list(self._clients)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        await self._server.wait_closed()
+        self.executor.shutdown(wait=True)
+        close_audit_writer()
+        flush_query_stats()
+        await self._close_pool()
+        if get_router():
+            get_router().closeall()
+        db_logger.info("Service stopped.")
+
+
+class AsyncReservationService(ReservationService):
+    """Requests run as coroutines on psycopg 3 connections; no thread is held while a query waits.
+    concurrency is the number of in-flight requests and the size of the async pool."""
+
+    def __init__(self, system_class, pool=None, **kwargs):
+        super().__init__(system_class, pool, **kwargs)
+        # psycopg2 connections for the maintenance jobs (executor threads), at most one per
+        # maintenance loop, kept between ticks instead of reconnecting every COUNTER_FOLD_INTERVAL
+        self.maintenance_pool = ConnectionPool(min_size=0, max_size=MAINTENANCE_LOOPS)
+
+    def _default_pool(self):
+        from async_db import make_async_pool
+        return make_async_pool(max_size=self.concurrency)
+
+    async def _open_pool(self):
+        await self.pool.open()
+
+    async def _close_pool(self):
+        await self.pool.close()
+        self.maintenance_pool.closeall()
+
+    def _pool_stats(self):
+        from async_db import pool_stats
+        return pool_stats(self.pool)
+
+    async def _dispatch(self, op, params):
+        from async_db import AsyncPostgresConnection
+        async with AsyncPostgresConnection(pool=self.pool) as db:
+            system = self.system_class(db)
+            async with db.transaction():
+                result = ASYNC_OPERATIONS[op](system, params)
+                return await result if inspect.isawaitable(result) else result
+
+    def _maintenance_db(self):
+        return PostgresConnection(pool=self.maintenance_pool)
+
+
+def serve(system_class, host=SERVICE_HOST, port=SERVICE_PORT, socket_path=None, concurrency=SERVICE_CONCURRENCY,
+          use_async=False):
+    service_class = AsyncReservationService if use_async else ReservationService
+    service = service_class(system_class, concurrency=concurrency)
+    asyncio.run(service.serve(host, port, socket_path))
@@ -0,0 +1,57 @@
+from async_db import AsyncPostgresConnection
+from db_connect import PostgresConnection
+
+# Connections that record statements and transaction control instead of talking to
+# Postgres, shared by the transaction, batch, report and async parity tests.
+
+
+class FakeConnection:
+    """Records transaction control; the cursor shares the log"""
+
+    def __init__(self):
+        self.log = []
+        self.cursor = FakeCursor(self.log)
+
+    def commit(self):
+        self.log.append("COMMIT")
+
+    def rollback(self):
+        self.log.append("ROLLBACK")
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+    def fetchone(self):
+        return None
+
+
+class AsyncFakeConnection(FakeConnection):
+    async def commit(self):
+        FakeConnection.commit(self)
+
+    async def rollback(self):
+        FakeConnection.rollback(self)
+
+
+class AsyncFakeCursor(FakeCursor):
+    async def execute(self, sql, params=None):
+        FakeCursor.execute(self, sql)
+
+
+def sync_db():
+    db = PostgresConnection(router=None)
+    db.con = FakeConnection()
+    db.cur = db._primary_cur = db.con.cursor
+    return db
+
+
+def async_db():
+    db = AsyncPostgresConnection()
+    db.con = AsyncFakeConnection()
+    db.cur = AsyncFakeCursor(db.con.log)
+    return db
@@ -0,0 +1,229 @@
+import asyncio
+from datetime import date, datetime
+from decimal import Decimal
+import pytest
+from async_db import AsyncPostgresConnection
+from async_managers import (AsyncBusManager, AsyncReportManager, AsyncSearchManager, AsyncTicketManager,
+                            AsyncUserManager, AsyncWalletManager)
+from bus import BUS_SELECT, BusManager
+from cache import TTLCache
+from reports import LATEST_REPORT_SQL, ReportManager
+from search import SearchManager
+from ticket import CANCEL_TICKET_SELECT_SQL, PURCHASE_OK, PURCHASE_SEAT_TAKEN, TicketManager
+from users import LOGIN_SQL, UserManager
+from wallet import BALANCE_SQL, CREDIT_QUERY, WalletManager
+from fakes import AsyncFakeConnection, sync_db
+
+# The same fixture (canned rows per statement) is served to a sync manager over
+# PostgresConnection and to its async counterpart over AsyncPostgresConnection;
+# both must send the same statements, with the same transaction control, and
+# return the same result.
+
+BUS_ROW = (3, "Night Liner", "NL-3", 40, Decimal("12.50"), "08:00", "12:00", "Tehran - Qom", 17)
+TRIP_ROW = BUS_ROW + (datetime(2026, 10, 20, 8), datetime(2026, 10, 20, 12), "Tehran", "Qom")
+
+
+class ScriptCursor:
+    """Answers each statement with the rows of the first fixture key equal to or contained in it"""
+
+    connection = None
+
+    def __init__(self, log, fixture):
+        self.log = log
+        self.fixture = fixture
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self.log.append((sql, params or None))
+        self.rows = next((list(rows) for key, rows in self.fixture if key == sql or key in sql), [])
+        self.rowcount = len(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class AsyncScriptCursor(ScriptCursor):
+    async def execute(self, sql, params=None):
+        ScriptCursor.execute(self, sql, params)
+
+    async def fetchone(self):
+        return ScriptCursor.fetchone(self)
+
+    async def fetchall(self):
+        return ScriptCursor.fetchall(self)
+
+
+def scripted_sync_db(fixture):
+    db = sync_db()
+    db.cur = db._primary_cur = ScriptCursor(db.con.log, fixture)
+    return db
+
+
+def scripted_async_db(fixture):
+    db = AsyncPostgresConnection()
+    db.con = AsyncFakeConnection()
+    db.cur = AsyncScriptCursor(db.con.log, fixture)
+    return db
+
+
+def run_both(fixture, sync_call, async_call):
+    """(sync result, sync log), (async result, async log) of one scenario"""
+    sync = scripted_sync_db(fixture)
+    sync_result = sync_call(sync)
+    adb = scripted_async_db(fixture)
+    async_result = asyncio.run(async_call(adb))
+    return (sync_result, sync.con.log), (async_result, adb.con.log)
+
+
+def assert_parity(fixture, sync_call, async_call):
+    (sync_result, sync_log), (async_result, async_log) = run_both(fixture, sync_call, async_call)
+    assert async_log == sync_log
+    assert async_result == sync_result
+    return sync_result
+
+
+def bus_managers():
+    return (lambda db: BusManager(db, cache=TTLCache()), lambda db: AsyncBusManager(db, BusManager, cache=TTLCache()))
+
+
+def ticket_managers():
+    def sync(db):
+        return TicketManager(db, BusManager(db, cache=TTLCache()), WalletManager(db))
+
+    def async_(db):
+        return AsyncTicketManager(db, AsyncBusManager(db, BusManager, cache=TTLCache()), AsyncWalletManager(db, WalletManager))
+
+    return sync, async_
+
+
+@pytest.mark.parametrize("password, expected", [("secret", "Customer"), ("wrong", None)])
+def test_login(password, expected):
+    fixture = [(LOGIN_SQL, [(5, "Sara", "sara@example.com", "secret", Decimal("40.00"), False)])]
+    (sync_user, sync_log), (async_user, async_log) = run_both(
+        fixture,
+        lambda db: UserManager(db).login_user("sara@example.com", password),
+        lambda db: AsyncUserManager(db).login_user("sara@example.com", password),
+    )
+    assert async_log == sync_log
+    assert type(async_user).__name__ == type(sync_user).__name__ == (expected or "NoneType")
+    assert vars(async_user) == vars(sync_user) if sync_user else async_user is None
+
+
+@pytest.mark.parametrize("rows", [[BUS_ROW], []])
+def test_bus_by_id(rows):
+    sync, async_ = bus_managers()
+    bus = assert_parity([(BUS_SELECT, rows)], lambda db: sync(db).get_bus_by_id(3),
+                        lambda db: async_(db).get_bus_by_id(3))
+    assert (bus or {}).get("available_seats") == (17 if rows else None)
+
+
+def test_free_seats():
+    sync, async_ = bus_managers()
+    fixture = [("FROM buses b WHERE b.bus_id=%s", [(17,)]), ("FROM seats", [(10, 1), (11, 2)])]
+    assert assert_parity(fixture, lambda db: sync(db).count_free_seats(3),
+                         lambda db: async_(db).count_free_seats(3)) == 17
+    assert assert_parity(fixture, lambda db: sync(db).get_available_seats(3),
+                         lambda db: async_(db).get_available_seats(3)) == [
+        {"seat_id": 10, "seat_number": 1}, {"seat_id": 11, "seat_number": 2}]
+
+
+@pytest.mark.parametrize("row, status", [
+    ((99, Decimal("87.50"), True, True, True, 4), PURCHASE_OK),
+    ((None, None, False, True, True, None), PURCHASE_SEAT_TAKEN),
+])
+def test_purchase(row, status):
+    sync, async_ = ticket_managers()
+    fixture = [("INSERT INTO tickets", [row])]
+    result = assert_parity(
+        fixture,
+        lambda db: sync(db).purchase(5, 3, 10, Decimal("12.50"), 4),
+        lambda db: async_(db).purchase(5, 3, 10, Decimal("12.50"), 4),
+    )
+    assert result["status"] == status
+
+
+def test_cancel():
+    sync, async_ = ticket_managers()
+    fixture = [
+        (CANCEL_TICKET_SELECT_SQL, [("PAID", Decimal("20.00"), 3, 10, 4, date(2026, 10, 1))]),
+        ("UPDATE seats SET is_booked", [(3,)]),
+        (CREDIT_QUERY, [(Decimal("56.00"),)]),
+    ]
+    (sync_result, sync_log), (async_result, async_log) = run_both(
+        fixture, lambda db: sync(db).cancel_ticket(5, 99), lambda db: async_(db).cancel_ticket(5, 99))
+    assert sync_result is async_result is True
+
+    # the sync manager frees the seat by seat_id in two statements, the async one in RELEASE_SEAT_SQL
+    def without_seat_release(log):
+        return [entry for entry in log if "seats" not in entry[0]]
+
+    assert without_seat_release(async_log) == without_seat_release(sync_log)
+
+
+def test_cancel_rolls_back_when_seat_is_not_released():
+    sync, async_ = ticket_managers()
+    fixture = [
+        (CANCEL_TICKET_SELECT_SQL, [("PAID", Decimal("20.00"), 3, 10, 4, date(2026, 10, 1))]),
+        (CREDIT_QUERY, [(Decimal("56.00"),)]),
+    ]
+    (sync_result, sync_log), (async_result, async_log) = run_both(
+        fixture, lambda db: sync(db).cancel_ticket(5, 99), lambda db: async_(db).cancel_ticket(5, 99))
+    assert sync_result is async_result is False
+    for log in (sync_log, async_log):
+        assert log[-1] == "ROLLBACK" and "COMMIT" not in log
+        assert not any(CREDIT_QUERY in entry[0] for entry in log if isinstance(entry, tuple))
+
+
+def test_balance():
+    assert assert_parity([(BALANCE_SQL, [(Decimal("56.00"),)])], lambda db: WalletManager(db).get_balance(5),
+                         lambda db: AsyncWalletManager(db, WalletManager).get_balance(5)) == 56.0
+
+
+@pytest.mark.parametrize("latest", [None, ("42", "125.0"), ("41", "125.0")])
+def test_total_revenue_report(latest):
+    fixture = [
+        ("FROM counter_state", [(42,)]),
+        (LATEST_REPORT_SQL, [latest] if latest else []),
+        ("SUM(paid_revenue)", [(10, 1, 0, Decimal("140.00"), 2)]),
+    ]
+    revenue = assert_parity(fixture, lambda db: ReportManager(db).get_total_revenue(1),
+                            lambda db: AsyncReportManager(db).get_total_revenue(1))
+    assert revenue == (125.0 if latest == ("42", "125.0") else 140.0)
+
+
+def test_search():
+    fixture = [("FROM buses b", [TRIP_ROW])]
+    page = assert_parity(
+        fixture,
+        lambda db: SearchManager(db, TTLCache()).search("tehran", "qom", "2026-10-20", page_size=5),
+        lambda db: AsyncSearchManager(db, TTLCache()).search("tehran", "qom", "2026-10-20", page_size=5),
+    )
+    assert [trip["bus_id"] for trip in page["items"]] == [3]
+
+
+def test_any_seat_charges_current_price_not_cached_one():
+    stale = TTLCache()
+    stale.set(("bus", 3), {"counted_at": 0, "buses": [BusManager._bus_row(BUS_ROW)]})  # cached at 12.50
+
+    def sync(db):
+        return TicketManager(db, BusManager(db, cache=stale), WalletManager(db))
+
+    def async_(db):
+        return AsyncTicketManager(db, AsyncBusManager(db, BusManager, cache=stale), AsyncWalletManager(db, WalletManager))
+
+    fixture = [
+        (BusManager.PRICE_SQL, [(Decimal("15.00"),)]),
+        ("INSERT INTO tickets", [(99, Decimal("85.00"), True, True, True, 4)]),
+    ]
+    (sync_result, sync_log), (async_result, async_log) = run_both(
+        fixture, lambda db: sync(db).purchase_any_seat(5, 3), lambda db: async_(db).purchase_any_seat(5, 3))
+    assert async_log == sync_log
+    assert async_result == sync_result
+    assert sync_result["status"] == PURCHASE_OK
+    purchase_params = next(params for sql, params in (e for e in sync_log if isinstance(e, tuple))
+                           if "INSERT INTO tickets" in sql)
+    assert purchase_params["price"] == purchase_params["amount"] == Decimal("15.00")
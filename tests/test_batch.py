@@ -0,0 +1,108 @@
+import threading
+import pytest
+import batch
+from batch import BatchRunner, _phases
+from counters import FOLD_LOCK_SQL
+from db_connect import PostgresConnection, RollbackOnly
+from fakes import FakeConnection
+
+
+class FakePostgresConnection(PostgresConnection):
+    logs = []
+
+    def __init__(self, pool=None):
+        super().__init__(pool=pool, router=None)
+
+    def __enter__(self):
+        self.con = FakeConnection()
+        self.cur = self._primary_cur = self.con.cursor
+        self.logs.append(self.con.log)
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSystem:
+    """add_money(user_id, amount): amount < 0 fails and rolls back, amount == 0 swallows a doomed scope"""
+
+    calls = []
+    lock = threading.Lock()
+
+    def __init__(self, db):
+        self.db = db
+
+    def add_money(self, user_id, amount):
+        with self.lock:
+            self.calls.append(("addmoney", user_id))
+        try:
+            with self.db.transaction():
+                self.db.cur.execute(f"UPDATE users {user_id}")
+                if amount < 0:
+                    self.db.rollback()
+                    return False
+                if amount == 0:
+                    self.db.rollback()
+        except RollbackOnly:
+            pass
+        return True
+
+    def add_bus(self, admin_id, *args):
+        with self.lock:
+            self.calls.append(("addbus", admin_id))
+        return True
+
+
+@pytest.fixture(autouse=True)
+def fake_db(monkeypatch):
+    FakePostgresConnection.logs = []
+    FakeSystem.calls = []
+    monkeypatch.setattr(batch, "PostgresConnection", FakePostgresConnection)
+
+
+def addmoney(line, user_id, amount):
+    return line, {"op": "addmoney", "params": {"user_id": user_id, "amount": amount}}
+
+
+def addbus(line):
+    return line, {"op": "addbus", "params": {"admin_id": 1, "name": "b", "number": str(line), "seats": 4,
+                                             "price": 10, "departure": "", "arrival": "", "route": ""}}
+
+
+def test_failed_command_only_undoes_its_savepoint():
+    runner = BatchRunner(FakeSystem, pool=object(), group_size=3)
+    results, summary = runner.run([addmoney(1, 1, 5), addmoney(2, 2, -1), addmoney(3, 3, 5)])
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert FakePostgresConnection.logs[0][-1] == "COMMIT"
+    assert summary["ok"] == 2
+
+
+def test_doomed_group_fails_every_command():
+    runner = BatchRunner(FakeSystem, pool=object(), group_size=1)
+    results, summary = runner.run([addmoney(1, 1, 5), addmoney(2, 2, 0), addmoney(3, 3, 5)])
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert "Group rolled back" in results[1]["error"]
+    assert FakePostgresConnection.logs[0].count("ROLLBACK") == 1
+
+
+def test_phases_split_at_barrier_ops():
+    commands = [addmoney(1, 1, 5), addbus(2), addbus(3), addmoney(4, 2, 5), addmoney(5, 3, 5)]
+    assert [(barrier, [line for line, _ in phase]) for barrier, phase in _phases(commands)] == [
+        (False, [1]), (True, [2, 3]), (False, [4, 5]),
+    ]
+
+
+def test_commands_after_a_barrier_wait_for_it():
+    commands = [addmoney(1, 1, 5), addmoney(2, 2, 5), addbus(3), addmoney(4, 1, 5), addmoney(5, 2, 5)]
+    runner = BatchRunner(FakeSystem, pool=object(), workers=2)
+    results, _ = runner.run(commands)
+    assert [r["line"] for r in results] == [1, 2, 3, 4, 5]
+    ops = [op for op, _ in FakeSystem.calls]
+    assert ops.index("addbus") == 2
+
+
+def test_counters_fold_every_n_commands_and_at_the_end():
+    runner = BatchRunner(FakeSystem, pool=object(), fold_every=2)
+    runner.run([addmoney(line, line, 5) for line in range(1, 6)])
+    folds = [log.count(FOLD_LOCK_SQL) for log in FakePostgresConnection.logs]
+    assert folds == [2, 1]  # after commands 2 and 4 in the worker, then once more after the run
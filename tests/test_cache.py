@@ -0,0 +1,83 @@
+import pytest
+import cache as cache_module
+from cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_get_and_set(clock):
+    cache = TTLCache(max_size=4, ttl=10)
+    assert cache.get("a", "missing") == "missing"
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(max_size=4, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=30)
+    clock[0] += 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TTLCache(max_size=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+def test_zero_size_disables_cache(clock):
+    cache = TTLCache(max_size=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_get_or_load_skips_empty_results(clock):
+    cache = TTLCache(max_size=4, ttl=10)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [] if len(calls) == 1 else ["row"]
+
+    assert cache.get_or_load("k", loader) == []
+    assert cache.get_or_load("k", loader) == ["row"]
+    assert cache.get_or_load("k", loader) == ["row"]
+    assert len(calls) == 2
+
+
+def test_invalidate(clock):
+    cache = TTLCache(max_size=4, ttl=10)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    cache.invalidate("a", "missing")
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.stats()["invalidations"] == 3
+
+
+def test_hit_ratio(clock):
+    cache = TTLCache(max_size=4, ttl=10)
+    assert cache.stats()["hit_ratio"] == 0.0
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats()["hit_ratio"] == 0.5
@@ -0,0 +1,78 @@
+import pytest
+import main
+from main import BusReservationSystem, build_parser
+from wallet_ledger import LedgerWalletManager
+
+
+class AuditRecorder:
+    def __init__(self):
+        self.entries = []
+
+    def log(self, actor_id, action):
+        self.entries.append((actor_id, action))
+
+
+def admin_system():
+    system = BusReservationSystem.__new__(BusReservationSystem)
+    system.db = None
+    system.audit = AuditRecorder()
+    return system
+
+
+def test_export_needs_admin_id():
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["export", "tickets"])
+    args = build_parser().parse_args(["export", "1", "tickets", "--format", "ndjson"])
+    assert (args.admin_id, args.table) == (1, "tickets")
+
+
+def test_export_is_audited(monkeypatch):
+    monkeypatch.setattr(main, "export_to_path", lambda *args, **filters: 3)
+    system = admin_system()
+    assert system.export(1, "tickets", fmt="ndjson", user_id=5) is True
+    assert system.audit.entries == [(1, "Exported tickets as ndjson for user 5")]
+
+
+def test_rejected_export_is_not_audited(monkeypatch):
+    def reject(*args, **filters):
+        raise ValueError("Unknown format 'xml'")
+
+    monkeypatch.setattr(main, "export_to_path", reject)
+    system = admin_system()
+    assert system.export(1, "tickets", fmt="xml") is False
+    assert system.audit.entries == []
+
+
+def test_wallet_maintenance_is_audited():
+    system = admin_system()
+    wallets = system.wallet_manager = LedgerWalletManager.__new__(LedgerWalletManager)
+    wallets.snapshot = lambda: 4
+    wallets.reconcile = lambda repair: [{"user_id": 5, "shards": 10, "ledger": 12}]
+    args = build_parser().parse_args(["wallet", "1", "snapshot"])
+    system.wallet_maintenance(args.admin_id, args.action)
+    system.wallet_maintenance(1, "reconcile", repair=True)
+    assert system.audit.entries == [
+        (1, "Wallet snapshots updated for 4 accounts"),
+        (1, "Wallet reconcile: 1 wallets rebalanced"),
+    ]
+
+
+def test_partition_changes_are_audited(monkeypatch):
+    monkeypatch.setattr(main.PartitionManager, "ensure_partitions", lambda self, months: ["tickets_2026_11"])
+    monkeypatch.setattr(main.PartitionManager, "retain", lambda self, months, archive_dir, drop, table: [])
+    system = admin_system()
+    args = build_parser().parse_args(["partitions", "1", "ensure"])
+    system.manage_partitions(args.admin_id, args.action, args.months)
+    system.manage_partitions(1, "retain", keep=True, table="tickets")
+    assert system.audit.entries == [
+        (1, "Created 1 history partitions"),
+        (1, "Archived 0 history partitions (kept detached) of tickets"),
+    ]
+
+
+def test_report_pruning_is_audited():
+    system = admin_system()
+    system.report_manager = type("Reports", (), {"prune_reports": lambda self, days: 7})()
+    args = build_parser().parse_args(["prunereports", "1", "--days", "30"])
+    system.prune_reports(args.admin_id, args.days)
+    assert system.audit.entries == [(1, "Pruned 7 old reports")]
@@ -0,0 +1,63 @@
+from bus import BusManager
+from counters import FOLD_LOCK_SQL, FOLD_SQL, LIVE_SEATS_SQL, CounterManager
+from rollups import status_change_query
+from search import search_query
+from ticket import TicketManager
+from wallet import WalletManager
+
+
+class FoldDb:
+    """Answers FOLD_SQL with the next folded count; records the statements"""
+
+    def __init__(self, counts):
+        self.counts = list(counts)
+        self.queries = []
+
+    def fetch_one(self, sql, params=None):
+        self.queries.append((sql, params))
+        if sql == FOLD_SQL:
+            return (self.counts.pop(0),)
+        return (0,)
+
+
+def test_purchase_statement_does_not_update_shared_counter_rows():
+    db = object()
+    bus_manager = BusManager(db)
+    tickets = TicketManager(db, bus_manager, WalletManager(db))
+    for query in (tickets.purchase_query, tickets._any_seat_query(frozenset())):
+        assert "UPDATE buses" not in query
+        assert "ticket_rollups" not in query
+        assert query.count("INSERT INTO counter_deltas") == 2  # seat and rollup
+
+
+def test_release_queues_seat_delta():
+    assert "UPDATE buses" not in BusManager.RELEASE_SEAT_SQL
+    assert "INSERT INTO counter_deltas (bus_id, seats)" in BusManager.RELEASE_SEAT_SQL
+
+
+def test_status_change_is_a_delta_row():
+    sql, params = status_change_query(7, "2026-10-01", 12.5, "PAID", "CANCELLED")
+    assert sql.split()[:3] == ["INSERT", "INTO", "counter_deltas"]
+    assert "(bus_id, day, paid, cancelled, paid_revenue)" in sql
+    assert params == (7, "2026-10-01", -1, 12.5)
+
+
+def test_search_filters_on_live_seats():
+    sql, params = search_query(min_seats=2)
+    assert f"{LIVE_SEATS_SQL} >= %s" in sql
+    assert params == (2,)
+
+
+def test_fold_pending_locks_then_drains_batches():
+    db = FoldDb([3, 3, 1])
+    assert CounterManager(db, batch=3).fold_pending() == 7
+    assert db.queries[0] == (FOLD_LOCK_SQL, None)
+    assert [params for _, params in db.queries[1:]] == [{"batch": 3}] * 3
+
+
+def test_fold_reports_nothing_on_error():
+    class BrokenDb:
+        def transaction(self):
+            raise RuntimeError("connection lost")
+
+    assert CounterManager(BrokenDb()).fold() == 0
@@ -0,0 +1,156 @@
+import threading
+import psycopg2.extensions
+import pytest
+import db_connect
+from db_connect import ConnectionPool, PoolTimeout
+
+
+class StubConnection:
+    def __init__(self, healthy=True):
+        self.closed = 0
+        self.healthy = healthy
+        self.rollbacks = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        con = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                if not con.healthy:
+                    raise psycopg2.OperationalError("server closed the connection")
+
+        return Cursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db_connect.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def connections():
+    made = []
+
+    def connect():
+        made.append(StubConnection())
+        return made[-1]
+
+    connect.made = made
+    return connect
+
+
+def test_invalid_sizes_rejected(connections):
+    for min_size, max_size in ((0, 0), (-1, 2), (3, 2)):
+        with pytest.raises(ValueError):
+            ConnectionPool(min_size=min_size, max_size=max_size, connect_func=connections)
+
+
+def test_min_size_opened_up_front(connections):
+    pool = ConnectionPool(min_size=2, max_size=4, connect_func=connections)
+    assert len(connections.made) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_returned_connection_is_reused(clock, connections):
+    pool = ConnectionPool(min_size=0, max_size=2, connect_func=connections)
+    con = pool.getconn()
+    pool.putconn(con)
+    assert pool.getconn() is con
+    assert len(connections.made) == 1
+    assert pool.stats()["checkouts"] == 2
+
+
+def test_open_transaction_rolled_back_on_return(clock, connections):
+    pool = ConnectionPool(min_size=0, max_size=1, connect_func=connections)
+    con = pool.getconn()
+    con.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(con)
+    assert con.rollbacks == 1
+    assert pool.getconn() is con
+
+
+def test_checkout_times_out_when_exhausted(clock, connections):
+    pool = ConnectionPool(min_size=0, max_size=1, checkout_timeout=0, connect_func=connections)
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiter_gets_returned_connection(connections):
+    pool = ConnectionPool(min_size=0, max_size=1, checkout_timeout=5, connect_func=connections)
+    con = pool.getconn()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+    waiter.start()
+    pool.putconn(con)
+    waiter.join(5)
+    assert got == [con]
+
+
+def test_failed_health_check_replaces_connection(clock, connections):
+    pool = ConnectionPool(min_size=0, max_size=1, ping_after=1, connect_func=connections)
+    con = pool.getconn()
+    pool.putconn(con)
+    con.healthy = False
+    clock[0] += 2
+    fresh = pool.getconn()
+    assert fresh is not con and con.closed
+    assert pool.stats()["discarded"] == 1
+    assert pool.stats()["size"] == 1
+
+
+def test_expired_connection_not_reused(clock, connections):
+    pool = ConnectionPool(min_size=0, max_size=1, max_lifetime=10, connect_func=connections)
+    con = pool.getconn()
+    clock[0] += 11
+    pool.putconn(con)
+    assert con.closed
+    assert pool.getconn() is not con
+
+
+def test_idle_connections_pruned_down_to_min_size(clock, connections):
+    pool = ConnectionPool(min_size=1, max_size=3, idle_timeout=10, connect_func=connections)
+    held = [pool.getconn() for _ in range(3)]
+    for con in held:
+        pool.putconn(con)
+    clock[0] += 11
+    pool.getconn()
+    assert pool.stats()["size"] == 1
+
+
+def test_failed_connect_frees_the_slot(clock):
+    def broken():
+        raise psycopg2.OperationalError("could not connect")
+
+    pool = ConnectionPool(min_size=0, max_size=1, connect_func=broken)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    assert pool.stats()["size"] == 0
+
+
+def test_closed_pool_refuses_checkouts(connections):
+    pool = ConnectionPool(min_size=1, max_size=1, connect_func=connections)
+    pool.closeall()
+    assert connections.made[0].closed
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
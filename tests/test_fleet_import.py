@@ -0,0 +1,54 @@
+from decimal import Decimal
+import pytest
+from fleet_import import COLUMNS, validate
+
+GOOD = {"bus_name": " Night liner ", "bus_number": "NL-1", "total_seats": "40", "price_per_seat": "12.346",
+        "departure_time": "2030-01-01 22:00", "arrival_time": "06:15", "route": "Kyiv -> Lviv"}
+
+
+def record(**changes):
+    return dict(GOOD, **changes)
+
+
+def test_valid_record_is_normalized():
+    row, error = validate(GOOD)
+    assert error is None
+    values = dict(zip(COLUMNS, row))
+    assert values["bus_name"] == "Night liner"
+    assert values["total_seats"] == 40
+    assert values["price_per_seat"] == Decimal("12.35")
+
+
+def test_non_string_text_is_kept_as_text():
+    row, error = validate(record(bus_number=1234))
+    assert error is None and row[1] == "1234"
+
+
+@pytest.mark.parametrize("column, limit", [("bus_name", 100), ("bus_number", 50), ("departure_time", 50),
+                                           ("arrival_time", 50), ("route", 200)])
+def test_text_longer_than_column_rejected(column, limit):
+    assert validate(record(**{column: "x" * limit}))[1] is None
+    row, error = validate(record(**{column: "x" * (limit + 1)}))
+    assert row is None and column in error
+
+
+@pytest.mark.parametrize("price, ok", [("99999999.99", True), ("99999999.995", False), ("100000000", False),
+                                       ("1e30", False), ("-1", False), ("NaN", False), ("abc", False)])
+def test_price_must_fit_decimal_10_2(price, ok):
+    row, error = validate(record(price_per_seat=price))
+    assert (error is None) is ok
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"bus_number": "  "}, "missing bus_number"),
+    ({"total_seats": "many"}, "total_seats must be an integer"),
+    ({"total_seats": 0}, "total_seats must be between"),
+])
+def test_rejected_records(changes, message):
+    row, error = validate(record(**changes))
+    assert row is None and error.startswith(message)
+
+
+def test_unparseable_line():
+    assert validate({"_error": "invalid JSON: x"}) == (None, "invalid JSON: x")
+    assert validate(["not", "an", "object"])[1] == "record must be an object"
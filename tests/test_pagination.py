@@ -0,0 +1,74 @@
+from datetime import date, datetime
+from decimal import Decimal
+import pytest
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, decode_cursor, encode_cursor, fetch_page
+
+QUERY = "SELECT id, at FROM t WHERE user_id = %s {after} ORDER BY at DESC, id DESC LIMIT %s"
+KEYSET = "(at, id) < (%s, %s)"
+
+
+class RecordingDb:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def fetch_all(self, sql, params):
+        self.calls.append((sql, params))
+        return self.rows
+
+
+def test_cursor_round_trip_keeps_types():
+    values = [datetime(2024, 5, 1, 12, 30, 15, 250), date(2024, 5, 1), Decimal("12.50"), 42, "x", None]
+    token = encode_cursor("tickets", values)
+    assert "=" not in token
+    assert decode_cursor("tickets", token) == values
+    assert isinstance(decode_cursor("tickets", token)[2], Decimal)
+
+
+def test_cursor_of_another_kind_rejected():
+    token = encode_cursor("tickets", [1])
+    with pytest.raises(InvalidCursor):
+        decode_cursor("transactions", token)
+
+
+@pytest.mark.parametrize("token", ["", "not-a-cursor", "e30", encode_cursor("tickets", [1])[:-3]])
+def test_malformed_cursor_rejected(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor("tickets", token)
+
+
+def test_first_page_has_no_keyset():
+    db = RecordingDb([(3, "c"), (2, "b"), (1, "a")])
+    rows, next_cursor = fetch_page(db, "t", QUERY, (7,), None, 2, KEYSET, lambda r: (r[1], r[0]))
+    sql, params = db.calls[0]
+    assert "{after}" not in sql and "(at, id) <" not in sql
+    assert params == (7, 3)
+    assert rows == [(3, "c"), (2, "b")]
+    assert decode_cursor("t", next_cursor) == ["b", 2]
+
+
+def test_next_page_binds_cursor_values():
+    db = RecordingDb([(1, "a")])
+    cursor = encode_cursor("t", ["b", 2])
+    rows, next_cursor = fetch_page(db, "t", QUERY, (7,), cursor, 2, KEYSET, lambda r: (r[1], r[0]))
+    sql, params = db.calls[0]
+    assert "AND (at, id) < (%s, %s)" in sql
+    assert params == (7, "b", 2, 3)
+    assert rows == [(1, "a")] and next_cursor is None
+
+
+def test_key_references_repeat_values():
+    db = RecordingDb([])
+    keyset = "at <= {0} AND (at, id) < ({0}, {1})"
+    fetch_page(db, "t", QUERY, (7,), encode_cursor("t", ["b", 2]), 2, keyset, lambda r: r)
+    sql, params = db.calls[0]
+    assert "AND at <= %s AND (at, id) < (%s, %s)" in sql
+    assert params == (7, "b", "b", 2, 3)
+
+
+@pytest.mark.parametrize("page_size, limit", [(None, DEFAULT_PAGE_SIZE), (0, DEFAULT_PAGE_SIZE),
+                                              (-5, 1), (10 ** 6, MAX_PAGE_SIZE)])
+def test_page_size_is_clamped(page_size, limit):
+    db = RecordingDb([])
+    fetch_page(db, "t", QUERY, (7,), None, page_size, KEYSET, lambda r: r)
+    assert db.calls[0][1][-1] == limit + 1
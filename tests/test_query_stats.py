@@ -0,0 +1,61 @@
+import pytest
+from query_stats import BUCKETS_MS, StatementStats, is_read_only, is_write, normalize_sql, percentile
+
+
+@pytest.mark.parametrize("sql, shape", [
+    ("SELECT * FROM buses WHERE bus_id = %s", "SELECT * FROM buses WHERE bus_id = ?"),
+    ("SELECT * FROM users WHERE name = 'O''Brien' AND id = 42", "SELECT * FROM users WHERE name = ? AND id = ?"),
+    ("UPDATE users SET wallet = wallet - %(amount)s WHERE user_id = %(user_id)s",
+     "UPDATE users SET wallet = wallet - ? WHERE user_id = ?"),
+    ("SELECT 1 FROM t WHERE id IN (%s, %s, %s)", "SELECT ? FROM t WHERE id IN (...)"),
+    ("SELECT 1 FROM t WHERE id IN (1,2)", "SELECT ? FROM t WHERE id IN (...)"),
+    ("SELECT price FROM t WHERE price > -1.5", "SELECT price FROM t WHERE price > ?"),
+    ("SELECT a -- comment 5\n  FROM   t;", "SELECT a FROM t"),
+    (b"SELECT x FROM t WHERE y = %s", "SELECT x FROM t WHERE y = ?"),
+])
+def test_normalize_sql(sql, shape):
+    assert normalize_sql(sql) == shape
+
+
+def test_identifiers_with_digits_are_kept():
+    assert normalize_sql("SELECT col1, t2.x FROM tickets_p202405") == "SELECT col1, t2.x FROM tickets_p202405"
+
+
+def test_same_shape_for_different_values():
+    assert normalize_sql("SELECT * FROM t WHERE id = 1") == normalize_sql("SELECT * FROM t WHERE id = 99")
+
+
+@pytest.mark.parametrize("sql, read_only, write", [
+    ("SELECT * FROM buses", True, False),
+    ("WITH x AS (SELECT 1) SELECT * FROM x", True, False),
+    ("SELECT * FROM users WHERE user_id = %s FOR UPDATE", False, True),
+    ("WITH s AS (UPDATE seats SET is_booked = TRUE RETURNING 1) SELECT * FROM s", False, True),
+    ("SELECT nextval('tickets_ticket_id_seq')", False, True),
+    ("INSERT INTO audit_log (action) VALUES (%s)", False, True),
+    ("SAVEPOINT sp_1", False, False),
+    ("SET LOCAL statement_timeout = 1000", False, False),
+    ("COMMIT", False, False),
+])
+def test_read_only_and_write(sql, read_only, write):
+    assert is_read_only(sql) is read_only
+    assert is_write(sql) is write
+
+
+@pytest.mark.parametrize("p, expected", [(0, 1), (50, 5), (90, 9), (95, 10), (99, 10), (100, 10)])
+def test_percentile_nearest_rank(p, expected):
+    assert percentile(list(range(1, 11)), p) == expected
+
+
+def test_percentile_of_nothing():
+    assert percentile([], 50) is None
+    assert StatementStats().percentile(50) is None
+
+
+def test_histogram_percentile_uses_the_same_rank():
+    stats = StatementStats()
+    values = [0.05] * 5 + [3] * 4 + [20]
+    for value in values:
+        stats.add(value, 1, False, "test")
+    for p in (50, 90, 95, 100):
+        exact = percentile(sorted(values), p)
+        assert stats.percentile(p) == min(b for b in BUCKETS_MS if b >= exact)
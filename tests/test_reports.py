@@ -0,0 +1,61 @@
+import json
+from reports import LATEST_REPORT_SQL, SAVE_REPORT_SQL, ReportManager, watermark_query
+from fakes import sync_db
+
+
+class ReportDb:
+    """sync_db() answering the watermark and latest-report lookups from canned values"""
+
+    def __init__(self, watermark, latest=None):
+        self.db = sync_db()
+        self.watermark = watermark
+        self.latest = latest
+        self.saved = []
+        self.db.fetch_one = self.fetch_one
+        self.db.execute_query = self.execute_query
+
+    def fetch_one(self, sql, params=None):
+        if sql == LATEST_REPORT_SQL:
+            return self.latest
+        if sql.startswith("SELECT") and "counter_deltas" in sql:
+            return (self.watermark,) if self.watermark is not None else None
+        return None
+
+    def execute_query(self, sql, params=None):
+        if sql == SAVE_REPORT_SQL:
+            self.saved.append(params)
+        return True
+
+
+def test_watermark_counts_folded_and_queued_changes():
+    sql, params = watermark_query()
+    assert "FROM counter_state" in sql and "counter_deltas" in sql
+    assert params is None
+    sql, params = watermark_query(7)
+    assert "b.ticket_version" in sql and "d.bus_id = b.bus_id" in sql
+    assert params == (7,)
+
+
+def test_unchanged_watermark_returns_stored_result():
+    fake = ReportDb(41, latest=("41", json.dumps(12.5)))
+    reports = ReportManager(fake.db)
+    computed = []
+    result = reports._memoized(1, "TOTAL_REVENUE", {}, lambda: computed.append(1) or 0.0, str)
+    assert result == 12.5
+    assert computed == []
+    assert fake.saved == []
+
+
+def test_new_watermark_recomputes_and_stores_it():
+    fake = ReportDb(42, latest=("41", json.dumps(12.5)))
+    reports = ReportManager(fake.db)
+    result = reports._memoized(1, "BUS_REVENUE", {"bus_id": 3}, lambda: 20.0, str)
+    assert result == 20.0
+    (report_type, admin_id, _, params, watermark, stored), = fake.saved
+    assert (report_type, params, watermark, stored) == ("BUS_REVENUE", '{"bus_id": 3}', "42", "20.0")
+
+
+def test_missing_bus_always_recomputes():
+    fake = ReportDb(None, latest=(None, json.dumps(1.0)))
+    reports = ReportManager(fake.db)
+    assert reports._memoized(1, "BUS_REVENUE", {"bus_id": 9}, lambda: 0.0, str) == 0.0
@@ -0,0 +1,98 @@
+import pytest
+from bus import BusManager
+from seat_map import BitmapBusManager, SeatBitmap
+
+
+def test_new_bitmap_is_empty():
+    bitmap = SeatBitmap(10)
+    assert len(bitmap) == 10
+    assert bitmap.to_bytes() == b"\x00\x00"
+    assert bitmap.count_free() == 10
+    assert bitmap.first_free() == 1
+
+
+def test_wrong_size_rejected():
+    with pytest.raises(ValueError):
+        SeatBitmap(10, b"\x00")
+
+
+def test_seat_bits_are_lsb_first():
+    bitmap = SeatBitmap(16)
+    bitmap.set(1)
+    bitmap.set(10)
+    # seat n is bit n-1, like Postgres get_bit(bytea)
+    assert bitmap.to_bytes() == bytes([0b00000001, 0b00000010])
+
+
+def test_set_and_clear_report_changes():
+    bitmap = SeatBitmap(8)
+    assert bitmap.set(3) is True
+    assert bitmap.set(3) is False
+    assert bitmap.is_booked(3)
+    assert bitmap.clear(3) is True
+    assert bitmap.clear(3) is False
+    assert not bitmap.is_booked(3)
+
+
+@pytest.mark.parametrize("seat_number", [0, 9, -1])
+def test_out_of_range_seat(seat_number):
+    with pytest.raises(IndexError):
+        SeatBitmap(8).is_booked(seat_number)
+
+
+def test_first_free_skips_booked_seats():
+    bitmap = SeatBitmap.from_bytes(12, bytes([0xFF, 0b00000101]))
+    assert bitmap.first_free() == 10
+    assert bitmap.count_free() == 2
+    assert bitmap.free_seats() == [10, 12]
+
+
+def test_full_bus_has_no_free_seat():
+    # padding bits past total_seats must not count as free seats
+    bitmap = SeatBitmap.from_bytes(10, bytes([0xFF, 0b00000011]))
+    assert bitmap.first_free() is None
+    assert bitmap.count_free() == 0
+    assert bitmap.free_seats() == []
+
+
+class InventoryDb:
+    """Answers BitmapBusManager.ROW_BUS_SQL with the bus's inventory; records the statements"""
+
+    def __init__(self, seat_rows, found=True):
+        self.seat_rows = seat_rows
+        self.found = found
+        self.queries = []
+
+    def fetch_one(self, sql, params=None):
+        self.queries.append(sql)
+        if sql == BitmapBusManager.ROW_BUS_SQL:
+            return (self.seat_rows,)
+        return (1,) if self.found else None
+
+    def execute_query(self, sql, params=None):
+        self.queries.append(sql)
+        return True
+
+
+def test_bitmap_statements_also_serve_seat_row_buses():
+    for sql in (BitmapBusManager.SEAT_CLAIM_SQL, BitmapBusManager.ANY_SEAT_CLAIM_SQL, BitmapBusManager.RELEASE_SEAT_SQL):
+        assert "UPDATE buses" in sql and "UPDATE seats" in sql
+        assert "SELECT %(bus_id)s, -1 FROM row_seat" in sql or "SELECT bus_id, 1 FROM row_seat" in sql
+    assert "b.seat_map IS NULL" in BitmapBusManager.RESOLVE_SEAT_SQL
+    assert "JOIN seats" in BitmapBusManager.FREE_SEATS_SQL and "FROM seats" in BitmapBusManager.SEAT_EXISTS_SQL
+    assert "seat_map" not in BitmapBusManager.BUS_EXISTS_SQL
+    # seat ids only exist on seats-row buses
+    assert BitmapBusManager.release_seat is BusManager.release_seat
+
+
+@pytest.mark.parametrize("seat_rows", [True, False])
+def test_release_by_number_goes_by_the_bus_inventory(seat_rows):
+    db = InventoryDb(seat_rows)
+    assert BitmapBusManager(db).release_seat_number(3, 4) is True
+    assert db.queries[0] == BitmapBusManager.ROW_BUS_SQL
+    assert ("FROM seats" in db.queries[1]) is seat_rows
+    assert ("set_bit(seat_map" in db.queries[1]) is not seat_rows
+
+
+def test_release_by_number_reports_failure():
+    assert BitmapBusManager(InventoryDb(False, found=False)).release_seat_number(3, 4) is False
@@ -0,0 +1,33 @@
+import asyncio
+from server import AsyncReservationService, ReservationService
+
+
+class IdlePool:
+    def closeall(self):
+        pass
+
+
+def test_shutdown_does_not_wait_for_idle_clients():
+    async def run():
+        service = ReservationService(object, pool=IdlePool(), drain_timeout=1)
+        service._idle = asyncio.Event()
+        service._idle.set()
+        service._server = await asyncio.start_server(service._client, "127.0.0.1", 0)
+        port = service._server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        while not service._clients:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(service.shutdown(), 5)
+        assert not service._clients
+        assert await reader.read() == b""  # the service closed its end
+        writer.close()
+
+    asyncio.run(run())
+
+
+def test_async_service_reuses_its_maintenance_connections():
+    service = AsyncReservationService(object, pool=IdlePool())
+    first, second = service._maintenance_db(), service._maintenance_db()
+    assert first.pool is second.pool is service.maintenance_pool
+    assert service.maintenance_pool.min_size == 0  # nothing connects until a job runs
+    service.executor.shutdown()
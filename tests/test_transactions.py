@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from db_connect import RollbackOnly
+from fakes import async_db, sync_db
+
+
+def test_outermost_scope_commits_once():
+    db = sync_db()
+    with db.transaction():
+        with db.transaction():
+            db.cur.execute("UPDATE a")
+    assert db.con.log == ["UPDATE a", "COMMIT"]
+
+
+def test_rollback_in_outermost_scope_ends_transaction():
+    db = sync_db()
+    with db.transaction():
+        db.cur.execute("UPDATE a")
+        db.rollback()
+    assert db.con.log == ["UPDATE a", "ROLLBACK", "ROLLBACK"]
+
+
+def test_nested_rollback_returns_to_enclosing_savepoint():
+    db = sync_db()
+    with db.transaction():
+        db.cur.execute("UPDATE a")
+        with db.transaction(savepoint=True):
+            with db.transaction():
+                db.cur.execute("UPDATE b")
+                db.rollback()
+                db.cur.execute("UPDATE c")
+        db.cur.execute("UPDATE d")
+    assert db.con.log == [
+        "UPDATE a", "SAVEPOINT uow_1", "UPDATE b", "ROLLBACK TO SAVEPOINT uow_1", "UPDATE c",
+        # anything the inner scope did after the rollback goes with the savepoint
+        "ROLLBACK TO SAVEPOINT uow_1", "RELEASE SAVEPOINT uow_1", "UPDATE d", "COMMIT",
+    ]
+
+
+def test_rollback_in_savepoint_scope_keeps_later_work():
+    db = sync_db()
+    with db.transaction():
+        with db.transaction(savepoint=True):
+            db.cur.execute("UPDATE a")
+            db.rollback()
+            db.cur.execute("UPDATE b")
+    assert db.con.log == ["SAVEPOINT uow_1", "UPDATE a", "ROLLBACK TO SAVEPOINT uow_1", "UPDATE b",
+                          "RELEASE SAVEPOINT uow_1", "COMMIT"]
+
+
+def test_nested_rollback_without_savepoint_dooms_transaction():
+    db = sync_db()
+    with db.transaction():
+        db.cur.execute("UPDATE a")
+        with pytest.raises(RollbackOnly):
+            with db.transaction():
+                db.rollback()
+        assert db._rollback_only
+        db.cur.execute("UPDATE b")
+    # the real transaction is not ended early: work before and after is rolled back together
+    assert db.con.log == ["UPDATE a", "UPDATE b", "ROLLBACK"]
+
+
+def test_async_nested_rollback_returns_to_enclosing_savepoint():
+    db = async_db()
+
+    async def work():
+        async with db.transaction():
+            async with db.transaction(savepoint=True):
+                async with db.transaction():
+                    await db.cur.execute("UPDATE b")
+                    await db.rollback()
+
+    asyncio.run(work())
+    assert db.con.log == ["SAVEPOINT uow_1", "UPDATE b", "ROLLBACK TO SAVEPOINT uow_1",
+                          "ROLLBACK TO SAVEPOINT uow_1", "RELEASE SAVEPOINT uow_1", "COMMIT"]
+
+
+def test_async_nested_rollback_without_savepoint_dooms_transaction():
+    db = async_db()
+
+    async def work():
+        async with db.transaction():
+            await db.cur.execute("UPDATE a")
+            with pytest.raises(RollbackOnly):
+                async with db.transaction():
+                    await db.rollback()
+
+    asyncio.run(work())
+    assert db.con.log == ["UPDATE a", "ROLLBACK"]
@@ -0,0 +1,85 @@
+from datetime import datetime
+import pytest
+from bus import city_key, parse_route, parse_trip_time, trip_sync_params
+from search import RouteIndex, search_query
+
+
+@pytest.mark.parametrize("route, stops", [
+    ("Kyiv -> Lviv", ["Kyiv", "Lviv"]),
+    ("Kyiv→Zhytomyr → Rivne → Lviv", ["Kyiv", "Zhytomyr", "Rivne", "Lviv"]),
+    ("New  York, Boston; Portland", ["New York", "Boston", "Portland"]),
+    ("A > B | C => D", ["A", "B", "C", "D"]),
+    ("Kyiv -> -> Lviv", ["Kyiv", "Lviv"]),
+    ("Kyiv", ["Kyiv"]),
+    ("", []),
+    (None, []),
+])
+def test_parse_route(route, stops):
+    assert parse_route(route) == stops
+
+
+def test_city_key_ignores_case_and_spacing():
+    assert city_key("  New   YORK ") == city_key("new york") == "new york"
+    assert city_key(None) == ""
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-05-01 08:30", datetime(2024, 5, 1, 8, 30)),
+    ("2024-05-01T08:30:00+02:00", datetime(2024, 5, 1, 8, 30)),
+    ("2024/05/01 08:30", datetime(2024, 5, 1, 8, 30)),
+    ("01.05.2024 08:30", datetime(2024, 5, 1, 8, 30)),
+    ("01/05/2024 08:30", datetime(2024, 5, 1, 8, 30)),
+    ("01.05.2024", datetime(2024, 5, 1)),
+    (datetime(2024, 5, 1, 8, 30), datetime(2024, 5, 1, 8, 30)),
+    ("tomorrow morning", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_trip_time(value, expected):
+    assert parse_trip_time(value) == expected
+
+
+def test_bare_clock_time_needs_a_reference():
+    assert parse_trip_time("08:30") is None
+    departure = datetime(2024, 5, 1, 22, 0)
+    assert parse_trip_time("23:45", after=departure) == datetime(2024, 5, 1, 23, 45)
+    # earlier on the clock than the departure means the next day
+    assert parse_trip_time("06:15", after=departure) == datetime(2024, 5, 2, 6, 15)
+    assert parse_trip_time("25:00", after=departure) is None
+
+
+def test_trip_sync_params():
+    trips, stops = trip_sync_params([
+        (1, "Kyiv -> Rivne -> Lviv", "2024-05-01 22:00", "06:15"),
+        (2, None, "soon", None),
+    ])
+    assert trips == (
+        [1, 2],
+        ["Kyiv", None],
+        ["Lviv", None],
+        [datetime(2024, 5, 1, 22, 0), None],
+        [datetime(2024, 5, 2, 6, 15), None],
+    )
+    assert stops == ([1, 1, 1], [0, 1, 2], ["Kyiv", "Rivne", "Lviv"], ["kyiv", "rivne", "lviv"])
+
+
+def test_route_index_completion():
+    index = RouteIndex(
+        [("kyiv", "Kyiv", 5), ("kharkiv", "Kharkiv", 2), ("khmelnytskyi", "Khmelnytskyi", 2), ("lviv", "Lviv", 4)],
+        [("kyiv", "lviv"), ("kyiv", "kharkiv"), ("lviv", "kyiv")],
+    )
+    assert len(index) == 4
+    assert [c["city"] for c in index.complete("kh")] == ["Kharkiv", "Khmelnytskyi"]
+    assert [c["city"] for c in index.complete("K", limit=1)] == ["Kyiv"]
+    assert [c["city"] for c in index.complete("", origin="KYIV")] == ["Lviv", "Kharkiv"]
+    assert index.complete("x") == []
+
+
+def test_search_matches_stops_without_joining_them():
+    # a route through a city twice must not return the trip twice (and break the keyset)
+    sql, params = search_query("Tehran", " qom ", min_seats=0)
+    assert "JOIN bus_stops o ON o.bus_id = b.bus_id" not in sql
+    assert sql.count("EXISTS (") == 1
+    assert params == ("tehran", "qom", "tehran", "qom")  # shown stop names, then the match
+    sql, params = search_query(destination="Qom", min_seats=0)
+    assert "b.origin" in sql and params == ("qom", "qom")
@@ -0,0 +1,92 @@
+import os
+from decimal import Decimal
+import psycopg2
+import pytest
+from db_connect import PostgresConnection
+from wallet_ledger import LEDGER_BALANCE_SQL, PENDING_ROW_SQL, SNAPSHOT_SQL, LedgerWalletManager
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+class ReconcileDb:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def fetch_all(self, sql, params=None):
+        self.queries.append(sql)
+        return self.rows
+
+
+def test_reconcile_compares_shards_with_ledger_only():
+    db = ReconcileDb([(1, Decimal("10.00"), Decimal("10.00")), (2, Decimal("7.50"), Decimal("10.00"))])
+    wallets = LedgerWalletManager(db)
+    rebalanced = []
+    wallets.rebalance = rebalanced.append
+    drift = wallets.reconcile(repair=True)
+    assert drift == [{"user_id": 2, "shards": Decimal("7.50"), "ledger": Decimal("10.00")}]
+    assert rebalanced == [2]
+    # users.wallet trails the ledger between rebalances and must not count as drift
+    assert "u.wallet" not in db.queries[0]
+
+
+def test_snapshot_horizon_is_commit_visibility_not_ids_or_time():
+    assert "pg_snapshot_xmin(pg_current_snapshot())" in SNAPSHOT_SQL
+    assert "t.xact < h.xid" in SNAPSHOT_SQL
+    assert "timestamp" not in SNAPSHOT_SQL.replace("CURRENT_TIMESTAMP", "")
+    for sql in (SNAPSHOT_SQL, LEDGER_BALANCE_SQL):
+        assert PENDING_ROW_SQL in sql
+
+
+def ledger_db(dsn, schema):
+    db = PostgresConnection(router=None)
+    db.con = psycopg2.connect(dsn, options=f"-c search_path={schema}")
+    db.cur = db._primary_cur = db.con.cursor()
+    return db
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="needs TEST_DATABASE_URL (scratch PostgreSQL 13+ database)")
+def test_row_committed_late_with_lower_id_is_not_lost():
+    schema = f"ledger_test_{os.getpid()}"
+    admin = psycopg2.connect(TEST_DATABASE_URL)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    slow = fast = None
+    try:
+        fast = ledger_db(TEST_DATABASE_URL, schema)
+        fast.cur.execute("""
+            CREATE TABLE users (user_id INTEGER PRIMARY KEY);
+            CREATE TABLE transactions (
+                transaction_id SERIAL PRIMARY KEY, user_id INTEGER, amount DECIMAL(12,2),
+                xact xid8 DEFAULT pg_current_xact_id()
+            );
+            CREATE TABLE wallet_snapshots (
+                user_id INTEGER PRIMARY KEY, balance DECIMAL(14,2) NOT NULL,
+                last_transaction_id INTEGER NOT NULL, horizon xid8, taken_at TIMESTAMP
+            );
+            INSERT INTO users VALUES (1);
+        """)
+        fast.con.commit()
+
+        slow = ledger_db(TEST_DATABASE_URL, schema)
+        slow.cur.execute("INSERT INTO transactions (user_id, amount) VALUES (1, 5) RETURNING transaction_id")
+        slow_id = slow.cur.fetchone()[0]  # still uncommitted
+        fast.cur.execute("INSERT INTO transactions (user_id, amount) VALUES (1, 7) RETURNING transaction_id")
+        assert fast.cur.fetchone()[0] > slow_id
+        fast.con.commit()
+
+        wallets = LedgerWalletManager(fast)
+        # the committed row is newer than the open transaction, so it has to wait with it
+        assert wallets.snapshot() == 0
+        assert wallets.get_balance_exact(1) == Decimal("7.00")
+        slow.con.commit()
+        assert wallets.get_balance_exact(1) == Decimal("12.00")
+        assert wallets.snapshot() == 1
+        assert fast.fetch_one("SELECT balance FROM wallet_snapshots WHERE user_id = 1")[0] == Decimal("12.00")
+        assert wallets.get_balance_exact(1) == Decimal("12.00")
+    finally:
+        for db in (slow, fast):
+            if db:
+                db.con.close()
+        admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
@@ -1,137 +1,296 @@
 from db_connect import PostgresConnection
 import datetime
-from db_connect import db_logger
-from bus import BusManager
-from wallet import WalletManager
+from decimal import Decimal, ROUND_HALF_UP
+from db_connect import db_logger, replica_read
+from bus import BusManager, parse_seat_preferences
+from wallet import CENT
+from wallet_ledger import make_wallet_manager
+from pagination import InvalidCursor, fetch_page
+from rollups import ROLLUP_PURCHASE_SQL, RollupManager
+
+# Purchase result codes
+PURCHASE_OK = "OK"
+PURCHASE_USER_NOT_FOUND = "USER_NOT_FOUND"
+PURCHASE_SEAT_NOT_FOUND = "SEAT_NOT_FOUND"
+PURCHASE_SEAT_TAKEN = "SEAT_TAKEN"
+PURCHASE_INSUFFICIENT_FUNDS = "INSUFFICIENT_FUNDS"
+PURCHASE_BUS_NOT_FOUND = "BUS_NOT_FOUND"
+PURCHASE_SOLD_OUT = "SOLD_OUT"
+PURCHASE_ERROR = "ERROR"
+
+PURCHASE_MESSAGES = {
+    PURCHASE_USER_NOT_FOUND: "User not found!",
+    PURCHASE_SEAT_NOT_FOUND: "Seat not found!",
+    PURCHASE_SEAT_TAKEN: "Seat already booked!",
+    PURCHASE_INSUFFICIENT_FUNDS: "Insufficient balance!",
+    PURCHASE_BUS_NOT_FOUND: "Bus not found!",
+    PURCHASE_SOLD_OUT: "No free seats left!",
+}
+
+# Extra condition for the wallet manager's debit fragment: only debit once the seat is claimed
+PURCHASE_DEBIT_CONDITION = "\n          AND EXISTS (SELECT 1 FROM seat)"
+
+# Any-seat purchases retry when a concurrent buyer took the picked seat first
+ANY_SEAT_RETRIES = 3
+
+# Seat claim and wallet debit are both conditional; later CTEs only insert
+# rows when both succeeded. The trailing subqueries read the pre-statement
+# snapshot and tell the caller why nothing was bought. The seat steps come
+# from the bus manager so row and bitmap inventories share this statement.
+PURCHASE_QUERY = """
+    WITH {seat_claim},
+    {debit},
+    ticket AS (
+        INSERT INTO tickets (user_id, bus_id, seat_id, seat_number, price, status)
+        SELECT %(user_id)s, %(bus_id)s, seat.seat_id, seat.seat_number, %(price)s, 'PAID' FROM seat, debit
+        RETURNING ticket_id
+    ),
+    {rollup},
+    audit AS (
+        INSERT INTO audit_log (actor_id, action)
+        SELECT %(user_id)s, %(action)s FROM ticket
+    )
+    SELECT (SELECT ticket_id FROM ticket),
+           (SELECT wallet FROM debit),
+           EXISTS (SELECT 1 FROM seat),
+           EXISTS ({seat_exists}),
+           EXISTS (SELECT 1 FROM users WHERE user_id = %(user_id)s),
+           (SELECT seat_number FROM seat)
+"""
+
+USER_TICKETS_SQL = """
+    SELECT t.ticket_id, b.bus_name, b.bus_number, COALESCE(t.seat_number, s.seat_number),
+           t.price, t.purchase_date, t.status, b.departure_time, b.arrival_time, b.route
+    FROM tickets t
+    JOIN buses b ON t.bus_id=b.bus_id
+    LEFT JOIN seats s ON t.seat_id=s.seat_id
+"""
+# Plain bounds on purchase_date (the partition key) let the planner skip
+# monthly partitions outside [since, cursor]; the row comparison alone does not.
+USER_TICKETS_SINCE = " AND t.purchase_date >= COALESCE(%s, '-infinity'::timestamp)"
+USER_TICKETS_PAGE_SQL = USER_TICKETS_SQL + """
+    WHERE t.user_id=%s""" + USER_TICKETS_SINCE + """ {after}
+    ORDER BY t.purchase_date DESC, t.ticket_id DESC
+    LIMIT %s
+"""
+USER_TICKETS_KEYSET = (
+    "t.purchase_date <= {0} AND (t.purchase_date, t.ticket_id) < ({0}, {1})",
+    lambda row: (row[5], row[0]),
+)
+
+CANCEL_TICKET_SELECT_SQL = (
+    "SELECT status, price, bus_id, seat_id, seat_number, purchase_date FROM tickets"
+    " WHERE ticket_id=%s AND user_id=%s FOR UPDATE"
+)
+CANCEL_TICKET_SQL = "UPDATE tickets SET status='CANCELLED' WHERE ticket_id=%s"
+
+
+def purchase_outcome(row):
+    """Result code of one run of PURCHASE_QUERY from its status columns"""
+    ticket_id, balance, seat_claimed, seat_exists, user_exists, seat_number = row
+    if ticket_id:
+        return PURCHASE_OK
+    if not user_exists:
+        return PURCHASE_USER_NOT_FOUND
+    if not seat_exists:
+        return PURCHASE_SEAT_NOT_FOUND
+    if not seat_claimed:
+        return PURCHASE_SEAT_TAKEN
+    return PURCHASE_INSUFFICIENT_FUNDS
+
+
+def refund_amount(price, refund_percent):
+    return (price * Decimal(refund_percent) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
 
 class TicketManager:
-    def __init__(self, db: PostgresConnection):
+    def __init__(self, db: PostgresConnection, bus_manager=None, wallet_manager=None):
         self.db = db
+        self.bus_manager = bus_manager or BusManager(db)
+        self.wallet_manager = wallet_manager or make_wallet_manager(db)
+        self.purchase_debit_sql = self.wallet_manager.DEBIT_SQL.format(condition=PURCHASE_DEBIT_CONDITION)
+        self.purchase_query = PURCHASE_QUERY.format(
+            seat_claim=self.bus_manager.SEAT_CLAIM_SQL,
+            seat_exists=self.bus_manager.SEAT_EXISTS_SQL,
+            rollup=ROLLUP_PURCHASE_SQL,
+            debit=self.purchase_debit_sql,
+        )
+        self._any_seat_queries = {}  # preferences -> purchase statement
 
-    def buy_ticket(self, user_id, bus_id, seat_id, price):
-        try:
-            # lock wallet
-            wallet_result = self.db.fetch_one(
-                "SELECT wallet FROM users WHERE user_id=%s FOR UPDATE",
-                (user_id,)
-            )
-            if not wallet_result:
-                db_logger.info("User not found!")
-                self.db.rollback()
-                return False
-
-            wallet = float(wallet_result[0])
-            if wallet < price:
-                db_logger.error("Insufficient balance!")
-                self.db.rollback()
-                return False
-
-            #check if seat is available
-            seat_result = self.db.fetch_one(
-                "SELECT is_booked FROM seats WHERE seat_id=%s FOR UPDATE",
-                (seat_id,)
-            )
-            if not seat_result:
-                db_logger.info("Seat not found!")
-                self.db.rollback()
-                return False
-
-            if seat_result[0]:
-                db_logger.info("Seat already booked!")
-                self.db.rollback()
-                return False
-
-            #reserve seat
-            bus_manager = BusManager(self.db)
-            bus_manager.reserve_seat(seat_id)
-            
-            # wallet deduction
-            wallet_manager = WalletManager(self.db)
-            wallet_manager.deduct_balance(user_id, price, type= "Ticket purchase")
-
-            # log ticket
-            self.db.execute_query(
-                "INSERT INTO tickets (user_id,bus_id,seat_id,price,status) VALUES (%s,%s,%s,%s,'PAID')",
-                (user_id, bus_id, seat_id, price)
+    def buy_ticket(self, user_id, bus_id, seat_id, price, seat_number=None):
+        return self.purchase(user_id, bus_id, seat_id, price, seat_number)["status"] == PURCHASE_OK
+
+    # --- Purchase engine ---
+    @staticmethod
+    def _purchase_params(user_id, bus_id, seat_id, price, seat_number):
+        price = Decimal(str(price)).quantize(CENT, rounding=ROUND_HALF_UP)
+        return {
+            "user_id": user_id,
+            "bus_id": bus_id,
+            "seat_id": seat_id,
+            "seat_number": seat_number,
+            "price": price,
+            "amount": price,
+            "type": "Ticket purchase",
+            "action": f"Purchase: -{price:.2f} (Ticket purchase)",
+        }
+
+    def purchase(self, user_id, bus_id, seat_id, price, seat_number=None):
+        """Claim the seat, debit the wallet and write ledger, ticket and audit rows in one statement."""
+        return self._run_purchase(self.purchase_query, self._purchase_params(user_id, bus_id, seat_id, price, seat_number))
+
+    def _any_seat_query(self, preferences):
+        query = self._any_seat_queries.get(preferences)
+        if query is None:
+            query = self._any_seat_queries[preferences] = PURCHASE_QUERY.format(
+                seat_claim=self.bus_manager.any_seat_claim_sql(preferences),
+                seat_exists=self.bus_manager.BUS_EXISTS_SQL,
+                rollup=ROLLUP_PURCHASE_SQL,
+                debit=self.purchase_debit_sql,
             )
+        return query
 
-            self.db.commit()
-            db_logger.info(f"Ticket purchased successfully! Remaining balance: ${wallet - price:.2f}")
-            return True
+    def purchase_any_seat(self, user_id, bus_id, preferences=None, retries=ANY_SEAT_RETRIES):
+        """Buy the best free seat on the bus for the given preferences (window/aisle, front/back)."""
+        try:
+            query = self._any_seat_query(parse_seat_preferences(preferences))
+        except ValueError as e:
+            db_logger.error(str(e))
+            return {"status": PURCHASE_ERROR, "ticket_id": None, "balance": None, "seat_number": None}
+
+        # price and purchase in one transaction, like book_ticket's resolve_seat
+        with self.db.transaction():
+            price = self.bus_manager.current_price(bus_id)
+            if price is None:
+                return {"status": PURCHASE_BUS_NOT_FOUND, "ticket_id": None, "balance": None, "seat_number": None}
+
+            params = self._purchase_params(user_id, bus_id, None, price, None)
+            for _ in range(retries + 1):
+                result = self._run_purchase(query, params, quiet=True)
+                if result["status"] == PURCHASE_SEAT_NOT_FOUND:
+                    result["status"] = PURCHASE_BUS_NOT_FOUND
+                if result["status"] != PURCHASE_SEAT_TAKEN:
+                    break
+                if not self.bus_manager.count_free_seats(bus_id):
+                    result["status"] = PURCHASE_SOLD_OUT
+                    break
+        if result["status"] == PURCHASE_SEAT_TAKEN:
+            result["status"] = PURCHASE_SOLD_OUT
+        if result["status"] in PURCHASE_MESSAGES:
+            db_logger.info(PURCHASE_MESSAGES[result["status"]])
+        return result
+
+    def _run_purchase(self, query, params, quiet=False):
+        result = self._purchase_once(query, params, quiet)
+        # a sharded wallet may hold enough in total but not on any one shard
+        if result["status"] == PURCHASE_INSUFFICIENT_FUNDS and self.wallet_manager.make_room(params["user_id"], params["amount"]):
+            result = self._purchase_once(query, params, quiet)
+        return result
+
+    def _purchase_once(self, query, params, quiet=False):
+        try:
+            # a savepoint keeps a failed purchase from dooming an enclosing unit of work
+            with self.db.transaction(savepoint=True):
+                row = self.db.fetch_one(query, params)
+                if not row:
+                    self.db.rollback()
+                    return {"status": PURCHASE_ERROR, "ticket_id": None, "balance": None, "seat_number": None}
+
+                ticket_id, balance, _, _, _, seat_number = row
+                status = purchase_outcome(row)
+
+                if status != PURCHASE_OK:
+                    # the seat claim may already have applied inside the statement
+                    self.db.rollback()
+                    if not quiet:
+                        db_logger.info(PURCHASE_MESSAGES[status])
+                    return {"status": status, "ticket_id": None, "balance": None, "seat_number": None}
+
+            if balance is not None:
+                db_logger.info(f"Ticket purchased successfully! Remaining balance: ${balance:.2f}")
+            else:
+                db_logger.info("Ticket purchased successfully!")
+            return {"status": status, "ticket_id": ticket_id, "balance": balance, "seat_number": seat_number}
         except Exception:
             db_logger.exception(f"Error buying ticket")
-            self.db.rollback()
-            return False
+            return {"status": PURCHASE_ERROR, "ticket_id": None, "balance": None, "seat_number": None}
 
     # Cancel ticket
     def cancel_ticket(self, user_id, ticket_id, refund_percent=80):
         try:
-            ticket = self.db.fetch_one(
-                "SELECT status, price, seat_id FROM tickets WHERE ticket_id=%s AND user_id=%s",
-                (ticket_id, user_id)
-            )
-            if not ticket:
-                db_logger.info("Ticket not found")
-                return False
+            with self.db.transaction():
+                ticket = self.db.fetch_one(CANCEL_TICKET_SELECT_SQL, (ticket_id, user_id))
+                if not ticket:
+                    db_logger.info("Ticket not found")
+                    return False
 
-            status, price, seat_id = ticket
-            if status != "PAID":
-                db_logger.error("Ticket cannot be cancelled!")
-                return False
+                status, price, bus_id, seat_id, seat_number, purchase_date = ticket
+                if status != "PAID":
+                    db_logger.error("Ticket cannot be cancelled!")
+                    return False
 
-            refund_amount = float(price) * refund_percent / 100
+                refund = refund_amount(price, refund_percent)
 
-            # Update ticket
-            self.db.execute_query(
-                "UPDATE tickets SET status='CANCELLED' WHERE ticket_id=%s",
-                (ticket_id,)
-            )
-            # Update seat
-            self.db.execute_query(
-                "UPDATE seats SET is_booked=FALSE WHERE seat_id=%s",
-                (seat_id,)
-            )
+                # Update ticket
+                self.db.execute_query(CANCEL_TICKET_SQL, (ticket_id,))
+                RollupManager(self.db).record_status_change(bus_id, purchase_date, price, "PAID", "CANCELLED")
+
+                # Update seat and the bus free-seat counter
+                if seat_id is not None:
+                    released = self.bus_manager.release_seat(seat_id)
+                else:
+                    released = self.bus_manager.release_seat_number(bus_id, seat_number)
+                if not released:
+                    db_logger.error(f"Could not release the seat of ticket {ticket_id}")
+                    self.db.rollback()
+                    return False
 
-            # Refund amount
-            wallet_manager = WalletManager(self.db)
-            wallet_manager.refund_balance(user_id, refund_amount, type="Ticket refund")
-           
-            self.db.commit()
-            db_logger.info(f"Ticket cancelled. Refund: ${refund_amount:.2f}")
+                # Refund amount
+                if refund > 0 and not self.wallet_manager.refund_balance(user_id, refund, type="Ticket refund"):
+                    self.db.rollback()
+                    return False
+
+            db_logger.info(f"Ticket cancelled. Refund: ${refund:.2f}")
             return True
         except Exception:
             db_logger.exception("Error cancelling ticket")
-            self.db.rollback()
             return False
 
-    def get_user_tickets(self, user_id):
+    @replica_read
+    def get_user_tickets(self, user_id, since=None):
         try:
-            query = """
-                SELECT t.ticket_id, b.bus_name, b.bus_number, s.seat_number, 
-                       t.price, t.purchase_date, t.status, b.departure_time, b.arrival_time, b.route
-                FROM tickets t
-                JOIN buses b ON t.bus_id=b.bus_id
-                JOIN seats s ON t.seat_id=s.seat_id
-                WHERE t.user_id=%s
-                ORDER BY t.purchase_date DESC
-            """
-            results = self.db.fetch_all(query, (user_id,))
-            tickets = []
-            for row in results:
-                ticket_id, bus_name, bus_number, seat_number, price, purchase_date, status, departure_time, arrival_time, route = row
-                tickets.append({
-                    "ticket_id": ticket_id,
-                    "bus_name": bus_name,
-                    "bus_number": bus_number,
-                    "seat_number": seat_number,
-                    "price": float(price),
-                    "status": status,
-                    "purchase_date": purchase_date,
-                    "departure_time": departure_time,
-                    "arrival_time": arrival_time,
-                    "route": route
-                })
-            return tickets
+            query = USER_TICKETS_SQL + " WHERE t.user_id=%s" + USER_TICKETS_SINCE + " ORDER BY t.purchase_date DESC"
+            results = self.db.fetch_all(query, (user_id, since))
+            return [self._ticket_row(row) for row in results]
         except Exception:
             db_logger.exception("Error fetching tickets")
             return []
+
+    @replica_read
+    def get_user_tickets_page(self, user_id, page_size=None, cursor=None, since=None):
+        try:
+            rows, next_cursor = fetch_page(
+                self.db, "tickets", USER_TICKETS_PAGE_SQL, (user_id, since), cursor, page_size, *USER_TICKETS_KEYSET
+            )
+            return {"items": [self._ticket_row(row) for row in rows], "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error fetching tickets page")
+            return {"items": [], "next_cursor": None}
+
+    @staticmethod
+    def _ticket_row(row):
+        ticket_id, bus_name, bus_number, seat_number, price, purchase_date, status, departure_time, arrival_time, route = row
+        return {
+            "ticket_id": ticket_id,
+            "bus_name": bus_name,
+            "bus_number": bus_number,
+            "seat_number": seat_number,
+            "price": float(price),
+            "status": status,
+            "purchase_date": purchase_date,
+            "departure_time": departure_time,
+            "arrival_time": arrival_time,
+            "route": route
+        }
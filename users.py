@@ -1,4 +1,5 @@
-from db_connect import PostgresConnection, db_logger
+from db_connect import PostgresConnection, db_logger, replica_read
+from pagination import InvalidCursor, fetch_page
 
 class User:
     def __init__(self, user_id, name, email, password, wallet=0.0, is_admin=False):
@@ -29,6 +30,22 @@ class Admin(User):
         return f"Admin(name={self.name}, email={self.email})"
 
 
+EMAIL_EXISTS_SQL = "SELECT 1 FROM users WHERE email = %s"
+REGISTER_SQL = "INSERT INTO users (name, email, password, is_admin, wallet) VALUES (%s,%s,%s,%s,%s)"
+LOGIN_SQL = "SELECT user_id, name, email, password, wallet, is_admin FROM users WHERE email = %s"
+
+
+def user_from_row(row, password):
+    """Admin/Customer for a LOGIN_SQL row, or None when the password does not match"""
+    user_id, name, db_email, db_password, wallet, is_admin = row
+    if db_password != password:
+        db_logger.error("Wrong password")
+        return None
+    if is_admin:
+        return Admin(user_id, name, db_email, db_password, wallet)
+    return Customer(user_id, name, db_email, db_password, wallet)
+
+
 class UserManager:
     def __init__(self, db: PostgresConnection):
         self.db = db
@@ -37,15 +54,13 @@ class UserManager:
     def register_user(self, name, email, password):
         try:
             # checking emial 
-            query = "SELECT * FROM users WHERE email = %s"
-            result = self.db.fetch_one(query, (email,))
+            result = self.db.fetch_one(EMAIL_EXISTS_SQL, (email,))
             if result:
                 db_logger.warning("Email already exists.")
                 return False
 
-            query = "INSERT INTO users (name, email, password, is_admin, wallet) VALUES (%s,%s,%s,%s,%s)"
-            success = self.db.execute_query(query, (name, email, password, False, 0))
-            self.db.commit()
+            with self.db.transaction():
+                success = self.db.execute_query(REGISTER_SQL, (name, email, password, False, 0))
             if success:
                 db_logger.info(f"User {name} registered successfully!")
                 return True
@@ -57,21 +72,11 @@ class UserManager:
 
     def login_user(self, email, password):
         try:
-            query = "SELECT user_id, name, email, password, wallet, is_admin FROM users WHERE email = %s"
-            result = self.db.fetch_one(query, (email,))
+            result = self.db.fetch_one(LOGIN_SQL, (email,))
             if not result:
                 db_logger.error("User not found")
                 return None
-
-            user_id, name, db_email, db_password, wallet, is_admin = result
-            if db_password != password:
-                db_logger.error("Wrong password")
-                return None
-
-            if is_admin:
-                return Admin(user_id, name, db_email, db_password, wallet)
-            else:
-                return Customer(user_id, name, db_email, db_password, wallet)
+            return user_from_row(result, password)
         except Exception:
             db_logger.exception("Login failed")
             return None
@@ -79,8 +84,8 @@ class UserManager:
     def delete_user(self, user_id):
         try:
             query = "DELETE FROM users WHERE user_id = %s AND is_admin = FALSE"
-            success = self.db.execute_query(query, (user_id,))
-            self.db.commit()
+            with self.db.transaction():
+                success = self.db.execute_query(query, (user_id,))
             db_logger.info("User successfully deleted")
             return success
         except Exception:
@@ -89,6 +94,7 @@ class UserManager:
             return False
 
     #Get users (admin only)
+    @replica_read
     def get_all_users(self):
         try:
             query = "SELECT user_id, name, email, wallet, is_admin FROM users WHERE is_admin=FALSE"
@@ -106,3 +112,28 @@ class UserManager:
         except Exception:
             db_logger.exception(f"Error fetching users")
             return []
+
+    @replica_read
+    def get_users_page(self, page_size=None, cursor=None):
+        try:
+            query = """
+                SELECT user_id, name, email, wallet FROM users
+                WHERE is_admin=FALSE {after}
+                ORDER BY user_id
+                LIMIT %s
+            """
+            rows, next_cursor = fetch_page(
+                self.db, "users", query, (), cursor, page_size,
+                "user_id > %s",
+                lambda row: (row[0],),
+            )
+            items = [
+                {"user_id": user_id, "name": name, "email": email, "wallet": float(wallet)}
+                for user_id, name, email, wallet in rows
+            ]
+            return {"items": items, "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception("Error fetching users page")
+            return {"items": [], "next_cursor": None}
@@ -1,118 +1,173 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from audit_log import AuditLogger
-from db_connect import db_logger
+from db_connect import db_logger, replica_read
+from pagination import InvalidCursor, fetch_page
+
+# Wallet result codes
+WALLET_OK = "OK"
+WALLET_USER_NOT_FOUND = "USER_NOT_FOUND"
+WALLET_INSUFFICIENT_FUNDS = "INSUFFICIENT_FUNDS"
+WALLET_INVALID_AMOUNT = "INVALID_AMOUNT"
+WALLET_ERROR = "ERROR"
+
+WALLET_MESSAGES = {
+    WALLET_USER_NOT_FOUND: "User not found",
+    WALLET_INSUFFICIENT_FUNDS: "Insufficient wallet balance.",
+    WALLET_INVALID_AMOUNT: "Amount must be positive.",
+    WALLET_ERROR: "Wallet update failed.",
+}
+
+CENT = Decimal("0.01")
+
+# Conditional debit plus its ledger row. The balance check happens inside the UPDATE,
+# so no row lock is held across round trips; {condition} lets a larger statement
+# (ticket.PURCHASE_QUERY) make the debit depend on its other steps.
+DEBIT_SQL = """
+    debit AS (
+        UPDATE users SET wallet = wallet - %(amount)s
+        WHERE user_id = %(user_id)s AND wallet >= %(amount)s{condition}
+        RETURNING wallet
+    ),
+    ledger AS (
+        INSERT INTO transactions (user_id, type, amount)
+        SELECT %(user_id)s, %(type)s, -(%(amount)s) FROM debit
+    )
+"""
+
+CREDIT_SQL = """
+    credit AS (
+        UPDATE users SET wallet = wallet + %(amount)s
+        WHERE user_id = %(user_id)s
+        RETURNING wallet
+    ),
+    ledger AS (
+        INSERT INTO transactions (user_id, type, amount)
+        SELECT %(user_id)s, %(type)s, %(amount)s FROM credit
+    )
+"""
+
+DEBIT_QUERY = "WITH " + DEBIT_SQL.format(condition="") + """
+    SELECT EXISTS (SELECT 1 FROM debit), (SELECT wallet FROM debit),
+           EXISTS (SELECT 1 FROM users WHERE user_id = %(user_id)s)
+"""
+CREDIT_QUERY = "WITH " + CREDIT_SQL + "SELECT wallet FROM credit"
+
+BALANCE_SQL = "SELECT wallet FROM users WHERE user_id = %s;"
+
+# timestamp is the partition key: the plain bounds prune partitions, the row comparison orders
+TRANSACTIONS_SINCE = " AND timestamp >= COALESCE(%s, '-infinity'::timestamp)"
+TRANSACTIONS_PAGE_SQL = (
+    "SELECT transaction_id, type, amount, timestamp FROM transactions "
+    "WHERE user_id = %s" + TRANSACTIONS_SINCE + " {after} ORDER BY timestamp DESC, transaction_id DESC LIMIT %s;"
+)
+TRANSACTIONS_KEYSET = (
+    "timestamp <= {0} AND (timestamp, transaction_id) < ({0}, {1})",
+    lambda row: (row[3], row[0]),
+)
+
+
+def to_amount(value):
+    """Positive money amount as a Decimal rounded to cents; ValueError otherwise"""
+    try:
+        amount = Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"Invalid amount: {value!r}")
+    if amount <= 0:
+        raise ValueError("Amount must be positive.")
+    return amount
+
 
 class WalletManager:
+    WALLET_MODE = "column"
+
+    # Statement fragments shared with ticket.PURCHASE_QUERY
+    DEBIT_SQL = DEBIT_SQL
+    DEBIT_QUERY = DEBIT_QUERY
+    CREDIT_QUERY = CREDIT_QUERY
+    BALANCE_SQL = BALANCE_SQL
+
     def __init__(self, db):
         self.db = db
         self.audit = AuditLogger(db)
 
-    def add_balance(self, user_id: int, amount: float, type: str = "Wallet deposit") -> bool:
-        if amount <= 0:
-            db_logger.error("Amount must be positive.")
-            return False
-
+    # --- Single-statement wallet updates ---
+    def debit(self, user_id, amount, type="Ticket purchase"):
+        """Take amount from the wallet if it covers it; {"status", "balance"}"""
         try:
-            # update wallet
-            if not self.db.execute_query(
-                "UPDATE users SET wallet = wallet + %s WHERE user_id = %s;",
-                (amount, user_id)
-            ):
-                self.db.rollback()
-                db_logger.error("Failed to update wallet.")
-                return False
-
-            # insert transaction
-            self.db.execute_query(
-                "INSERT INTO transactions (user_id, type, amount) VALUES (%s, %s, %s);",
-                (user_id, type, amount)
-            )
-
-            self.db.commit()
-            self.audit.log(user_id, f"Deposit: +{amount:.2f} ({type})")
-            db_logger.info(f"Added ${amount:.2f} to user {user_id} wallet.")
-            return True
+            amount = to_amount(amount)
+        except ValueError:
+            return {"status": WALLET_INVALID_AMOUNT, "balance": None}
+        try:
+            with self.db.transaction():
+                row = self.db.fetch_one(self.DEBIT_QUERY, {"user_id": user_id, "amount": amount, "type": type})
+                if not row:
+                    return {"status": WALLET_ERROR, "balance": None}
+                debited, balance, user_exists = row
+                if not debited:
+                    return {"status": WALLET_INSUFFICIENT_FUNDS if user_exists else WALLET_USER_NOT_FOUND, "balance": None}
+                self.audit.log(user_id, f"Purchase: -{amount:.2f} ({type})")
+            return {"status": WALLET_OK, "balance": balance}
         except Exception:
-            try:
-                self.db.rollback()
-            except Exception:
-                pass
-            db_logger.exception(f"Error adding balance for user {user_id}")
-            return False
-
-    def deduct_balance(self, user_id: int, amount: float, type: str = "Ticket purchase") -> bool:
-        if amount <= 0:
-            db_logger.error("Invalid amount.")
-            return False
+            db_logger.exception(f"Error deducting balance for user {user_id}")
+            return {"status": WALLET_ERROR, "balance": None}
 
+    def credit(self, user_id, amount, type="Wallet deposit", action="Deposit"):
         try:
-            # Lock wallet
-            row = self.db.fetch_one("SELECT wallet FROM users WHERE user_id = %s FOR UPDATE;", (user_id,))
-            if not row:
-                db_logger.error("User not found")
-                return False
-
-            wallet_balance = float(row[0])
-            if wallet_balance < amount:
-                db_logger.error("Insufficient wallet balance.")
-                return False
-
-            # deduct balance
-            if not self.db.execute_query("UPDATE users SET wallet = wallet - %s WHERE user_id = %s;", (amount, user_id)):
-                db_logger.error("Failed to deduct wallet.")
-                return False
-
-            # transaction log
-            self.db.execute_query(
-                "INSERT INTO transactions (user_id, type, amount) VALUES (%s, %s, %s);",
-                (user_id, type, -abs(amount))
-            )
-
-            self.audit.log(user_id, f"Purchase: -{amount:.2f} ({type})")
-            db_logger.info(f"Deducted ${amount:.2f} from user {user_id} wallet.")
-            return True
+            amount = to_amount(amount)
+        except ValueError:
+            return {"status": WALLET_INVALID_AMOUNT, "balance": None}
+        try:
+            with self.db.transaction():
+                row = self.db.fetch_one(self.CREDIT_QUERY, {"user_id": user_id, "amount": amount, "type": type})
+                if not row:
+                    return {"status": WALLET_USER_NOT_FOUND, "balance": None}
+                self.audit.log(user_id, f"{action}: +{amount:.2f} ({type})")
+            return {"status": WALLET_OK, "balance": row[0]}
         except Exception:
-            db_logger.exception(f"Error deducting balance for user {user_id}")
-            return False
+            db_logger.exception(f"Error crediting balance for user {user_id}")
+            return {"status": WALLET_ERROR, "balance": None}
+
+    def make_room(self, user_id, amount):
+        """Rearrange funds so a single conditional debit of amount can succeed; nothing to do for one row"""
+        return False
 
-    def refund_balance(self, user_id: int, amount: float, type: str = "Ticket refund") -> bool:
-        if amount <= 0:
-            db_logger.error("Invalid refund amount.")
+    @staticmethod
+    def _succeeded(result, message, amount, user_id):
+        if result["status"] != WALLET_OK:
+            db_logger.error(WALLET_MESSAGES[result["status"]])
             return False
+        db_logger.info(message.format(amount=to_amount(amount), user_id=user_id))
+        return True
 
-        try:
-            # refund
-            if not self.db.execute_query("UPDATE users SET wallet = wallet + %s WHERE user_id = %s;", (amount, user_id)):
-                db_logger.error("Failed to update wallet for refund.")
-                return False
-            
-            #log into trasnaction
-            self.db.execute_query(
-                "INSERT INTO transactions (user_id, type, amount) VALUES (%s, %s, %s);",
-                (user_id, type, amount)
-            )
+    def add_balance(self, user_id: int, amount, type: str = "Wallet deposit") -> bool:
+        result = self.credit(user_id, amount, type, "Deposit")
+        return self._succeeded(result, "Added ${amount:.2f} to user {user_id} wallet.", amount, user_id)
 
-            self.audit.log(user_id, f"Refund: +{amount:.2f} ({type})")
-            db_logger.info(f"Refunded ${amount:.2f} to user {user_id}.")
-            return True
-        except Exception:
-            db_logger.exception(f"Error refunding balance for user {user_id}")
-            return False
+    def deduct_balance(self, user_id: int, amount, type: str = "Ticket purchase") -> bool:
+        result = self.debit(user_id, amount, type)
+        return self._succeeded(result, "Deducted ${amount:.2f} from user {user_id} wallet.", amount, user_id)
+
+    def refund_balance(self, user_id: int, amount, type: str = "Ticket refund") -> bool:
+        result = self.credit(user_id, amount, type, "Refund")
+        return self._succeeded(result, "Refunded ${amount:.2f} to user {user_id}.", amount, user_id)
 
+    @replica_read
     def get_balance(self, user_id: int) -> float:
         """بازگشت موجودی فعلی کیف پول"""
         try:
-            row = self.db.fetch_one("SELECT wallet FROM users WHERE user_id = %s;", (user_id,))
+            row = self.db.fetch_one(BALANCE_SQL, (user_id,))
             return float(row[0]) if row and row[0] is not None else 0.0
         except Exception:
             db_logger.exception(f"Error fetching balance for user {user_id}")
             return 0.0
 
-    def show_transactions(self, user_id: int, limit: int = 50):
+    @replica_read
+    def show_transactions(self, user_id: int, limit: int = 50, since=None):
         try:
             rows = self.db.fetch_all(
                 "SELECT transaction_id, type, amount, timestamp FROM transactions "
-                "WHERE user_id = %s ORDER BY timestamp DESC LIMIT %s;",
-                (user_id, limit)
+                "WHERE user_id = %s" + TRANSACTIONS_SINCE + " ORDER BY timestamp DESC LIMIT %s;",
+                (user_id, since, limit)
             )
 
             if not rows:
@@ -135,3 +190,20 @@ class WalletManager:
         except Exception:
             db_logger.exception(f"Error showing transactions for user {user_id}")
             return []
+
+    @replica_read
+    def get_transactions_page(self, user_id: int, page_size: int = None, cursor: str = None, since=None) -> dict:
+        try:
+            rows, next_cursor = fetch_page(
+                self.db, "transactions", TRANSACTIONS_PAGE_SQL, (user_id, since), cursor, page_size, *TRANSACTIONS_KEYSET
+            )
+            items = [
+                {"transaction_id": t_id, "type": t_type, "amount": float(amount), "timestamp": created}
+                for t_id, t_type, amount, created in rows
+            ]
+            return {"items": items, "next_cursor": next_cursor}
+        except InvalidCursor:
+            raise
+        except Exception:
+            db_logger.exception(f"Error fetching transactions page for user {user_id}")
+            return {"items": [], "next_cursor": None}
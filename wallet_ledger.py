@@ -0,0 +1,266 @@
+import os
+from decimal import Decimal, ROUND_DOWN
+from db_connect import db_logger, replica_read
+from wallet import CENT, WALLET_INSUFFICIENT_FUNDS, WALLET_OK, WalletManager, to_amount
+
+# "column" keeps users.wallet as the balance, "ledger" derives it from transactions
+WALLET_MODE = os.getenv("WALLET_MODE", "column")
+WALLET_MAX_SHARDS = int(os.getenv("WALLET_MAX_SHARDS", "64"))
+
+# Debit one shard that covers the amount; buyers of the same account skip shards
+# another transaction holds instead of queueing on one wallet row.
+LEDGER_DEBIT_SQL = """
+    debit AS (
+        UPDATE wallet_shards SET balance = balance - %(amount)s
+        WHERE (user_id, shard) = (
+            SELECT user_id, shard FROM wallet_shards
+            WHERE user_id = %(user_id)s AND balance >= %(amount)s{condition}
+            ORDER BY balance DESC
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING NULL::DECIMAL AS wallet, shard
+    ),
+    ledger AS (
+        INSERT INTO transactions (user_id, type, amount, shard)
+        SELECT %(user_id)s, %(type)s, -(%(amount)s), shard FROM debit
+    )
+"""
+
+# Credits land on a random shard of the account
+LEDGER_CREDIT_SQL = """
+    credit AS (
+        INSERT INTO wallet_shards (user_id, shard, balance)
+        SELECT user_id, floor(random() * wallet_shards)::SMALLINT, %(amount)s
+        FROM users WHERE user_id = %(user_id)s
+        FOR SHARE  -- waits for a running rebalance of this account
+        ON CONFLICT (user_id, shard) DO UPDATE SET balance = wallet_shards.balance + EXCLUDED.balance
+        RETURNING NULL::DECIMAL AS wallet, shard
+    ),
+    ledger AS (
+        INSERT INTO transactions (user_id, type, amount, shard)
+        SELECT %(user_id)s, %(type)s, %(amount)s, shard FROM credit
+    )
+"""
+
+# Ledger row t not yet folded into snapshot s (or there is no snapshot). A snapshot holds
+# the rows whose writing transaction (t.xact) ended before its horizon, the oldest one still
+# open when it was taken: ids are handed out before commit, so an id high-water mark would
+# skip rows of transactions that commit late with a lower id. Rows from before migration 6
+# (xact NULL) go by id; they were all settled when the first horizon snapshot folded them.
+PENDING_ROW_SQL = """(
+    t.xact >= COALESCE(s.horizon, '0'::xid8)
+    OR (t.xact IS NULL AND t.transaction_id > COALESCE(s.last_transaction_id, 0))
+)"""
+
+# snapshot + ledger rows it does not hold yet
+LEDGER_BALANCE_SQL = f"""
+    SELECT COALESCE(s.balance, 0) + COALESCE((
+               SELECT SUM(t.amount) FROM transactions t
+               WHERE t.user_id = u.user_id AND {PENDING_ROW_SQL}
+           ), 0)
+    FROM users u
+    LEFT JOIN wallet_snapshots s ON s.user_id = u.user_id
+    WHERE u.user_id = %s
+"""
+
+# Fold rows of finished transactions into the snapshots. Rows of transactions still open
+# stay pending whatever their id, and are folded by a later run once they end.
+SNAPSHOT_SQL = f"""
+    WITH horizon AS (SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xid)
+    INSERT INTO wallet_snapshots (user_id, balance, last_transaction_id, horizon, taken_at)
+    SELECT t.user_id, COALESCE(s.balance, 0) + SUM(t.amount),
+           GREATEST(MAX(t.transaction_id), s.last_transaction_id), GREATEST(h.xid, s.horizon), CURRENT_TIMESTAMP
+    FROM transactions t
+    CROSS JOIN horizon h
+    LEFT JOIN wallet_snapshots s ON s.user_id = t.user_id
+    WHERE {PENDING_ROW_SQL}
+      AND (t.xact IS NULL OR t.xact < h.xid)
+    GROUP BY t.user_id, s.balance, s.last_transaction_id, s.horizon, h.xid
+    ON CONFLICT (user_id) DO UPDATE
+    SET balance = EXCLUDED.balance,
+        last_transaction_id = EXCLUDED.last_transaction_id,
+        horizon = EXCLUDED.horizon,
+        taken_at = EXCLUDED.taken_at
+"""
+
+
+class LedgerWalletManager(WalletManager):
+    """Wallet whose truth is the transactions ledger; spendable funds are split over
+    per-account shards (users.wallet_shards) that are debited independently."""
+
+    WALLET_MODE = "ledger"
+
+    DEBIT_SQL = LEDGER_DEBIT_SQL
+    DEBIT_QUERY = "WITH " + LEDGER_DEBIT_SQL.format(condition="") + """
+        SELECT EXISTS (SELECT 1 FROM debit), NULL::DECIMAL,
+               EXISTS (SELECT 1 FROM users WHERE user_id = %(user_id)s)
+    """
+    CREDIT_QUERY = "WITH " + LEDGER_CREDIT_SQL + "SELECT wallet FROM credit"
+    BALANCE_SQL = LEDGER_BALANCE_SQL
+
+    def debit(self, user_id, amount, type="Ticket purchase"):
+        result = super().debit(user_id, amount, type)
+        if result["status"] == WALLET_INSUFFICIENT_FUNDS and self.make_room(user_id, amount):
+            result = super().debit(user_id, amount, type)
+        if result["status"] == WALLET_OK:
+            result["balance"] = self.get_balance_exact(user_id)
+        return result
+
+    def credit(self, user_id, amount, type="Wallet deposit", action="Deposit"):
+        result = super().credit(user_id, amount, type, action)
+        if result["status"] == WALLET_OK:
+            result["balance"] = self.get_balance_exact(user_id)
+        return result
+
+    # --- Balances ---
+    def get_balance_exact(self, user_id):
+        row = self.db.fetch_one(LEDGER_BALANCE_SQL, (user_id,))
+        return row[0] if row else Decimal("0.00")
+
+    @replica_read
+    def get_balance(self, user_id: int) -> float:
+        try:
+            return float(self.get_balance_exact(user_id))
+        except Exception:
+            db_logger.exception(f"Error fetching balance for user {user_id}")
+            return 0.0
+
+    def _lock_shards(self, user_id):
+        # fixed order so concurrent consolidations cannot deadlock
+        return self.db.fetch_all(
+            "SELECT shard, balance FROM wallet_shards WHERE user_id=%s ORDER BY shard FOR UPDATE",
+            (user_id,)
+        )
+
+    def _write_shards(self, user_id, balances):
+        self.db.cur.executemany(
+            """INSERT INTO wallet_shards (user_id, shard, balance) VALUES (%s, %s, %s)
+               ON CONFLICT (user_id, shard) DO UPDATE SET balance = EXCLUDED.balance""",
+            [(user_id, shard, balance) for shard, balance in balances.items()]
+        )
+
+    def make_room(self, user_id, amount):
+        """Move funds between this account's shards until one covers amount (slow path)"""
+        try:
+            amount = to_amount(amount)
+            with self.db.transaction():
+                shards = {shard: balance for shard, balance in self._lock_shards(user_id)}
+                if not shards or sum(shards.values()) < amount:
+                    return False
+                target = max(shards, key=shards.get)
+                if shards[target] >= amount:
+                    return True
+                need = amount - shards[target]
+                for shard in sorted(shards):
+                    if shard == target or not need:
+                        continue
+                    take = min(shards[shard], need)
+                    shards[shard] -= take
+                    shards[target] += take
+                    need -= take
+                self._write_shards(user_id, shards)
+            return True
+        except Exception:
+            db_logger.exception(f"Error consolidating wallet shards for user {user_id}")
+            return False
+
+    # --- Background maintenance ---
+    def rebalance(self, user_id, shard_count=None):
+        """Spread the ledger balance evenly over the account's shards and refresh users.wallet"""
+        try:
+            with self.db.transaction():
+                if shard_count is not None:
+                    shard_count = max(1, min(int(shard_count), WALLET_MAX_SHARDS))
+                    self.db.execute_query("UPDATE users SET wallet_shards=%s WHERE user_id=%s", (shard_count, user_id))
+                row = self.db.fetch_one("SELECT wallet_shards FROM users WHERE user_id=%s FOR NO KEY UPDATE", (user_id,))
+                if not row:
+                    return False
+                count = row[0]
+                self._lock_shards(user_id)
+                total = self.get_balance_exact(user_id)
+                if total < 0:
+                    db_logger.error(f"Ledger balance of user {user_id} is negative ({total}); not rebalancing")
+                    self.db.rollback()
+                    return False
+                share = (total / count).quantize(CENT, rounding=ROUND_DOWN)
+                balances = {shard: share for shard in range(count)}
+                balances[0] += total - share * count
+                self.db.execute_query("DELETE FROM wallet_shards WHERE user_id=%s AND shard >= %s", (user_id, count))
+                self._write_shards(user_id, balances)
+                self.db.execute_query("UPDATE users SET wallet=%s WHERE user_id=%s", (total, user_id))
+            return True
+        except Exception:
+            db_logger.exception(f"Error rebalancing wallet of user {user_id}")
+            return False
+
+    def reconcile(self, repair=False):
+        """Accounts whose shards no longer add up to the ledger balance; repair rebalances them.
+        users.wallet is not compared: in ledger mode only rebalance refreshes it, so it trails
+        every active account."""
+        try:
+            query = f"""
+                SELECT u.user_id,
+                       COALESCE((SELECT SUM(balance) FROM wallet_shards w WHERE w.user_id = u.user_id), 0) AS shards,
+                       COALESCE(s.balance, 0) + COALESCE((
+                           SELECT SUM(t.amount) FROM transactions t
+                           WHERE t.user_id = u.user_id AND {PENDING_ROW_SQL}
+                       ), 0) AS ledger
+                FROM users u
+                LEFT JOIN wallet_snapshots s ON s.user_id = u.user_id
+                ORDER BY u.user_id
+            """
+            drift = [
+                {"user_id": user_id, "shards": shards, "ledger": ledger}
+                for user_id, shards, ledger in self.db.fetch_all(query)
+                if shards != ledger
+            ]
+            if repair:
+                for d in drift:
+                    self.rebalance(d["user_id"])
+                if drift:
+                    db_logger.info(f"Rebalanced {len(drift)} wallets.")
+            return drift
+        except Exception:
+            db_logger.exception("Error reconciling wallets")
+            return []
+
+    def snapshot(self):
+        """Fold the ledger rows of finished transactions into wallet_snapshots; returns the number of accounts updated"""
+        try:
+            with self.db.transaction():
+                self.db.cur.execute(SNAPSHOT_SQL)
+                updated = self.db.cur.rowcount
+            db_logger.info(f"Wallet snapshots updated for {updated} accounts.")
+            return updated
+        except Exception:
+            db_logger.exception("Error taking wallet snapshots")
+            return 0
+
+    def adopt(self):
+        """Switch-over step: make the ledger agree with users.wallet and seed the shards"""
+        try:
+            with self.db.transaction():
+                self.db.execute_query("""
+                    INSERT INTO transactions (user_id, type, amount)
+                    SELECT u.user_id, 'Opening balance', u.wallet - COALESCE(l.total, 0)
+                    FROM users u
+                    LEFT JOIN (SELECT user_id, SUM(amount) AS total FROM transactions GROUP BY user_id) l
+                      ON l.user_id = u.user_id
+                    WHERE u.wallet IS DISTINCT FROM COALESCE(l.total, 0)
+                """)
+                self.db.execute_query("DELETE FROM wallet_snapshots")
+                users = [row[0] for row in self.db.fetch_all("SELECT user_id FROM users ORDER BY user_id")]
+                for user_id in users:
+                    self.rebalance(user_id)
+            db_logger.info(f"Ledger wallet adopted for {len(users)} accounts.")
+            return len(users)
+        except Exception:
+            db_logger.exception("Error adopting ledger wallets")
+            return 0
+
+
+def make_wallet_manager(db):
+    if WALLET_MODE == "ledger":
+        return LedgerWalletManager(db)
+    return WalletManager(db)